@@ -0,0 +1,98 @@
+'''blockMeshDict generation from the model JSON against the array backed BlockModel.
+
+    python benchmarks/bench_blockmodel.py [--blocks 50000] [--patches 512]
+
+Reports the time to render a synthetic model (see synthetic.py) through
+the JSON dicts and through BlockModel, the time to apply a one vertex
+delta and re-render, and the memory the decoded model takes either way.
+'''
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+import toDICT
+from toDICT import ToMeshDICT, MeshJSON
+from blockModel import BlockModel
+from synthetic import mesh_json
+
+
+def timed(fn, *args, repeat=3):
+    best, res = None, None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            res = fn(*args)
+            dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return res, best
+
+
+def retained(fn, *args):
+    '''(result, bytes still allocated once fn returned, peak bytes during it).'''
+    tracemalloc.start()
+    try:
+        res = fn(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return res, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=50000)
+    parser.add_argument('--patches', type=int, default=512)
+    args = parser.parse_args()
+
+    text = mesh_json(args.blocks, args.patches)
+    print(f'model: {args.blocks} blocks, {args.patches} patches, {len(text) / 1e6:.1f} MB JSON')
+
+    def render_dicts():
+        toDICT._sectionCache.pop('dicts', None)
+        return ToMeshDICT(MeshJSON(text), 'dicts').res
+
+    def render_model():
+        toDICT._sectionCache.pop('model', None)
+        return ToMeshDICT(BlockModel.from_json(text), 'model').res
+
+    res, dt = timed(render_dicts)
+    print(f'JSON dicts:        {dt * 1e3:8.1f} ms  ({len(res) / 1e6:.1f} MB blockMeshDict)')
+    _, dt = timed(render_model)
+    print(f'BlockModel:        {dt * 1e3:8.1f} ms  (decode + arrays + render)')
+
+    model = BlockModel.from_json(text, 0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ToMeshDICT(model, 'delta')
+    step = iter(range(1, 100))
+
+    def delta():
+        v = next(step)
+        model.apply({"base": v - 1, "version": v, "vertices": {"0": {"xyz": [v * 1e-3, 0, 0]}}})
+        return ToMeshDICT(model, 'delta').res
+    _, dt = timed(delta)
+    print(f'delta + render:    {dt * 1e3:8.1f} ms  (one vertex moved)')
+
+    def review_dicts():
+        # the same edit without deltas: the full JSON again, unchanged sections come from the cache
+        return ToMeshDICT(MeshJSON(text), 'dicts').res
+    _, dt = timed(review_dicts)
+    print(f'full JSON re-view: {dt * 1e3:8.1f} ms  (JSON decoded again, sections cached)')
+
+    obj, held, peak = retained(json.loads, text)
+    print(f'memory, dicts:      {held / 1e6:8.1f} MB held, {peak / 1e6:.1f} MB peak')
+    del obj
+    model, held, peak = retained(BlockModel.from_json, text)
+    print(f'memory, BlockModel: {held / 1e6:8.1f} MB held, {peak / 1e6:.1f} MB peak, '
+          f'{model.nbytes() / 1e6:.1f} MB in arrays')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''Size and latency of the compact surface payload against the ASCII VTK files.
+
+    python benchmarks/bench_payload.py [case_dir or .vtk files ...] [--mbps 100]
+
+Without arguments a synthetic patch grid is generated. Latency is the
+conversion time plus the time to push the bytes through a link of the
+given bandwidth.
+'''
+import os
+import sys
+import glob
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from polyMeshReader import vtk_polydata
+from surfacePayload import vtk_to_surface, decode_surface
+
+
+def synthetic_patch(n=400):
+    '''n x n quad grid on a wavy surface, like a blockMesh wall patch.'''
+    x, y = np.meshgrid(np.linspace(0, 1, n + 1), np.linspace(0, 1, n + 1))
+    z = 0.05 * np.sin(6 * x) * np.cos(4 * y)
+    points = np.column_stack([x.ravel(), y.ravel(), z.ravel()])
+    i, j = np.meshgrid(np.arange(n), np.arange(n))
+    v0 = (j * (n + 1) + i).ravel()
+    quads = np.column_stack([v0, v0 + 1, v0 + n + 2, v0 + n + 1])
+    offsets = np.arange(len(quads) + 1) * 4
+    return vtk_polydata('synthetic', points, offsets, quads.ravel()).encode()
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        res = fn(*args)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return res, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--mbps', type=float, default=100.0, help='link bandwidth in Mbit/s')
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        files += sorted(glob.glob(os.path.join(path, '*.vtk'))) if os.path.isdir(path) else [path]
+    samples = [(os.path.basename(f), open(f, 'rb').read()) for f in files] or \
+              [('synthetic-400x400', synthetic_patch())]
+
+    rate = args.mbps * 1e6 / 8
+    print(f'{"patch":24} {"format":13} {"bytes":>12} {"ratio":>7} {"encode ms":>10} {"latency ms":>11}')
+    for name, data in samples:
+        raw_latency = len(data) / rate * 1e3
+        print(f'{name:24} {"vtk":13} {len(data):12d} {1.0:7.2f} {0.0:10.1f} {raw_latency:11.1f}')
+        for fmt, compress in (('surface', False), ('surface+zlib', True)):
+            payload, dt = timed(vtk_to_surface, data, compress)
+            decode_surface(payload)
+            latency = dt * 1e3 + len(payload) / rate * 1e3
+            print(f'{name:24} {fmt:13} {len(payload):12d} {len(data) / len(payload):7.2f} '
+                  f'{dt * 1e3:10.1f} {latency:11.1f}')
+
+
+if __name__ == '__main__':
+    main()
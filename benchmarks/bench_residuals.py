@@ -0,0 +1,122 @@
+'''Throughput of the residual log parser on a synthetic solver log.
+
+    python benchmarks/bench_residuals.py [--size-mb 1024] [--log path] [--keep]
+
+The log imitates simpleFoam/pimpleFoam output with k-epsilon turbulence
+and an energy equation. The line-by-line regex parser the monitor op used
+before is timed on the first 64 MB for comparison.
+'''
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from residualLog import ResidualParser, parse_log_file
+
+STEP = '''Time = {t}
+
+smoothSolver:  Solving for Ux, Initial residual = {r0:.6g}, Final residual = {f:.6g}, No Iterations 3
+smoothSolver:  Solving for Uy, Initial residual = {r1:.6g}, Final residual = {f:.6g}, No Iterations 3
+smoothSolver:  Solving for Uz, Initial residual = {r2:.6g}, Final residual = {f:.6g}, No Iterations 3
+GAMG:  Solving for p, Initial residual = {r3:.6g}, Final residual = {f:.6g}, No Iterations 12
+time step continuity errors : sum local = {f:.6g}, global = {c:.6g}, cumulative = {c:.6g}
+GAMG:  Solving for p, Initial residual = {r4:.6g}, Final residual = {f:.6g}, No Iterations 8
+time step continuity errors : sum local = {f:.6g}, global = {c:.6g}, cumulative = {c:.6g}
+smoothSolver:  Solving for T, Initial residual = {r5:.6g}, Final residual = {f:.6g}, No Iterations 2
+smoothSolver:  Solving for epsilon, Initial residual = {r6:.6g}, Final residual = {f:.6g}, No Iterations 2
+bounding epsilon, min: -1.2e-05 max: 3.4 average: 0.02
+smoothSolver:  Solving for k, Initial residual = {r7:.6g}, Final residual = {f:.6g}, No Iterations 2
+ExecutionTime = {e:.2f} s  ClockTime = {e:.0f} s
+
+'''
+
+
+def write_log(path, size):
+    rng = np.random.default_rng(0)
+    step = 0
+    with open(path, 'w') as f:
+        while f.tell() < size:
+            lines = []
+            for _ in range(1000):
+                step += 1
+                r = 10 ** rng.uniform(-6, 0, 8)
+                lines.append(STEP.format(t=step, r0=r[0], r1=r[1], r2=r[2], r3=r[3], r4=r[4], r5=r[5],
+                                         r6=r[6], r7=r[7], f=r[0] * 1e-3, c=r[3] * 1e-9, e=step * 0.01))
+            f.write(''.join(lines))
+    return step
+
+
+def legacy_parse(path, limit):
+    '''The per-line parser from the monitor op, for comparison.'''
+    patterns = {
+        "Ux": re.compile(r"Solving for Ux, Initial residual = ([\d.eE+-]+)"),
+        "Uy": re.compile(r"Solving for Uy, Initial residual = ([\d.eE+-]+)"),
+        "Uz": re.compile(r"Solving for Uz, Initial residual = ([\d.eE+-]+)"),
+        "p": re.compile(r"Solving for p, Initial residual = ([\d.eE+-]+)"),
+        "continuity": re.compile(r"continuity errors : .* global = ([\d.eE+-]+)"),
+        "time": re.compile(r"^Time = ([\d.eE+-]+)")
+    }
+    residuals = {key: [] for key in patterns}
+    count = {key: 0 for key in patterns}
+    read = 0
+    with open(path, 'r') as file:
+        for line in file:
+            read += len(line)
+            if read > limit:
+                break
+            for key, pattern in patterns.items():
+                match = pattern.search(line)
+                if match:
+                    value_ = float(match.group(1))
+                    if key == "time":
+                        count = {ki: 0 for ki in patterns}
+                        logValue = value_
+                    else:
+                        logValue = np.log10(np.abs(value_)) * np.sign(value_)
+                    if count[key] == 0:
+                        residuals[key].append(logValue)
+                        count[key] += 1
+    return read
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=float, default=1024)
+    parser.add_argument('--log', help='existing log to parse instead of a synthetic one')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic log')
+    args = parser.parse_args()
+
+    path = args.log
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        t = time.perf_counter()
+        steps = write_log(path, int(args.size_mb * 1024 * 1024))
+        print(f'generated {steps} time steps in {time.perf_counter() - t:.1f}s: {path}')
+    size = os.path.getsize(path)
+
+    try:
+        t = time.perf_counter()
+        res = parse_log_file(path, ResidualParser())
+        res.finish()
+        residuals = res.flush()
+        dt = time.perf_counter() - t
+        print(f'ResidualParser: {size / 1e6:.0f} MB in {dt:.2f}s, {size / 1e6 / dt:.0f} MB/s, '
+              f'{len(residuals["time"])} steps, fields {res.fields}')
+
+        limit = min(size, 64 * 1024 * 1024)
+        t = time.perf_counter()
+        read = legacy_parse(path, limit)
+        dt = time.perf_counter() - t
+        print(f'line parser:    {read / 1e6:.0f} MB in {dt:.2f}s, {read / 1e6 / dt:.0f} MB/s')
+    finally:
+        if args.log is None and not args.keep:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
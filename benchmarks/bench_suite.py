@@ -0,0 +1,301 @@
+'''Benchmark suite with regression check against stored baselines.
+
+    python benchmarks/bench_suite.py [--sizes small,medium,large] [--filter name]
+                                     [--log-mb 64] [--check] [--tolerance 1.5] [--noise-ms 1]
+                                     [--update]
+
+Times the blockMeshDict writer, the block preview, the boundary condition
+writer, the case materializer, the boundary file parser, the residual log parser and protocol 2 patch streaming to a
+local fake client, on synthetic cases from synthetic.py. Everything runs
+offline in a temporary directory.
+
+--update stores the results in baselines.json next to this file. --check
+compares against it and exits with status 1 when a benchmark got slower
+than tolerance times its baseline. Times are compared relative to a fixed
+calibration workload timed in the same run, so baselines taken on another
+machine still give a usable verdict (--raw compares plain seconds). A
+benchmark less than --noise-ms slower than its baseline passes whatever the
+ratio: sub millisecond runs jitter by more than the tolerance.
+'''
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import itertools
+import contextlib
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+import toDICT
+from toDICT import ToMeshDICT, ToBoundary, MeshJSON, render_mesh_dict
+from blockPreview import mesh_preview
+from caseMaterializer import materialize
+from residualLog import ResidualParser, parse_log_file
+from patchStream import PatchStreamer, parse_frame
+from openfoamOps import parse_boundary_file
+from workerPool import shutdown_workers
+from bench_payload import synthetic_patch
+from synthetic import MESH_SIZES, BOUNDARY_SIZES, mesh_json, write_boundary, bc_list, write_log
+
+BASELINES = os.path.join(HERE, 'baselines.json')
+# Patch grid sizes streamed to the fake client (n x n quads)
+PATCH_SIZES = {"small": 50, "medium": 200, "large": 600}
+
+
+def timed(fn, *args, repeat=3):
+    '''Best wall time of repeat calls; the code's own progress prints are swallowed.'''
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            fn(*args)
+            dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def calibrate():
+    '''Fixed mixed Python/NumPy workload, the unit times are compared in.'''
+    values = np.random.default_rng(0).uniform(size=200000)
+
+    def work():
+        text = json.dumps(values[:50000].tolist())
+        json.loads(text)
+        np.sort(values)
+        sum(i * i for i in range(200000))
+    return timed(work, repeat=5)
+
+
+class FakeClient:
+    '''Websocket stand-in reassembling protocol 2 transfers like the client does.'''
+    def __init__(self):
+        self.announced = {}
+        self.received = {}
+        self.frames = 0
+
+    async def send(self, message):
+        if isinstance(message, str):
+            message = json.loads(message)
+            self.announced[message["id"]] = message
+            self.received[message["id"]] = bytearray()
+            return
+        header, payload = parse_frame(message)
+        self.received[header["id"]][header["offset"]:header["offset"] + header["length"]] = payload
+        self.frames += 1
+
+    def verify(self):
+        for transferId, message in self.announced.items():
+            data = self.received[transferId]
+            if len(data) != message["size"]:
+                raise AssertionError(f'{message["name"]}: got {len(data)} of {message["size"]} bytes')
+
+
+def bench_mesh_dict(tmp, size):
+    blocks, patches = MESH_SIZES[size]
+    text = mesh_json(blocks, patches)
+    fileName = os.path.join(tmp, f'blockMeshDict.{size}')
+
+    def render():
+        toDICT._sectionCache.pop(fileName, None)
+        ToMeshDICT(MeshJSON(text), fileName).write()
+
+    results = {f'ToMeshDICT/{size}': (timed(render), 1, 'run')}
+
+    # client edit: one vertex moved and the whole model sent again (the
+    # view's path), only the vertices section is rendered again
+    model = json.loads(text)
+    edits = []
+    for n in range(3):
+        model["vertices"][0]["xyz"][0] = n * 1e-3
+        edits.append(json.dumps(model))
+    step = itertools.cycle(edits)
+    with contextlib.redirect_stdout(io.StringIO()):
+        # the worker holds the model of the first view
+        render_mesh_dict(text, fileName)
+        results[f'ToMeshDICT-edit/{size}'] = (timed(lambda: render_mesh_dict(next(step), fileName), repeat=7),
+                                              1, 'run')
+    return results
+
+
+def bench_preview(tmp, size):
+    blocks, patches = MESH_SIZES[size]
+    fileName = os.path.join(tmp, f'preview.{size}')
+    with contextlib.redirect_stdout(io.StringIO()):
+        render_mesh_dict(mesh_json(blocks, patches), fileName)
+    return {f'mesh_preview/{size}': (timed(mesh_preview, fileName), 1, 'run')}
+
+
+def bench_bc_file(tmp, size):
+    bcs = bc_list(BOUNDARY_SIZES[size])
+    path = os.path.join(tmp, f'U.{size}')
+
+    def generate():
+        ToBoundary(path).genBCFile('volVectorField', 'U', [0, 1, -1, 0, 0, 0, 0], 'uniform', [0, 0, 0], bcs)
+    return {f'ToBoundary.genBCFile/{size}': (timed(generate), 1, 'run')}
+
+
+def bench_materialize(tmp, size):
+    patches = BOUNDARY_SIZES[size]
+    case_dir = os.path.join(tmp, f'case.{size}')
+    bcs = bc_list(patches)
+    spec = {"control": {"application": "simpleFoam"}, "patches": [bc[0] for bc in bcs],
+            "fields": {name: {"class": "volScalarField", "internalField": "uniform 0", "boundaryField": bcs}
+                       for name in ("p", "k", "epsilon", "nut")}}
+    spec["fields"]["U"] = {"class": "volVectorField", "internalField": ["uniform", [0, 0, 0]], "boundaryField": bcs}
+    # the first run writes every file, the timed ones find them all unchanged
+    with contextlib.redirect_stdout(io.StringIO()):
+        materialize(case_dir, spec)
+    return {f'materialize/{size}': (timed(materialize, case_dir, spec), 1, 'run')}
+
+
+def bench_boundary(tmp, size):
+    path = write_boundary(os.path.join(tmp, size, 'constant', 'polyMesh', 'boundary'), BOUNDARY_SIZES[size])
+    stamp = [time.time_ns()]
+
+    def parse():
+        # a new mtime every call, so the parsed file cache never answers
+        stamp[0] += 1000000
+        os.utime(path, ns=(stamp[0], stamp[0]))
+        boundaries = asyncio.run(parse_boundary_file(path))
+        if len(boundaries) != BOUNDARY_SIZES[size]:
+            raise AssertionError(f'parsed {len(boundaries)} patches')
+
+    timed(parse, repeat=1)  # starts the case worker
+    return {f'parse_boundary_file/{size}': (timed(parse), 1, 'run')}
+
+
+def bench_log(tmp, sizeMb):
+    path = os.path.join(tmp, 'log.run')
+    if not os.path.exists(path):
+        write_log(path, int(sizeMb * 1024 * 1024))
+    mb = os.path.getsize(path) / (1024 * 1024)
+
+    def parse():
+        parser = parse_log_file(path, ResidualParser())
+        parser.finish()
+        parser.take()
+    return {'ResidualParser': (timed(parse), mb, 'MB')}
+
+
+def bench_stream(tmp, size):
+    path = os.path.join(tmp, f'patch.{size}.vtk')
+    with open(path, 'wb') as f:
+        f.write(synthetic_patch(PATCH_SIZES[size]))
+    mb = os.path.getsize(path) / (1024 * 1024)
+    results = {}
+    for fmt in ('vtk', 'surface'):
+        def stream():
+            async def run():
+                client = FakeClient()
+                sender = PatchStreamer(client, fmt)
+                for p in range(4):
+                    await sender.send(f'patch{p}', path)
+                await sender.close()
+                client.verify()
+            asyncio.run(run())
+        results[f'PatchStreamer-{fmt}/{size}'] = (timed(stream), mb, 'MB')
+    return results
+
+
+def run_suite(sizes, logMb, only=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        benches = []
+        for size in sizes:
+            benches += [(f'ToMeshDICT/{size}', bench_mesh_dict, size),
+                        (f'mesh_preview/{size}', bench_preview, size),
+                        (f'ToBoundary.genBCFile/{size}', bench_bc_file, size),
+                        (f'materialize/{size}', bench_materialize, size),
+                        (f'parse_boundary_file/{size}', bench_boundary, size),
+                        (f'PatchStreamer/{size}', bench_stream, size)]
+        benches.append(('ResidualParser', bench_log, logMb))
+        for name, bench, arg in benches:
+            if only and only not in name:
+                continue
+            for key, result in bench(tmp, arg).items():
+                results[key] = result
+                seconds, scale, unit = result
+                per = f'{seconds / scale * 1e3:9.1f} ms/{unit}' if unit != 'run' else ''
+                print(f'{key:32} {seconds * 1e3:10.1f} ms {per}')
+    shutdown_workers()
+    return results
+
+
+def check(results, calibration, baselines, tolerance, raw=False, noise=1e-3):
+    '''Compare per unit times with the baselines, return the names that regressed.'''
+    failed = []
+    print(f'\n{"benchmark":32} {"now":>10} {"baseline":>10} {"ratio":>7}')
+    for name, (seconds, units, unit) in results.items():
+        base = baselines["results"].get(name)
+        if base is None:
+            print(f'{name:32} {seconds / units * 1e3:10.1f} {"-":>10} {"-":>7} new')
+            continue
+        expected = base["seconds"] / base["scale"] * (1.0 if raw else calibration / base["calibration"])
+        ratio = seconds / units / expected
+        # noise is per run, whatever its units
+        regressed = ratio > tolerance and seconds - expected * units > noise
+        status = 'REGRESSION' if regressed else 'ok'
+        if regressed:
+            failed.append(name)
+        print(f'{name:32} {seconds / units * 1e3:10.1f} {expected * 1e3:10.1f} {ratio:7.2f} {status}')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='small,medium,large')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--log-mb', type=float, default=64, help='synthetic solver log size, e.g. 4096')
+    parser.add_argument('--check', action='store_true', help='fail on regressions against the baselines')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown factor')
+    parser.add_argument('--raw', action='store_true', help='compare seconds, not calibrated times')
+    parser.add_argument('--noise-ms', type=float, default=1.0, help='slowdowns below this always pass')
+    parser.add_argument('--update', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--baselines', default=BASELINES)
+    args = parser.parse_args()
+
+    sizes = [size for size in args.sizes.split(',') if size]
+    for size in sizes:
+        if size not in MESH_SIZES:
+            parser.error(f'unknown size {size}, one of {list(MESH_SIZES)}')
+
+    calibration = calibrate()
+    print(f'calibration: {calibration * 1e3:.1f} ms\n')
+    results = run_suite(sizes, args.log_mb, args.filter)
+
+    if args.update:
+        baselines = {"results": {}}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        baselines["machine"] = f'{platform.machine()} {platform.python_implementation()} {platform.python_version()}'
+        for name, (seconds, scale, unit) in results.items():
+            # calibration per entry: a partial update keeps the other entries valid
+            baselines["results"][name] = {"seconds": round(seconds, 6), "scale": round(scale, 3), "unit": unit,
+                                          "calibration": round(calibration, 6)}
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'\nbaselines written to {args.baselines}')
+
+    if args.check:
+        if not os.path.exists(args.baselines):
+            sys.exit(f'no baselines at {args.baselines}, run with --update first')
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+        failed = check(results, calibration, baselines, args.tolerance, args.raw, args.noise_ms * 1e-3)
+        if failed:
+            print(f'\n{len(failed)} regression(s): {", ".join(failed)}')
+            sys.exit(1)
+        print('\nno regressions')
+
+
+if __name__ == '__main__':
+    main()
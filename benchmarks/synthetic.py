@@ -0,0 +1,152 @@
+'''Synthetic cases for the benchmarks.
+
+    python benchmarks/synthetic.py out_dir [--blocks 1000] [--patches 64] [--log-mb 0]
+
+Writes mesh.json (the client's blockMesh model), constant/polyMesh/boundary
+and, with --log-mb, a solver log of that size into out_dir.
+'''
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_residuals import write_log
+
+# Mesh model sizes used by the suite: (blocks, boundary patches)
+MESH_SIZES = {"small": (10, 6), "medium": (1000, 64), "large": (50000, 512)}
+# Boundary file sizes: patches
+BOUNDARY_SIZES = {"small": 10, "medium": 500, "large": 5000}
+
+# Faces of a hex block as positions in its vertex list, by side
+SIDES = {"xmin": (0, 4, 7, 3), "xmax": (1, 2, 6, 5), "ymin": (0, 1, 5, 4),
+         "ymax": (3, 7, 6, 2), "zmin": (0, 3, 2, 1), "zmax": (4, 5, 6, 7)}
+# Multi-section grading of one block direction: (cell fraction, length fraction, ratio)
+GRADED = [[0.3, 0.2, 4], [0.4, 0.6, 1], [0.3, 0.2, 0.25]]
+
+
+def block_grid(blocks):
+    '''Smallest nx * ny * nz grid holding the given number of blocks.'''
+    n = max(int(round(blocks ** (1 / 3))), 1)
+    nx = ny = n
+    nz = -(-blocks // (nx * ny))
+    return nx, ny, nz
+
+
+def mesh_model(blocks=1000, patches=64, seed=0):
+    '''A blockMesh model in the client's JSON layout.
+
+    Blocks fill a slightly distorted grid, every other block has graded
+    directions, every tenth an arc or spline edge, and the outside faces
+    are split into the given number of patches.
+    '''
+    rng = np.random.default_rng(seed)
+    nx, ny, nz = block_grid(blocks)
+    i, j, k = np.meshgrid(np.arange(nx + 1), np.arange(ny + 1), np.arange(nz + 1), indexing='ij')
+    xyz = np.column_stack([i.ravel(), j.ravel(), k.ravel()]).astype(np.float64) * 0.1
+    xyz += rng.uniform(-0.01, 0.01, xyz.shape)
+    vertices = [{"xyz": [round(v, 6) for v in p]} for p in xyz.tolist()]
+
+    def vertex(a, b, c):
+        return (a * (ny + 1) + b) * (nz + 1) + c
+
+    hexes, sides, edges = [], [], []
+    for n in range(blocks):
+        a, rest = divmod(n, ny * nz)
+        b, c = divmod(rest, nz)
+        hexes.append([vertex(a, b, c), vertex(a + 1, b, c), vertex(a + 1, b + 1, c), vertex(a, b + 1, c),
+                      vertex(a, b, c + 1), vertex(a + 1, b, c + 1), vertex(a + 1, b + 1, c + 1),
+                      vertex(a, b + 1, c + 1)])
+        for side, outside in (("xmin", a == 0), ("xmax", a == nx - 1), ("ymin", b == 0),
+                              ("ymax", b == ny - 1), ("zmin", c == 0), ("zmax", c == nz - 1)):
+            if outside:
+                sides.append([hexes[-1][v] for v in SIDES[side]])
+        if n % 10 == 0:
+            v0, v1 = hexes[-1][0], hexes[-1][1]
+            mid = ((xyz[v0] + xyz[v1]) / 2 + [0, 0.005, 0]).round(6).tolist()
+            if n % 20 == 0:
+                edges.append({"type": "arc", "vertices": [v0, v1], "points": [mid]})
+            else:
+                quarter = ((3 * xyz[v0] + xyz[v1]) / 4).round(6).tolist()
+                edges.append({"type": "spline", "vertices": [v0, v1], "points": [quarter, mid]})
+
+    model_blocks = []
+    for n, hexVertices in enumerate(hexes):
+        cells = [int(c) for c in rng.integers(4, 20, 3)]
+        if n % 2:
+            grading = [GRADED, [[1]], GRADED]
+        else:
+            grading = [[[round(float(r), 3)]] for r in rng.uniform(0.5, 2, 3)]
+        model_blocks.append({"hex": hexVertices, "number": cells, "grading": grading})
+
+    boundaries = []
+    for p, faces in enumerate(np.array_split(np.arange(len(sides)), patches)):
+        boundaries.append({"name": f"patch{p}", "type": "wall" if p % 3 else "patch",
+                           "faces": [sides[f] for f in faces]})
+
+    return {"prescale": [1, 1, 1], "transform": {}, "geometry": [], "vertices": vertices,
+            "blocks": model_blocks, "edges": edges, "faces": [],
+            "defaultPatch": {"name": "defaultFaces", "type": "wall"}, "boundaries": boundaries}
+
+
+def mesh_json(blocks=1000, patches=64, seed=0):
+    return json.dumps(mesh_model(blocks, patches, seed))
+
+
+def boundary_text(patches=500, facesPerPatch=2000):
+    '''A constant/polyMesh/boundary file with the given number of patches.'''
+    types = ("wall", "patch", "symmetryPlane", "empty")
+    lines = ['FoamFile\n{\n    version     2.0;\n    format      ascii;\n    class       polyBoundaryMesh;\n'
+             '    location    "constant/polyMesh";\n    object      boundary;\n}\n\n', f'{patches}\n(\n']
+    start = 1000000
+    for p in range(patches):
+        kind = types[p % len(types)]
+        lines.append(f'    patch{p}\n    {{\n        type            {kind};\n'
+                     f'        inGroups        List<word> 1({kind});\n'
+                     f'        nFaces          {facesPerPatch};\n        startFace       {start};\n    }}\n')
+        start += facesPerPatch
+    lines.append(')\n\n// ************************************************************************* //\n')
+    return ''.join(lines)
+
+
+def write_boundary(path, patches=500, facesPerPatch=2000):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(boundary_text(patches, facesPerPatch))
+    return path
+
+
+def bc_list(patches=500):
+    '''Boundary conditions of a velocity field for ToBoundary.genBCFile.'''
+    bcs = []
+    for p in range(patches):
+        if p % 3 == 0:
+            bcs.append([f"patch{p}", "fixedValue", {"value": "uniform", "data": [1, 0, 0]}])
+        elif p % 3 == 1:
+            bcs.append([f"patch{p}", "zeroGradient"])
+        else:
+            bcs.append([f"patch{p}", "noSlip"])
+    return bcs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir')
+    parser.add_argument('--blocks', type=int, default=1000)
+    parser.add_argument('--patches', type=int, default=64)
+    parser.add_argument('--log-mb', type=float, default=0, help='also write a solver log of this size')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, 'mesh.json'), 'w') as f:
+        f.write(mesh_json(args.blocks, args.patches))
+    write_boundary(os.path.join(args.out_dir, 'constant', 'polyMesh', 'boundary'), args.patches)
+    if args.log_mb:
+        steps = write_log(os.path.join(args.out_dir, 'log.run'), int(args.log_mb * 1024 * 1024))
+        print(f'log.run: {steps} time steps')
+    print(f'written to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
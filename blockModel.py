@@ -0,0 +1,310 @@
+import re
+import json
+import itertools
+import numpy as np
+
+# Array backed blockMesh model.
+#
+# The client's model JSON holds one dict per vertex and per block; walking
+# those and calling str() on every scalar dominates blockMeshDict generation
+# for big models. BlockModel keeps the bulky sections as arrays instead:
+#
+#   vertices    xyz (n, 3) float64, projections {vertex: [surfaces]}
+#   blocks      hex (m, 8) int32, cells (m, 3) int32, grading (m, 3)
+#               float64 ratios; blocks with multi section or edge grading
+#               keep their rendered grading text in gradingText and the
+#               grading itself, as nested tuples, in gradingSections
+#   edges       struct of arrays: types, ends (k, 2) int32, points (p, 3)
+#               float64 with pointOffsets (k + 1)
+#   boundaries  names, types, faces (f, 4) int32 with faceOffsets
+#
+# and renders them with one %-format call per section. The small sections
+# (prescale, transform, geometry, faces, defaultPatch) stay as they are in
+# obj. A model that does not fit the arrays (e.g. non quad boundary faces)
+# keeps that section in obj and ToMeshDICT renders it the old way.
+#
+# A delta from the client updates the model in place:
+#
+#   {"base": version it applies to, "version": new version,
+#    "vertices": {"12": {"xyz": [...]}}, "blocks": {"3": {"number": [...]}},
+#    "edges": [...], ...}
+#
+# An index -> entry dict changes (or, at the end, appends) single entries, a
+# list replaces the whole section.
+
+ARRAY_SECTIONS = ("vertices", "blocks", "edges", "boundaries")
+# what each section renders from (gradingSections is gradingText parsed)
+SECTION_FIELDS = {
+    "vertices": ("xyz", "projections"),
+    "blocks": ("hex", "cells", "grading", "gradingText"),
+    "edges": ("edgeTypes", "edgeEnds", "pointOffsets", "edgePoints"),
+    "boundaries": ("patchNames", "patchTypes", "faceOffsets", "faces"),
+}
+# Coordinates and ratios are written as repr() writes them, the shortest
+# text that reads back as the same double, with integral values losing
+# their ".0" as the client's JSON.stringify writes them
+_INTEGRAL = re.compile(r'\.0(?=[ )])')
+
+_ids = itertools.count()
+
+
+class ModelError(Exception):
+    pass
+
+
+def number(value):
+    text = repr(value)
+    return text[:-2] if text.endswith('.0') else text
+
+
+def numbers(text):
+    '''Text %r-formatted from floats, integral values without ".0".'''
+    return _INTEGRAL.sub('', text)
+
+
+def grading_text(grading):
+    '''The grading of one block as ToMeshDICT.genGrading writes it.'''
+    res_ = []
+    for j in grading:
+        if len(j) == 1:
+            res_.append(str(*j[0]))
+        else:
+            res_.append('(' + ' '.join(['(' + ' '.join([str(z[1]), str(z[0]), str(z[2])]) + ')' for z in j]) + ')')
+    return ' '.join(res_)
+
+
+class BlockModel:
+    def __init__(self, obj, version=None):
+        self.version = version
+        # ids are never reused (unlike id()), a new model never hits a stale cached section
+        self.uid = next(_ids)
+        # bumped per section on every change, ToMeshDICT re-renders a section when it moves
+        self.serial = {}
+        self.obj = {k: v for k, v in obj.items() if k not in ARRAY_SECTIONS}
+        for section in ARRAY_SECTIONS:
+            self.set_section(section, obj.get(section))
+
+    @classmethod
+    def from_json(cls, text, version=None):
+        return cls(json.loads(text), version)
+
+    def touch(self, section):
+        self.serial[section] = self.serial.get(section, 0) + 1
+
+    def fingerprint(self, section):
+        return (self.uid, section, self.serial.get(section, 0))
+
+    def same_section(self, other, section):
+        if section in self.obj or section in other.obj:
+            return False
+        for field in SECTION_FIELDS[section]:
+            mine, theirs = getattr(self, field), getattr(other, field)
+            if isinstance(mine, np.ndarray):
+                if mine.shape != theirs.shape or not np.array_equal(mine, theirs):
+                    return False
+            elif mine != theirs:
+                return False
+        return True
+
+    def succeed(self, previous):
+        '''Take over the uid and serials of the model this one replaces.
+
+        A full model sent again mostly repeats the previous one: sections
+        with the same arrays keep their fingerprint (and ToMeshDICT its
+        rendered text), the others move on.
+        '''
+        if previous is None:
+            return self
+        serial = dict(previous.serial)
+        for section in ARRAY_SECTIONS:
+            if not self.same_section(previous, section):
+                serial[section] = serial.get(section, 0) + 1
+        self.uid, self.serial = previous.uid, serial
+        return self
+
+    def set_section(self, section, data):
+        '''Replace a whole section; data that does not fit the arrays stays in obj.'''
+        self.touch(section)
+        self.obj.pop(section, None)
+        try:
+            getattr(self, f'_set_{section}')(data or [])
+        except (KeyError, TypeError, ValueError, IndexError):
+            self.obj[section] = data
+            getattr(self, f'_set_{section}')([])
+
+    def _set_vertices(self, vertices):
+        self.xyz = np.array([v["xyz"] for v in vertices], dtype=np.float64).reshape(-1, 3)
+        self.projections = {i: v["project"] for i, v in enumerate(vertices) if v.get("project")}
+
+    def _set_blocks(self, blocks):
+        self.hex = np.array([b["hex"] for b in blocks], dtype=np.int32).reshape(-1, 8)
+        self.cells = np.array([[int(j) for j in b["number"]] for b in blocks], dtype=np.int32).reshape(-1, 3)
+        self.grading = np.ones((len(blocks), 3), dtype=np.float64)
+        self.gradingText = {}
+        self.gradingSections = {}
+        # models repeat a handful of multi section gradings, render each once
+        texts = {}
+        for i, b in enumerate(blocks):
+            self.set_grading(i, b["grading"], texts)
+
+    def set_grading(self, i, grading, texts=None):
+        if len(grading) == 3 and all(len(j) == 1 and len(j[0]) == 1 for j in grading):
+            self.grading[i] = [float(j[0][0]) for j in grading]
+            self.gradingText.pop(i, None)
+            self.gradingSections.pop(i, None)
+            return
+        key = tuple(tuple(map(tuple, j)) for j in grading)
+        known = texts.get(key) if texts is not None else None
+        if known is None:
+            # blocks with the same grading share one key tuple
+            known = (key, grading_text(grading))
+            if texts is not None:
+                texts[key] = known
+        self.gradingSections[i], self.gradingText[i] = known
+
+    def _set_edges(self, edges):
+        self.edgeTypes = [e["type"] for e in edges]
+        self.edgeEnds = np.array([[int(z) for z in e["vertices"]] for e in edges], dtype=np.int32).reshape(-1, 2)
+        counts = [len(e["points"]) for e in edges]
+        self.pointOffsets = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.pointOffsets[1:])
+        self.edgePoints = np.array([p for e in edges for p in e["points"]], dtype=np.float64).reshape(-1, 3)
+
+    def _set_boundaries(self, boundaries):
+        self.patchNames = [b["name"] for b in boundaries]
+        self.patchTypes = [b["type"] for b in boundaries]
+        counts = [len(b["faces"]) for b in boundaries]
+        self.faceOffsets = np.zeros(len(boundaries) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.faceOffsets[1:])
+        # reshape fails on anything but quads, the section then stays in obj
+        self.faces = np.array([f for b in boundaries for f in b["faces"]], dtype=np.int32).reshape(-1, 4)
+
+    def apply(self, delta):
+        '''Apply a client delta in place.
+
+        Raises ModelError when the delta is not for this version or does not
+        fit; a model a delta failed on may be half updated and is dropped.
+        '''
+        if delta.get("base") != self.version:
+            raise ModelError(f'delta for version {delta.get("base")}, model is at {self.version}')
+        try:
+            for section, data in delta.items():
+                if section in ("base", "version"):
+                    continue
+                if section not in ARRAY_SECTIONS:
+                    self.obj[section] = data
+                    self.touch(section)
+                elif isinstance(data, list):
+                    self.set_section(section, data)
+                elif section in self.obj:
+                    raise ModelError(f'{section} is not held as arrays, send it whole')
+                elif section == "vertices":
+                    self.update_vertices(data)
+                elif section == "blocks":
+                    self.update_blocks(data)
+                else:
+                    raise ModelError(f'{section} can only be replaced whole')
+        except (KeyError, TypeError, ValueError, IndexError, AttributeError) as e:
+            raise ModelError(f'bad delta: {e!r}')
+        self.version = delta.get("version")
+
+    def update_vertices(self, changes):
+        for key, vertex in sorted(changes.items(), key=lambda kv: int(kv[0])):
+            i = int(key)
+            if not 0 <= i <= len(self.xyz):
+                raise IndexError(f'vertex {i}')
+            if i == len(self.xyz):
+                self.xyz = np.vstack([self.xyz, np.zeros((1, 3))])
+            if "xyz" in vertex:
+                self.xyz[i] = vertex["xyz"]
+            if "project" in vertex:
+                if vertex["project"]:
+                    self.projections[i] = vertex["project"]
+                else:
+                    self.projections.pop(i, None)
+        self.touch("vertices")
+
+    def update_blocks(self, changes):
+        for key, block in sorted(changes.items(), key=lambda kv: int(kv[0])):
+            i = int(key)
+            if not 0 <= i <= len(self.hex):
+                raise IndexError(f'block {i}')
+            if i == len(self.hex):
+                self.hex = np.vstack([self.hex, np.zeros((1, 8), dtype=np.int32)])
+                self.cells = np.vstack([self.cells, np.ones((1, 3), dtype=np.int32)])
+                self.grading = np.vstack([self.grading, np.ones((1, 3))])
+            if "hex" in block:
+                self.hex[i] = block["hex"]
+            if "number" in block:
+                self.cells[i] = [int(j) for j in block["number"]]
+            if "grading" in block:
+                self.set_grading(i, block["grading"])
+        self.touch("blocks")
+
+    def render_vertices(self):
+        if not self.projections:
+            template = '\t(%r %r %r)\n'
+            return 'vertices\n(\n' + numbers((template * len(self.xyz)) % tuple(self.xyz.ravel().tolist())) + ');\n'
+        lines = [f'\t({number(x)} {number(y)} {number(z)})\n' for x, y, z in self.xyz.tolist()]
+        for i, project in self.projections.items():
+            lines[i] = '\tproject ' + lines[i][1:-1] + ' (' + ' '.join(project) + ')\n'
+        return 'vertices\n(\n' + ''.join(lines) + ');\n'
+
+    def render_blocks(self):
+        m = len(self.hex)
+        # one float64 table, %d prints the vertex and cell counts (exact below 2**53) as integers
+        values = np.hstack([self.hex, self.cells, self.grading])
+        template = '\thex (%d %d %d %d %d %d %d %d) (%d %d %d) grading (%r %r %r)\n'
+        text = numbers((template * m) % tuple(values.ravel().tolist()))
+        if not self.gradingText:
+            return 'blocks\n(\n' + text + ');\n'
+        rows = text.splitlines(True)
+        for i, text in self.gradingText.items():
+            rows[i] = rows[i][:rows[i].index(' grading (')] + f' grading ({text})\n'
+        return 'blocks\n(\n' + ''.join(rows) + ');\n'
+
+    def render_edges(self):
+        res_ = ['edges\n(\n']
+        point = '\t(%r %r %r)\n'
+        offsets = self.pointOffsets.tolist()
+        ends = self.edgeEnds.tolist()
+        for k, kind in enumerate(self.edgeTypes):
+            p0, p1 = offsets[k], offsets[k + 1]
+            res_.append(f'\t{kind} {ends[k][0]} {ends[k][1]}\n\t(\n')
+            res_.append(numbers((point * (p1 - p0)) % tuple(self.edgePoints[p0:p1].ravel().tolist())))
+            res_.append('\t)\n')
+        res_.append(');\n')
+        return ''.join(res_)
+
+    def render_boundaries(self):
+        if not self.patchNames:
+            return '\n'
+        res_ = ['boundary\n(\n']
+        offsets = self.faceOffsets.tolist()
+        for p, name in enumerate(self.patchNames):
+            f0, f1 = offsets[p], offsets[p + 1]
+            faces_ = ' '.join(['(%d %d %d %d)'] * (f1 - f0)) % tuple(self.faces[f0:f1].ravel().tolist())
+            res_.append('\t' + name + '\n\t{\n'
+                        '\t\t' + 'type' + '\t' + self.patchTypes[p] + ';\n'
+                        '\t\t' + 'faces' + '\t(' + faces_ + ');\n'
+                        '\n\t}\n')
+        res_.append(');\n')
+        return ''.join(res_)
+
+    def nbytes(self):
+        '''Bytes held by the arrays.'''
+        return sum(a.nbytes for a in (self.xyz, self.hex, self.cells, self.grading, self.edgeEnds,
+                                      self.pointOffsets, self.edgePoints, self.faceOffsets, self.faces))
+
+
+# Models of the blockMeshDicts rendered in this (worker) process, by file name
+_models = {}
+
+
+def get_model(fileName):
+    return _models.get(fileName)
+
+
+def put_model(fileName, model):
+    _models[fileName] = model
+    return model
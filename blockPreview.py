@@ -0,0 +1,259 @@
+import os
+import zlib
+import struct
+import numpy as np
+from blockModel import get_model
+
+# Preview of the block mesh straight from the BlockModel, sent on a view
+# before blockMesh has run. The client draws it at once and drops it when
+# the real patches of the same view arrive.
+#
+#   header: magic "SMP1", version u16, flags u16, nPoints u32,
+#           nOutlines u32, nGridLines u32, nQuads u32, bodySize u32
+#           (uncompressed), little endian
+#   body:   float32 xyz * nPoints       block vertices, then edge points
+#           int32 (a, b) * nOutlines    block edges as point pairs, curved
+#                                       edges as polylines through their points
+#           float32 (xyz, xyz) * nGridLines
+#                                       graded grid lines on the boundary faces
+#           int32 (a, b, c, d) * nQuads boundary faces, patch after patch
+#
+# The body is zlib compressed when FLAG_ZLIB is set. Grid lines follow the
+# grading of the block behind each boundary face but run straight across
+# it; curved edges only show in the outlines.
+
+MAGIC = b'SMP1'
+VERSION = 1
+FLAG_ZLIB = 1
+HEADER = struct.Struct('<4sHHIIIII')
+# Grid lines sent at most; above that only every k-th line of a direction is kept
+PREVIEW_LINES = int(os.environ.get("SIMONMESH_PREVIEW_LINES", 500000))
+
+# The 12 edges of a hex block as positions in its vertex list
+HEX_EDGES = np.array([(0, 1), (3, 2), (7, 6), (4, 5), (0, 3), (1, 2), (5, 6), (4, 7),
+                      (0, 4), (1, 5), (2, 6), (3, 7)])
+# The 6 sides of a hex block: corners at (0, 0), (1, 0), (0, 1), (1, 1) of
+# the face and the block directions its first and second face axis run along
+SIDES = np.array([(0, 3, 4, 7, 1, 2), (1, 2, 5, 6, 1, 2), (0, 1, 4, 5, 0, 2),
+                  (3, 2, 7, 6, 0, 2), (0, 1, 3, 2, 0, 1), (4, 5, 7, 6, 0, 1)])
+
+
+def simple_fractions(cells, ratios):
+    '''Interior node positions (0..1) of simply graded directions.
+
+    cells and ratios hold one entry per direction; returns the positions
+    of all directions concatenated and the offset of each direction in them.
+    '''
+    cells = np.maximum(cells.astype(np.int64), 1)
+    counts = cells - 1
+    offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    owner = np.repeat(np.arange(len(cells)), counts)
+    i = np.arange(offsets[-1]) - offsets[owner] + 1
+    n = cells[owner]
+    # cell sizes grow by e, the last cell is ratio times the first
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        e = np.where(n > 1, ratios[owner] ** (1.0 / np.maximum(n - 1, 1)), 1.0)
+        graded = (1 - e ** i) / (1 - e ** n)
+    fractions = np.where(np.abs(e - 1) > 1e-12, graded, i / n)
+    return fractions, offsets
+
+
+def section_fractions(sections, cells):
+    '''Interior node positions of a multi section graded direction.
+
+    sections are (cell fraction, length fraction, ratio) as in the model
+    JSON, a single (ratio) grades the whole direction.
+    '''
+    if len(sections) == 1 and len(sections[0]) == 1:
+        return simple_fractions(np.array([cells]), np.array([float(sections[0][0])]))[0]
+    cellFractions = np.array([float(s[0]) for s in sections])
+    lengths = np.array([float(s[1]) for s in sections])
+    ratios = np.array([float(s[2]) for s in sections])
+    # cells per section as blockMesh splits them, the last one takes the rest
+    counts = np.round(cellFractions / cellFractions.sum() * cells).astype(np.int64)
+    counts[-1] = max(cells - counts[:-1].sum(), 0)
+    starts = np.concatenate([[0], np.cumsum(lengths / lengths.sum())])
+    nodes = []
+    for k, n in enumerate(counts):
+        if n == 0:
+            continue
+        inner, _ = simple_fractions(np.array([n]), ratios[k:k + 1])
+        nodes.append(starts[k] + (starts[k + 1] - starts[k]) * np.concatenate([inner, [1.0]]))
+    return np.concatenate(nodes)[:-1] if nodes else np.zeros(0)
+
+
+def direction_fractions(model, dirs):
+    '''Interior node positions of the block directions dirs (3 * block + direction):
+    (fractions, offset of each direction in them).'''
+    blocks, d = np.divmod(dirs, 3)
+    fractions, offsets = simple_fractions(model.cells[blocks, d], model.grading[blocks, d])
+    if not model.gradingSections:
+        return fractions, offsets
+    # multi section and edge graded blocks, edge grading uses the first edge of a direction
+    counts = np.diff(offsets)
+    multi = {}
+    known = {}
+    for k, (b, d) in enumerate(zip(blocks.tolist(), d.tolist())):
+        grading = model.gradingSections.get(b)
+        if grading is None:
+            continue
+        key = (grading[4 * d] if len(grading) == 12 else grading[d], int(model.cells[b, d]))
+        if key not in known:
+            known[key] = section_fractions(*key)
+        multi[k] = known[key]
+        counts[k] = len(known[key])
+    res = np.empty(counts.sum())
+    moved = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=moved[1:])
+    # simply graded directions are copied over, the others filled in
+    owner = np.repeat(np.arange(len(dirs)), np.diff(offsets))
+    keep = np.ones(len(dirs), dtype=bool)
+    keep[list(multi)] = False
+    src = np.nonzero(keep[owner])[0]
+    res[moved[owner[src]] + src - offsets[owner[src]]] = fractions[src]
+    for k, nodes in multi.items():
+        res[moved[k]:moved[k + 1]] = nodes
+    return res, moved
+
+
+def block_outlines(model):
+    '''Point coordinates and line segments (point pairs) of the block edges.'''
+    nVertices = len(model.xyz)
+    pairs = model.hex[:, HEX_EDGES].reshape(-1, 2).astype(np.int64)
+    # blocks share most edges; sorting and dropping repeats beats np.unique here
+    keys = np.sort(pairs.min(axis=1) * nVertices + pairs.max(axis=1))
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) else keys
+    ends = model.edgeEnds.astype(np.int64)
+    curved = np.zeros(len(keys), dtype=bool)
+    if len(ends):
+        found = np.minimum(ends[:, 0], ends[:, 1]) * nVertices + np.maximum(ends[:, 0], ends[:, 1])
+        curved = np.isin(keys, found[np.diff(model.pointOffsets) > 0])
+    straight = keys[~curved]
+    # polylines through the points of arc, spline... edges, appended after the vertices
+    counts = np.diff(model.pointOffsets)
+    owner = np.repeat(np.arange(len(counts)), counts + 1)
+    j = np.arange(len(owner)) - np.repeat(np.cumsum(counts + 1) - (counts + 1), counts + 1)
+    first = nVertices + model.pointOffsets[owner] + j
+    chains = np.column_stack([np.where(j == 0, ends[owner, 0] if len(ends) else 0, first - 1),
+                              np.where(j == counts[owner], ends[owner, 1] if len(ends) else 0, first)])
+    chains = chains[counts[owner] > 0]
+    segments = [np.column_stack([straight // nVertices, straight % nVertices]), chains]
+    return np.vstack([model.xyz, model.edgePoints]), np.vstack(segments)
+
+
+def boundary_sides(model):
+    '''Block and side of every boundary face, -1 for faces that are no block side.'''
+    if not len(model.faces) or not len(model.hex):
+        return np.full(len(model.faces), -1), np.full(len(model.faces), -1)
+    sides = np.sort(model.hex[:, SIDES[:, :4]].reshape(-1, 4), axis=1).astype(np.int64)
+    faces = np.sort(model.faces, axis=1).astype(np.int64)
+    nVertices = max(len(model.xyz), int(faces.max()) + 1, int(sides.max()) + 1)
+    # only sides with all corners on the boundary can match, few of them in big models
+    onBoundary = np.zeros(nVertices, dtype=bool)
+    onBoundary[faces.ravel()] = True
+    candidates = np.nonzero(onBoundary[sides].all(axis=1))[0]
+    sides = sides[candidates]
+    key = np.dtype([('hi', '<i8'), ('lo', '<i8')])
+
+    def keys(quads):
+        k = np.empty(len(quads), dtype=key)
+        k['hi'] = quads[:, 0] * nVertices + quads[:, 1]
+        k['lo'] = quads[:, 2] * nVertices + quads[:, 3]
+        return k
+    unique, inverse = np.unique(np.concatenate([keys(sides), keys(faces)]), return_inverse=True)
+    owner = np.full(len(unique), -1, dtype=np.int64)
+    # the first block side of a key wins, boundary faces have one anyway
+    owner[inverse[:len(sides)][::-1]] = np.arange(len(sides))[::-1]
+    match = owner[inverse[len(sides):]]
+    match = np.where(match >= 0, candidates[match], -1)
+    return np.where(match >= 0, match // 6, -1), np.where(match >= 0, match % 6, -1)
+
+
+def grid_lines(model, budget=PREVIEW_LINES):
+    '''Graded grid lines on the boundary faces: (lines (n, 2, 3), thinning step).'''
+    blocks, sides = boundary_sides(model)
+    valid = blocks >= 0
+    blocks, sides = blocks[valid], sides[valid]
+    if not len(blocks):
+        return np.zeros((0, 2, 3)), 1
+    # faces x axes -> block directions, node positions computed once per direction
+    used, dirIndex = np.unique(3 * blocks[:, None] + SIDES[sides, 4:], return_inverse=True)
+    dirIndex = dirIndex.reshape(-1, 2)
+    fractions, offsets = direction_fractions(model, used)
+    corners = model.xyz[model.hex[blocks[:, None], SIDES[sides, :4]]]
+    axes = []
+    for axis in (0, 1):
+        # lines across the face at the nodes of its axis direction
+        dirs = dirIndex[:, axis]
+        counts = offsets[dirs + 1] - offsets[dirs]
+        axes.append((dirs, counts, axis))
+    total = sum(int(c.sum()) for _, c, _ in axes)
+    step = max(-(-total // budget), 1) if budget else 1
+    lines = []
+    for dirs, counts, axis in axes:
+        face = np.repeat(np.arange(len(blocks)), counts)
+        node = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        keep = node % step == step - 1 if step > 1 else slice(None)
+        face, node = face[keep], node[keep]
+        t = fractions[offsets[dirs[face]] + node][:, None]
+        c = corners[face]
+        if axis == 0:
+            # t along the first axis, the line joins edges 0-1 and 2-3 of the face
+            a = c[:, 0] + t * (c[:, 1] - c[:, 0])
+            b = c[:, 2] + t * (c[:, 3] - c[:, 2])
+        else:
+            a = c[:, 0] + t * (c[:, 2] - c[:, 0])
+            b = c[:, 1] + t * (c[:, 3] - c[:, 1])
+        lines.append(np.stack([a, b], axis=1))
+    return np.concatenate(lines), step
+
+
+def encode_preview(points, outlines, lines, quads, compress=False):
+    body = b''.join([np.ascontiguousarray(points, dtype='<f4').tobytes(),
+                     np.ascontiguousarray(outlines, dtype='<i4').tobytes(),
+                     np.ascontiguousarray(lines, dtype='<f4').tobytes(),
+                     np.ascontiguousarray(quads, dtype='<i4').tobytes()])
+    flags = 0
+    size = len(body)
+    if compress:
+        body = zlib.compress(body, 1)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(MAGIC, VERSION, flags, len(points), len(outlines), len(lines), len(quads), size) + body
+
+
+def decode_preview(data):
+    '''Inverse of encode_preview, returns (points, outlines, lines, quads).'''
+    magic, version, flags, nPoints, nOutlines, nLines, nQuads, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a preview payload')
+    body = data[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    res = []
+    offset = 0
+    for dtype, count, shape in (('<f4', nPoints * 3, (-1, 3)), ('<i4', nOutlines * 2, (-1, 2)),
+                                ('<f4', nLines * 6, (-1, 2, 3)), ('<i4', nQuads * 4, (-1, 4))):
+        res.append(np.frombuffer(body, dtype=dtype, count=count, offset=offset).reshape(shape))
+        offset += count * 4
+    return tuple(res)
+
+
+def mesh_preview(fileName, compress=False, budget=PREVIEW_LINES):
+    '''Preview payload of the model last rendered to fileName (runs in the case worker).
+
+    Returns (payload, description for the announcement), None when the
+    worker holds no model for the file or its blocks are not held as arrays.
+    '''
+    model = get_model(fileName)
+    if model is None or "vertices" in model.obj or "blocks" in model.obj:
+        return None
+    points, outlines = block_outlines(model)
+    lines, step = grid_lines(model, budget)
+    # quads that are no block side are drawn all the same
+    patches = [{"name": name, "type": model.patchTypes[p],
+                "quads": int(model.faceOffsets[p + 1] - model.faceOffsets[p])}
+               for p, name in enumerate(model.patchNames)]
+    data = encode_preview(points, outlines, lines, model.faces, compress)
+    return data, {"points": len(points), "outlines": len(outlines), "gridLines": len(lines),
+                  "gridStep": step, "patches": patches, "modelVersion": model.version}
@@ -0,0 +1,138 @@
+import os
+import re
+from toDICT import (ToControlDICT, ToMaterial, ToModel, ToSchemes, ToSolution, ToBoundary, CONTROL_DEFAULTS,
+                    write_if_changed)
+from polyMeshReader import read_boundary
+from foamDict import FoamDictError
+
+# Case materialization: every file of a case (system/, constant/ and the
+# 0/ fields) rendered in one pass from one spec, and written only where the
+# bytes changed. Unchanged files keep their mtime, so runTimeModifiable
+# does not reload them and nothing keyed on them is invalidated; changed
+# files are replaced atomically (see toDICT.write_if_changed).
+#
+#   {"control": {"application": "simpleFoam", "endTime": 500, ...},
+#    "transport": {"model": "Newtonian", "nu": 1e-5},
+#    "turbulence": {"model": "kEpsilon"},          # or "laminar"
+#    "schemes": {"div": "Gauss linearUpwind grad(U)", ...},
+#    "solution": {"solvers": {"p": {...}, "(U|k|epsilon)": {...}},
+#                 "algorithm": "SIMPLE", "settings": {...}, "relaxation": {...}},
+#    "fields": {"U": {"class": "volVectorField", "dimensions": [0, 1, -1, 0, 0, 0, 0],
+#                     "internalField": ["uniform", [0, 0, 0]],
+#                     "boundaryField": {"inlet": {"type": "fixedValue", "value": ["uniform", [1, 0, 0]]}},
+#                     "default": {"type": "zeroGradient"}}},
+#    "patches": ["inlet", ...]}                    # only used before there is a mesh
+#
+# Every field gets an entry for every patch of the mesh: patches the spec
+# leaves out get the field's "default", constraint patches (empty,
+# symmetry, wedge, cyclic...) their own type. boundaryField may also be the
+# [name, type, {info}] list ToBoundary.genBCFile takes.
+
+# Patch types whose fields must use the same (constraint) type
+CONSTRAINT_TYPES = ("empty", "symmetry", "symmetryPlane", "wedge", "cyclic", "cyclicAMI", "processor")
+DEFAULT_SOLVERS = {
+    "p": {"solver": "GAMG", "smoother": "GaussSeidel", "tolerance": 1e-6, "relTol": 0.1},
+    "(U|k|epsilon|omega|nuTilda)": {"solver": "smoothSolver", "smoother": "GaussSeidel",
+                                    "tolerance": 1e-5, "relTol": 0.1},
+}
+DEFAULT_ALGORITHM = {"nNonOrthogonalCorrectors": 0, "consistent": "yes"}
+# field names become file names in 0/: plain words only (alpha.water, p_rgh)
+FIELD_NAME = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.:-]*$')
+
+# controlDict entries materialized per case, the view writes the same ones
+_controls = {}
+
+
+def control_entries(case_dir):
+    return _controls.get(os.path.abspath(case_dir))
+
+
+def remember_control(case_dir, entries):
+    _controls[os.path.abspath(case_dir)] = entries
+
+
+def case_patches(case_dir, spec):
+    '''[(name, type)] of the case's mesh, or of the spec's "patches" before there is one.'''
+    boundary = os.path.join(case_dir, 'constant', 'polyMesh', 'boundary')
+    if os.path.exists(boundary):
+        try:
+            return [(patch["name"], patch["type"]) for patch in read_boundary(boundary)]
+        except (OSError, ValueError, FoamDictError) as e:
+            print("materialize: boundary file not readable, using the spec's patches: ", e)
+    return [(name, "patch") for name in spec.get("patches", [])]
+
+
+def internal_field(value):
+    '''(fieldType, fieldValue) of ToBoundary.assignInternalField.'''
+    if isinstance(value, (list, tuple)) and len(value) == 2 and value[0] in ('uniform', 'nonuniform'):
+        data = value[1]
+        return value[0], list(data) if isinstance(data, (list, tuple)) else [data]
+    kind, _, data = str(value).partition(' ')
+    return kind, [data.strip()]
+
+
+def boundary_list(field, patches):
+    '''The [name, type, {info}] list of a field, one entry per patch.'''
+    given = field.get("boundaryField") or {}
+    if isinstance(given, list):
+        given = {bc[0]: {"type": bc[1], **(bc[2] if len(bc) > 2 else {})} for bc in given}
+    default = field.get("default") or {"type": "zeroGradient"}
+    bcList = []
+    for name, patchType in patches:
+        bc = given.get(name)
+        if bc is None:
+            bc = {"type": patchType} if patchType in CONSTRAINT_TYPES else default
+        bc = dict(bc)
+        bcType = bc.pop("type")
+        bcList.append([name, bcType] + ([bc] if bc else []))
+    # entries for patches the mesh doesn't have (yet) are kept, OpenFOAM ignores them
+    known = {name for name, _ in patches}
+    for name, bc in given.items():
+        if name not in known:
+            bc = dict(bc)
+            bcList.append([name, bc.pop("type")] + ([bc] if bc else []))
+    return bcList
+
+
+def render_case(spec, patches):
+    '''{path relative to the case: text} of every file the spec describes.'''
+    control = {**CONTROL_DEFAULTS, **(spec.get("control") or {})}
+    transport = spec.get("transport") or {}
+    solution = spec.get("solution") or {}
+    fields = spec.get("fields") or {}
+    for name in fields:
+        if not isinstance(name, str) or not FIELD_NAME.match(name):
+            raise ValueError(f'not a field name: {name!r}')
+    files = {
+        'system/controlDict': ToControlDICT('', control["writeFormat"], control["writeCompression"], control).res,
+        'system/fvSchemes': ToSchemes().render(spec.get("schemes")),
+        'system/fvSolution': ToSolution('').render(solution.get("solvers", DEFAULT_SOLVERS),
+                                                   solution.get("algorithm", "SIMPLE"),
+                                                   solution.get("settings", DEFAULT_ALGORITHM),
+                                                   solution.get("relaxation")),
+        'constant/transportProperties': ToMaterial().render(transport.get("model", "Newtonian"),
+                                                            transport.get("nu", 0.001),
+                                                            transport.get("unit", (0, 2, -1, 0, 0, 0, 0))),
+        'constant/turbulenceProperties': ToModel().render((spec.get("turbulence") or {}).get("model", "kEpsilon")),
+    }
+    for name, field in fields.items():
+        files[f'0/{name}'] = ToBoundary().render(field.get("class", "volScalarField"), name,
+                                                 field.get("dimensions", [0, 0, 0, 0, 0, 0, 0]),
+                                                 *internal_field(field.get("internalField", ["uniform", 0])),
+                                                 boundary_list(field, patches))
+    return files, control
+
+
+def materialize(case_dir, spec):
+    '''Render the case from spec and write the files that changed (runs in a case worker).
+
+    Returns {"written": [...], "unchanged": [...], "control": controlDict entries}.
+    '''
+    files, control = render_case(spec, case_patches(case_dir, spec))
+    written, unchanged = [], []
+    for relPath, text in files.items():
+        path = os.path.join(case_dir, *relPath.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (written if write_if_changed(path, text) else unchanged).append(relPath)
+    print("materialize: ", case_dir, "written: ", written, "unchanged: ", len(unchanged))
+    return {"written": written, "unchanged": unchanged, "control": control}
@@ -0,0 +1,62 @@
+import numpy as np
+
+# Point budget reduction for residual charts.
+#
+# Both methods return indices of actual samples and always keep the first
+# and last point. "minmax" keeps the extremes of every bucket, so a single
+# spike in a residual still shows up; "lttb" (Largest-Triangle-Three-
+# Buckets) keeps the points that best preserve the visual shape.
+
+METHODS = ("minmax", "lttb")
+
+
+def minmax(x, y, budget):
+    '''Indices of the smallest and largest y of each of budget // 2 buckets.'''
+    n = len(y)
+    count = max((budget - 2) // 2, 1)
+    starts = np.unique(np.linspace(0, n, count + 1).astype(np.int64)[:-1])
+    sizes = np.diff(np.append(starts, n))
+    picked = [[0, n - 1]]
+    for reduce in (np.fmin, np.fmax):
+        # first sample of every bucket equal to the bucket's extreme (NaNs,
+        # from a diverged solver, are skipped)
+        hits = np.flatnonzero(y == np.repeat(reduce.reduceat(y, starts), sizes))
+        if len(hits):
+            picked.append(hits[np.minimum(np.searchsorted(hits, starts), len(hits) - 1)])
+    return np.unique(np.concatenate(picked))
+
+
+def lttb(x, y, budget):
+    '''Largest-Triangle-Three-Buckets.
+
+    The points between the first and the last are split into budget - 2
+    buckets; each bucket keeps the point forming the largest triangle with
+    the point kept in the previous bucket and the mean of the next one.
+    '''
+    n = len(y)
+    x = np.nan_to_num(np.asarray(x, dtype=np.float64))
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    meanX = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / sizes, x[-1])
+    meanY = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / sizes, y[-1])
+
+    index = np.empty(budget, dtype=np.int64)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(budget - 2):
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = meanX[i + 1], meanY[i + 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        index[i + 1] = a
+    return index
+
+
+def downsample(x, y, budget, method="minmax"):
+    '''Indices of at most about budget samples of the series (x, y).'''
+    if budget is None or len(y) <= max(budget, 3):
+        return np.arange(len(y))
+    if method == "lttb":
+        return lttb(x, y, max(budget, 3))
+    return minmax(x, y, budget)
@@ -0,0 +1,361 @@
+import os
+import re
+import gzip
+import mmap
+import numpy as np
+from collections import OrderedDict, namedtuple
+
+# Streaming parser for OpenFOAM dictionaries and list files (boundary,
+# controlDict, fvSchemes, field files, points/faces/owner ...).
+#
+# Tokens are scanned one at a time straight from the file bytes. Dictionaries
+# become dicts, lists become Python lists, and counted numeric lists (points,
+# labels, faces, nonuniform fields) are handed to NumPy in one piece. Binary
+# format lists are read with np.frombuffer; the element type comes from the
+# List<type> prefix or the file class. Values at the top level that belong
+# to no keyword, like the list of a boundary or points file, are collected
+# in a list under the key None.
+
+# Parsed files are cached by (path, mtime, size) of the file and everything
+# it includes. Results are shared between callers: treat them as read-only.
+CACHE_ENTRIES = 64
+# Bigger files (mesh lists) are parsed every time instead of being kept
+CACHE_FILE_LIMIT = 16 * 1024 * 1024
+# Files that big are memory mapped instead of read, so binary lists become
+# views of the mapping without a copy. They are never cached: a mapping goes
+# bad when OpenFOAM rewrites the file in place.
+MMAP_MIN_BYTES = CACHE_FILE_LIMIT
+
+# Faces of a faceList as CSR: labels[offsets[i]:offsets[i + 1]] is face i
+CompactList = namedtuple('CompactList', 'offsets labels')
+
+_SKIP = re.compile(rb'(?:\s+|//[^\n]*|/\*.*?\*/)+', re.S)
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|#\{.*?#\}|[{}()\[\];]|[^\s{}()\[\];"]+', re.S)
+_INT = re.compile(rb'[-+]?\d+')
+_FLOAT = re.compile(rb'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+# counted numeric lists: flat, of tuples (vectors) or of counted sublists (faces)
+_LIST_HEAD = re.compile(rb'\s*(?:(\()|(\d+\s*\())?')
+_FLAT_END = re.compile(rb'\)')
+_NESTED_END = re.compile(rb'\)\s*\)')
+# everything but the brackets, what is left of the entries of a list of
+# tuples must be "()()()..." or the list nests deeper than one level
+_NOT_BRACKETS = bytes(c for c in range(256) if c not in b'()')
+_REAL = re.compile(rb'[.eE]')
+_BRACKETS = bytes.maketrans(b'()', b'  ')
+
+# components of the contiguous types that binary files store as raw bytes
+_COMPONENTS = {'label': 1, 'scalar': 1, 'vector': 3, 'symmTensor': 6, 'tensor': 9, 'sphericalTensor': 1}
+# element type of the top level lists of binary files without a List<type> prefix
+_CLASS_TYPES = {'vectorField': 'vector', 'scalarField': 'scalar', 'labelList': 'label',
+                'faceCompactList': 'label', 'cellCompactList': 'label'}
+_INCLUDES = ('#include', '#includeIfPresent', '#sinclude')
+
+_cache = OrderedDict()
+
+
+class FoamDictError(Exception):
+    pass
+
+
+def _atom(token):
+    if _INT.fullmatch(token):
+        return int(token)
+    if _FLOAT.fullmatch(token):
+        return float(token)
+    if token[:1] == b'"':
+        return token[1:-1].decode()
+    return token.decode()
+
+
+def compact_list(flat, count):
+    '''CSR CompactList from the "n a b c n a b c ..." labels of a faceList.'''
+    if count == 0:
+        return CompactList(np.zeros(1, dtype=np.int64), flat)
+    # blockMesh meshes are all quads, avoid walking the counts one by one
+    n = flat[0]
+    if flat.size == count * (n + 1) and np.all(flat[::n + 1] == n):
+        return CompactList(np.arange(count + 1, dtype=np.int64) * n, flat.reshape(count, n + 1)[:, 1:].ravel())
+
+    heads = np.empty(count, dtype=np.int64)
+    pos = 0
+    for i in range(count):
+        heads[i] = pos
+        pos += flat[pos] + 1
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(flat[heads], out=offsets[1:])
+    keep = np.ones(flat.size, dtype=bool)
+    keep[heads] = False
+    return CompactList(offsets, flat[keep])
+
+
+class FoamParser:
+    def __init__(self, data, path='<string>'):
+        self.data = data
+        self.path = path
+        self.pos = 0
+        self.peeked = None
+        self.binary = False
+        self.label = np.dtype('<i4')
+        self.scalar = np.dtype('<f8')
+        self.fileClass = None
+        # (path, (mtime, size)) of included files
+        self.includes = []
+
+    def error(self, message):
+        line = self.data[:self.pos].count(b'\n') + 1
+        raise FoamDictError(f'{self.path}:{line}: {message}')
+
+    def next(self):
+        if self.peeked is not None:
+            token, self.peeked = self.peeked, None
+            return token
+        data = self.data
+        skip = _SKIP.match(data, self.pos)
+        if skip:
+            self.pos = skip.end()
+        m = _TOKEN.match(data, self.pos)
+        if m is None:
+            if self.pos < len(data):
+                self.error(f'unexpected {data[self.pos:self.pos + 1]!r}')
+            return None
+        token = m.group()
+        self.pos = m.end()
+        # keywords like div(phi,U) carry their own brackets
+        if data[self.pos:self.pos + 1] == b'(' and token[:1] not in b'{}()[];"' and not _INT.fullmatch(token):
+            depth = 0
+            end = self.pos
+            while end < len(data):
+                depth += {40: 1, 41: -1}.get(data[end], 0)
+                end += 1
+                if depth == 0:
+                    break
+            token = data[m.start():end]
+            self.pos = end
+        return token
+
+    def peek(self):
+        if self.peeked is None:
+            self.peeked = self.next()
+        return self.peeked
+
+    def parse(self):
+        return self.parse_dict(top=True)
+
+    def parse_dict(self, closing=False, top=False):
+        entries = {}
+        while True:
+            token = self.next()
+            if token is None:
+                if closing:
+                    self.error('missing }')
+                return entries
+            if token == b'}' and closing:
+                return entries
+            if token == b';':
+                continue
+            if token[:1] == b'#' and token[:2] != b'#{':
+                self.directive(token.decode(), entries)
+            elif top and (token == b'(' or _INT.fullmatch(token)):
+                self.peeked = token
+                entries.setdefault(None, []).append(self.parse_value())
+            else:
+                key = _atom(token) if token[:1] == b'"' else token.decode()
+                entries[key] = self.parse_entry()
+                if top and key == 'FoamFile' and isinstance(entries[key], dict):
+                    self.header(entries[key])
+
+    def header(self, header):
+        self.binary = header.get('format') == 'binary'
+        self.fileClass = header.get('class')
+        arch = str(header.get('arch', ''))
+        order = '>' if 'MSB' in arch else '<'
+        self.label = np.dtype(f'{order}i{8 if "label=64" in arch else 4}')
+        self.scalar = np.dtype(f'{order}f{4 if "scalar=32" in arch else 8}')
+
+    def parse_entry(self):
+        token = self.next()
+        if token == b'{':
+            return self.parse_dict(closing=True)
+        values = []
+        while token != b';':
+            if token is None or token in (b'}', b')'):
+                self.error('missing ;')
+            self.peeked = token
+            values.append(self.parse_value())
+            token = self.next()
+        return values[0] if len(values) == 1 else values
+
+    def parse_value(self, hint=None):
+        token = self.next()
+        if token is None:
+            self.error('unexpected end of file')
+        if token == b'(':
+            return self.parse_list(None, hint)
+        if token == b'{':
+            return self.parse_dict(closing=True)
+        if token == b'[':
+            dims = []
+            while (token := self.next()) != b']':
+                if token is None:
+                    self.error('missing ]')
+                dims.append(_atom(token))
+            return dims
+        if token.startswith(b'List<') and token.endswith(b'>'):
+            following = self.peek()
+            if following == b'(' or (following is not None and _INT.fullmatch(following)):
+                return self.parse_value(token[5:-1].decode())
+        if _INT.fullmatch(token):
+            following = self.peek()
+            if following == b'(':
+                self.next()
+                return self.parse_list(int(token), hint)
+            if following == b'{':
+                # uniform list: N{value}
+                self.next()
+                value = self.parse_value(hint)
+                if self.next() != b'}':
+                    self.error('missing }')
+                return [value] * int(token)
+        return _atom(token)
+
+    def parse_list(self, count, hint=None):
+        # self.pos is just past the opening bracket
+        if count:
+            kind = hint or _CLASS_TYPES.get(self.fileClass)
+            if self.binary and kind in _COMPONENTS:
+                return self.binary_list(count, kind)
+            fast = self.numeric_list(count)
+            if fast is not None:
+                return fast
+        items = []
+        while (token := self.next()) != b')':
+            if token is None:
+                self.error('missing )')
+            self.peeked = token
+            items.append(self.parse_value())
+        return items
+
+    def numeric_list(self, count):
+        '''Parse a counted list of numbers, of tuples or of counted sublists with NumPy.
+
+        Returns None (and leaves the position alone) when the list holds
+        anything else, the caller then parses it token by token.
+        '''
+        data = self.data
+        head = _LIST_HEAD.match(data, self.pos)
+        nested = head.group(1) or head.group(2)
+        # nested lists end at the first ")" closing their last entry
+        end = _NESTED_END.search(data, self.pos) if nested else _FLAT_END.search(data, self.pos)
+        if end is None:
+            return None
+        body = data[self.pos:end.end() - 1]
+        # the end found is only the list's own ")" when nothing nests deeper
+        if nested:
+            brackets = body.translate(None, _NOT_BRACKETS)
+            if brackets != b'()' * (len(brackets) // 2):
+                return None
+        elif b'(' in body:
+            return None
+        try:
+            dtype = np.float64 if _REAL.search(body) else np.int64
+            flat = np.array(body.translate(_BRACKETS).split(), dtype=dtype)
+        except ValueError:
+            return None
+        if head.group(2):
+            values = compact_list(flat, count)
+            found = len(values.offsets) - 1
+        else:
+            if head.group(1) and flat.size % count == 0:
+                flat = flat.reshape(count, -1)
+            values, found = flat, len(flat)
+        if found != count:
+            self.error(f'expected {count} list entries, found {found}')
+        self.pos = end.end()
+        return values
+
+    def binary_list(self, count, kind):
+        dtype = self.label if kind == 'label' else self.scalar
+        components = _COMPONENTS[kind]
+        end = self.pos + count * components * dtype.itemsize
+        if self.data[end:end + 1] != b')':
+            self.error(f'binary List<{kind}> of {count} entries does not end with )')
+        values = np.frombuffer(self.data, dtype=dtype, count=count * components, offset=self.pos)
+        self.pos = end + 1
+        return values.reshape(count, components) if components > 1 else values
+
+    def directive(self, name, entries):
+        if name in _INCLUDES:
+            target = _atom(self.next())
+            path = foam_path(os.path.join(os.path.dirname(self.path), os.path.expandvars(target)))
+            if not os.path.exists(path) and name != '#include':
+                return
+            included = read_foam_file(path)
+            self.includes.append((os.path.abspath(path), _stamp(path)))
+            entries.update((k, v) for k, v in included.items() if k not in ('FoamFile', None))
+        else:
+            # #includeEtc, #includeFunc, #remove, #inputMode ... take one argument
+            self.parse_value()
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def foam_path(path):
+    '''path itself, or path.gz when only the compressed file exists (writeCompression on).'''
+    if not os.path.exists(path) and os.path.exists(path + '.gz'):
+        return path + '.gz'
+    return path
+
+
+def read_foam_bytes(path):
+    '''File contents as bytes, or as a read-only mmap for big uncompressed files.'''
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_BYTES:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+
+def parse_foam(data, path='<string>'):
+    '''Parse OpenFOAM dictionary text (bytes or str).'''
+    if isinstance(data, str):
+        data = data.encode()
+    return FoamParser(data, path).parse()
+
+
+def read_foam_file(path):
+    '''Parse an OpenFOAM file, cached by (path, mtime, size).
+
+    Reads path.gz when only the compressed file is there.
+    '''
+    path = foam_path(os.path.abspath(path))
+    cached = _cache.get(path)
+    if cached is not None:
+        try:
+            if all(_stamp(p) == stamp for p, stamp in cached[0]):
+                _cache.move_to_end(path)
+                return cached[1]
+        except OSError:
+            pass
+        del _cache[path]
+
+    stamp = _stamp(path)
+    parser = FoamParser(read_foam_bytes(path), path)
+    result = parser.parse()
+    if stamp[1] < MMAP_MIN_BYTES and stamp[1] <= CACHE_FILE_LIMIT:
+        _cache[path] = ([(path, stamp)] + parser.includes, result)
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return result
+
+
+def top_level_lists(path):
+    '''The lists of a list file (points, owner, boundary ...), FoamDictError when there is none.'''
+    lists = read_foam_file(path).get(None)
+    if not lists:
+        raise FoamDictError(f'{path}: no list found')
+    return lists
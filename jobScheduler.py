@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+from collections import deque
+from metrics import observe
+
+# Per case job queue for the operations that write into a case directory.
+#
+# Jobs on the same case run one at a time, in order, so two requests never
+# write octopus.dict or the patch files at once; different cases run in
+# parallel. A new job supersedes older jobs of the same op on that case:
+# queued ones are dropped and a running one is cancelled, which kills its
+# OpenFOAM process (see processEngine.run_process).
+
+# Set to 0 to let every job run to completion instead
+SUPERSEDE = os.environ.get("SIMONMESH_SUPERSEDE", "1") != "0"
+# Number of recent queue wait times kept for the stats
+WAIT_SAMPLES = 256
+
+
+class JobSuperseded(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, case, op):
+        self.case = case
+        self.op = op
+        self.task = None
+        self.superseded = False
+        self.submitted = time.monotonic()
+        self.started = None
+
+    def supersede(self):
+        self.superseded = True
+        if self.task is not None:
+            self.task.cancel()
+
+
+class CaseQueue:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # queued and running jobs, oldest first
+        self.jobs = []
+
+
+class JobScheduler:
+    def __init__(self, supersede=SUPERSEDE):
+        self.supersede = supersede
+        self.cases = {}
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.counts = {"submitted": 0, "completed": 0, "superseded": 0, "failed": 0}
+
+    async def run(self, case_dir, op, job_fn):
+        '''Run job_fn() (a coroutine function) as a job of op on case_dir.
+
+        Returns its result; raises JobSuperseded when a newer job of the
+        same op on the same case replaced it before or while it ran.
+        '''
+        case = os.path.abspath(case_dir)
+        queue = self.cases.setdefault(case, CaseQueue())
+        job = Job(case, op)
+        if self.supersede:
+            for older in queue.jobs:
+                if older.op == op and not older.superseded:
+                    older.supersede()
+                    self.counts["superseded"] += 1
+        queue.jobs.append(job)
+        self.counts["submitted"] += 1
+        try:
+            async with queue.lock:
+                if job.superseded:
+                    raise JobSuperseded(f'{op} on {case} superseded while queued')
+                job.started = time.monotonic()
+                self.waits.append(job.started - job.submitted)
+                observe("queue.job", job.started - job.submitted)
+                job.task = asyncio.ensure_future(job_fn())
+                try:
+                    result = await job.task
+                except asyncio.CancelledError:
+                    if job.superseded:
+                        raise JobSuperseded(f'{op} on {case} superseded while running')
+                    raise
+                except Exception:
+                    self.counts["failed"] += 1
+                    raise
+                self.counts["completed"] += 1
+                return result
+        finally:
+            queue.jobs.remove(job)
+            if not queue.jobs and self.cases.get(case) is queue:
+                del self.cases[case]
+
+    def stats(self):
+        '''Queue depth per case and queue wait times in seconds.'''
+        now = time.monotonic()
+        cases = {}
+        for case, queue in self.cases.items():
+            running = [job for job in queue.jobs if job.started is not None and not job.task.done()]
+            waiting = [job for job in queue.jobs if job.started is None]
+            cases[case] = {"depth": len(waiting),
+                           "running": running[0].op if running else None,
+                           "waiting": [job.op for job in waiting],
+                           "oldestWait": max((now - job.submitted for job in waiting), default=0.0)}
+        waits = sorted(self.waits)
+        return {"cases": cases, **self.counts,
+                "wait": {"last": self.waits[-1] if waits else 0.0,
+                         "mean": sum(waits) / len(waits) if waits else 0.0,
+                         "max": waits[-1] if waits else 0.0}}
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler()
+    return _scheduler
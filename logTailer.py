@@ -0,0 +1,210 @@
+import os
+import asyncio
+import numpy as np
+from residualLog import ResidualParser, BLOCK_SIZE
+from residualIndex import ResidualIndex
+from workerPool import run_in_worker
+
+# One tailer per log file, shared by every monitoring client.
+#
+# The tailer reads and parses each new chunk of the log once and publishes
+# coalesced residual updates to its subscribers at most FRAME_RATE times a
+# second. Subscribers are reference counted; the tailer stops when the last
+# one leaves. Parsing runs in the case worker of the log (see workerPool),
+# which checkpoints the residuals to a ResidualIndex next to the log: new
+# subscribers get their history from it, and a new tailer resumes parsing
+# where the last one stopped.
+
+FRAME_RATE = float(os.environ.get("SIMONMESH_MONITOR_HZ", 4))
+# Bytes parsed per read while catching up, keeps memory bounded on big logs
+READ_LIMIT = 16 * BLOCK_SIZE
+
+_tailers = {}
+
+
+class Subscription:
+    def __init__(self, tailer):
+        self.tailer = tailer
+        self.reset = False
+        self.times = []
+        self.series = {}
+        self.ready = asyncio.Event()
+        # set once the history has been published to this subscriber
+        self.attached = False
+
+    def publish(self, times, series, reset=False):
+        if reset:
+            self.reset = True
+            self.times = []
+            self.series = {}
+        self.times.extend(times)
+        for field, pair in series.items():
+            self.series.setdefault(field, []).append(pair)
+        self.ready.set()
+
+    async def get(self):
+        '''Wait for the next update and return (reset, times, {field: (times, values)}).
+
+        Everything published since the last call is merged; reset is True
+        when the log was restarted in between.
+        '''
+        await self.ready.wait()
+        self.ready.clear()
+        series = {field: (np.concatenate([t for t, _ in pairs]), np.concatenate([v for _, v in pairs]))
+                  for field, pairs in self.series.items()}
+        update = self.reset, self.times, series
+        self.reset, self.times, self.series = False, [], {}
+        return update
+
+
+class LogReader:
+    '''Parser state of one log, kept in the case worker the log is routed to.'''
+    def __init__(self, path):
+        self.path = path
+        self.index = ResidualIndex(path)
+        self.parser = self.index.load()
+        self.offset = self.index.offset
+        self.inode = None
+
+    def read(self):
+        '''Parse what was appended since the last call and checkpoint it.
+
+        Returns (reset, times, {field: (times, values)}, offset).
+        '''
+        st = os.stat(self.path)
+        inode, self.inode = self.inode, st.st_ino
+        if st.st_size < self.offset or inode not in (None, st.st_ino):
+            # log truncated or replaced by a new run
+            self.index.clear()
+            self.parser = ResidualParser()
+            self.offset = 0
+            return True, [], {}, self.offset
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            read = 0
+            while read < READ_LIMIT and (chunk := f.read(BLOCK_SIZE)):
+                self.parser.feed(chunk)
+                read += len(chunk)
+        self.offset += read
+        if not self.parser.pending():
+            return False, [], {}, self.offset
+        times, series = self.parser.take()
+        self.index.append(times, series, self.parser.checkpoint())
+        return False, times, series, self.offset
+
+
+_readers = {}
+
+
+def read_log(path):
+    '''Worker side of a tailer tick, see LogReader.read.'''
+    reader = _readers.get(path)
+    if reader is None:
+        reader = _readers[path] = LogReader(path)
+    return reader.read()
+
+
+def read_log_index(path, window=None):
+    '''Stored (times, series) of a log, read in the server process.'''
+    index = ResidualIndex(path)
+    index.refresh()
+    return index.read(*(window or ()))
+
+
+class LogTailer:
+    def __init__(self, path, rate=FRAME_RATE):
+        self.path = path
+        self.rate = rate
+        # parsing runs in the worker of the log's case directory
+        self.case_dir = os.path.dirname(path)
+        self.offset = 0
+        self.fields = []
+        self.started = False
+        self.subscribers = set()
+        self.task = None
+        # serializes index updates with history reads, so a subscriber sees
+        # every step exactly once
+        self.lock = asyncio.Lock()
+
+    def subscribe(self, window=None):
+        sub = Subscription(self)
+        self.subscribers.add(sub)
+        asyncio.ensure_future(self.attach(sub, window))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return sub
+
+    async def tick(self):
+        reset, times, series, self.offset = await run_in_worker(self.case_dir, read_log, self.path)
+        self.started = True
+        self.fields += [field for field in series if field not in self.fields]
+        if reset:
+            self.fields = []
+            self.publish([], {}, reset=True)
+        if times or series:
+            self.publish(times, series)
+
+    async def attach(self, sub, window=None):
+        async with self.lock:
+            if not self.started:
+                # brings the index up to date with the log before it is read
+                try:
+                    await self.tick()
+                except FileNotFoundError:
+                    pass
+            times, series = await asyncio.to_thread(read_log_index, self.path, window)
+            if times or series:
+                sub.publish(times, series)
+            sub.attached = True
+
+    async def query(self, t0=None, t1=None):
+        '''Stored (times, series) between the times t0 and t1.'''
+        async with self.lock:
+            return await asyncio.to_thread(read_log_index, self.path, (t0, t1))
+
+    def unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, times, series, reset=False):
+        for sub in self.subscribers:
+            if sub.attached:
+                sub.publish(times, series, reset)
+
+    async def run(self):
+        while True:
+            try:
+                async with self.lock:
+                    await self.tick()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"log tailer {self.path}: {e}")
+            await asyncio.sleep(1 / self.rate)
+
+
+def subscribe_log(path, rate=None, window=None):
+    '''Subscribe to a log file, starting its tailer if needed.
+
+    The first update holds the stored history, limited to the time window
+    (t0, t1) when one is given.
+    '''
+    path = os.path.abspath(path)
+    tailer = _tailers.get(path)
+    if tailer is None:
+        tailer = _tailers[path] = LogTailer(path, rate or FRAME_RATE)
+    return tailer.subscribe(window)
+
+
+def unsubscribe_log(sub):
+    tailer = sub.tailer
+    tailer.unsubscribe(sub)
+    if not tailer.subscribers and _tailers.get(tailer.path) is tailer:
+        del _tailers[tailer.path]
+
+
+def tailer_stats():
+    return {path: {"subscribers": len(t.subscribers), "offset": t.offset, "fields": t.fields}
+            for path, t in _tailers.items()}
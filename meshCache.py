@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import hashlib
+from collections import OrderedDict
+
+# On-disk cache of blockMesh results (polyMesh + per patch VTK files), keyed on
+# the content of everything that determines them, so an unchanged model is
+# served without rerunning blockMesh and the extractions. The copies run in
+# threads (asyncio.to_thread), the index is guarded by a lock and entries
+# being restored are pinned, eviction passes them by. Hits only reorder the
+# index in memory, it is written when an entry is added or evicted.
+
+MAX_BYTES = int(os.environ.get("SIMONMESH_MESH_CACHE_MB", 1024)) * 1024 * 1024
+INDEX_NAME = 'index.json'
+
+_file_digests = {}
+_caches = {}
+
+
+def file_digest(path):
+    '''sha256 of a file, memoized on (size, mtime) so large STLs are hashed once.'''
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    cached = _file_digests.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _file_digests[path] = (stamp, digest)
+    return digest
+
+
+def remember_digest(path, digest):
+    '''Record the sha256 of a file written by the server, so it is not hashed again.'''
+    st = os.stat(path)
+    _file_digests[path] = ((st.st_size, st.st_mtime_ns), digest)
+
+
+def geometry_files(case_dir, geometry):
+    '''Paths of the STL files a blockMeshDict geometry section refers to.'''
+    paths = []
+    for g in geometry or []:
+        for sub in ('geometry', 'triSurface'):
+            path = os.path.join(case_dir, 'constant', sub, f'{g["name"]}.stl')
+            if os.path.exists(path):
+                paths.append(path)
+                break
+    return paths
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class MeshCache:
+    def __init__(self, root, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # {key: restores in progress}
+        self.pinned = {}
+        os.makedirs(root, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.root, INDEX_NAME)) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        index = OrderedDict(sorted(entries.items(), key=lambda kv: kv[1]["atime"]))
+        # drop entries whose directory went missing
+        for key in [k for k in index if not os.path.isdir(os.path.join(self.root, k))]:
+            del index[key]
+        return index
+
+    def _save_index(self):
+        tmp = os.path.join(self.root, INDEX_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, os.path.join(self.root, INDEX_NAME))
+
+    @staticmethod
+    def key(dict_texts, stl_paths, patchNames):
+        h = hashlib.sha256()
+        for text in dict_texts:
+            h.update(text.encode())
+            h.update(b'\0')
+        for path in sorted(stl_paths):
+            h.update(os.path.basename(path).encode())
+            h.update(file_digest(path).encode())
+        h.update('\0'.join(sorted(patchNames)).encode())
+        return h.hexdigest()
+
+    @property
+    def size(self):
+        return sum(e["size"] for e in self.index.values())
+
+    def get(self, key):
+        '''Return {"key": key, "patches": {name: path}, "polyMesh": dir} or None.'''
+        entry_dir = os.path.join(self.root, key)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not os.path.isdir(entry_dir):
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["atime"] = time.time()
+            self.index.move_to_end(key)
+        patch_dir = os.path.join(entry_dir, 'patches')
+        return {"key": key, "patches": {n: os.path.join(patch_dir, f'{n}.vtk') for n in entry["patches"]},
+                "polyMesh": os.path.join(entry_dir, 'polyMesh')}
+
+    def put(self, key, patchFiles, mesh_dir):
+        '''Store the patch VTK files ({name: path}) and the polyMesh directory.'''
+        entry_dir = os.path.join(self.root, key)
+        tmp_dir = entry_dir + f'.{uuid.uuid4().hex}.tmp'
+        os.makedirs(os.path.join(tmp_dir, 'patches'))
+        for patchName, path in patchFiles.items():
+            shutil.copyfile(path, os.path.join(tmp_dir, 'patches', f'{patchName}.vtk'))
+        shutil.copytree(mesh_dir, os.path.join(tmp_dir, 'polyMesh'))
+
+        size = dir_size(tmp_dir)
+        with self.lock:
+            if key in self.pinned:
+                # the same mesh is being restored from the entry right now
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            self.index[key] = {"size": size, "atime": time.time(), "patches": sorted(patchFiles)}
+            self.index.move_to_end(key)
+            self.evict()
+            self._save_index()
+
+    def evict(self):
+        '''Drop least recently used entries until the cache fits max_bytes (lock held).'''
+        total = self.size
+        # the most recent entry (the one just added) always stays
+        for key in list(self.index)[:-1]:
+            if total <= self.max_bytes:
+                break
+            if key in self.pinned:
+                continue
+            entry = self.index.pop(key)
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= entry["size"]
+            self.evictions += 1
+
+    def restore(self, entry, case_dir):
+        '''Copy a cached polyMesh and patch files back into the case.
+
+        The polyMesh is copied next to the case's and swapped in, so nothing
+        of the old mesh (cellZones, sets/...) survives and a reader never
+        sees half of it. Raises OSError when the entry is gone.
+        '''
+        key = entry["key"]
+        with self.lock:
+            if key not in self.index:
+                raise FileNotFoundError(f'mesh cache entry {key} was evicted')
+            self.pinned[key] = self.pinned.get(key, 0) + 1
+        try:
+            self._restore(entry, case_dir)
+        finally:
+            with self.lock:
+                self.pinned[key] -= 1
+                if not self.pinned[key]:
+                    del self.pinned[key]
+
+    def _restore(self, entry, case_dir):
+        mesh_dir = os.path.join(case_dir, 'constant', 'polyMesh')
+        tag = uuid.uuid4().hex
+        tmp_dir, old_dir = f'{mesh_dir}.{tag}.tmp', f'{mesh_dir}.{tag}.old'
+        try:
+            shutil.copytree(entry["polyMesh"], tmp_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        if os.path.isdir(mesh_dir):
+            os.replace(mesh_dir, old_dir)
+        os.replace(tmp_dir, mesh_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        for patchName, path in entry["patches"].items():
+            shutil.copyfile(path, os.path.join(case_dir, f'{patchName}.vtk'))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.index), "bytes": self.size, "maxBytes": self.max_bytes}
+
+
+def get_mesh_cache(base_dir):
+    root = os.path.join(base_dir, '.meshcache')
+    if root not in _caches:
+        _caches[root] = MeshCache(root)
+    return _caches[root]
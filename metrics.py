@@ -0,0 +1,117 @@
+import os
+import time
+import contextlib
+from collections import deque
+
+# Timing spans and counters of the server's operations.
+#
+# span("view.blockMesh") times one stage of an op; the last SPAN_SAMPLES
+# durations of every span are kept for the p50/p95/p99 in the stats.
+# Counters add up bytes sent, processes started and the like. snapshot() is
+# what the "stats" op returns; with SIMONMESH_METRICS_FILE set the same is
+# also written in the Prometheus text format (e.g. for the node_exporter
+# textfile collector), at most every METRICS_INTERVAL seconds.
+
+SPAN_SAMPLES = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_FILE = os.environ.get("SIMONMESH_METRICS_FILE")
+METRICS_INTERVAL = float(os.environ.get("SIMONMESH_METRICS_INTERVAL", 10))
+PREFIX = "simonmesh"
+
+_spans = {}
+_counters = {}
+_dumped = 0.0
+
+
+class Histogram:
+    def __init__(self):
+        self.samples = deque(maxlen=SPAN_SAMPLES)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def summary(self):
+        '''count, sum, mean and max over all samples, quantiles over the recent ones.'''
+        samples = sorted(self.samples)
+        res = {"count": self.count, "sum": self.sum,
+               "mean": self.sum / self.count if self.count else 0.0, "max": self.max}
+        for q in QUANTILES:
+            # nearest rank
+            res[f'p{round(q * 100)}'] = samples[min(int(q * len(samples)), len(samples) - 1)] if samples else 0.0
+        return res
+
+
+def observe(name, seconds):
+    histogram = _spans.get(name)
+    if histogram is None:
+        histogram = _spans[name] = Histogram()
+    histogram.observe(seconds)
+
+
+def count(name, n=1):
+    _counters[name] = _counters.get(name, 0) + n
+
+
+@contextlib.contextmanager
+def span(name):
+    '''Time the body as span name; failed and cancelled runs count too.'''
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t)
+
+
+def snapshot():
+    return {"spans": {name: h.summary() for name, h in sorted(_spans.items())},
+            "counters": dict(sorted(_counters.items()))}
+
+
+def reset():
+    _spans.clear()
+    _counters.clear()
+
+
+def _metric_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def prometheus_text(stats, gauges=None):
+    '''Render a snapshot() (and flat {name: number} gauges) in the Prometheus text format.'''
+    lines = [f'# TYPE {PREFIX}_span_seconds summary']
+    for name, summary in stats["spans"].items():
+        for q in QUANTILES:
+            lines.append(f'{PREFIX}_span_seconds{{span="{name}",quantile="{q}"}} {summary[f"p{round(q * 100)}"]:.6g}')
+        lines.append(f'{PREFIX}_span_seconds_sum{{span="{name}"}} {summary["sum"]:.6g}')
+        lines.append(f'{PREFIX}_span_seconds_count{{span="{name}"}} {summary["count"]}')
+    for name, value in stats["counters"].items():
+        metric = f'{PREFIX}_{_metric_name(name)}_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    for name, value in (gauges or {}).items():
+        metric = f'{PREFIX}_{_metric_name(name)}'
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def dump(gauges=None, path=None, force=False):
+    '''Write the Prometheus file if one is configured and it is due.'''
+    global _dumped
+    path = path or METRICS_FILE
+    now = time.monotonic()
+    if not path or (not force and now - _dumped < METRICS_INTERVAL):
+        return False
+    _dumped = now
+    tmp = f'{path}.tmp'
+    # replaced atomically, a scrape never sees half a file
+    with open(tmp, 'w') as f:
+        f.write(prometheus_text(snapshot(), gauges))
+    os.replace(tmp, path)
+    return True
@@ -1,252 +1,357 @@
 import os
 import json
 import asyncio
-import subprocess
 from pathlib import Path
 from toDICT import *
+from processEngine import run_process, print_line, ProcessTimeout, ProcessCancelled
+from polyMeshReader import write_patch_vtks, read_boundary, PolyMeshError
+from meshCache import get_mesh_cache, geometry_files
+from patchStream import patch_sender, is_legacy, resume_patch
+from surfacePayload import negotiate_format
+from logTailer import subscribe_log, unsubscribe_log, tailer_stats
+from residualLog import residual_payload
+from foamDict import FoamDictError
+from workerPool import run_in_worker, worker_stats
+from jobScheduler import get_scheduler, JobSuperseded
+from shellPool import SHELL_POOL, ShellError, shell_pool
+from metrics import METRICS_FILE, span, count, snapshot, dump
+from stlUpload import receive_upload
+from stlGeometry import case_geometry
+from blockPreview import mesh_preview
+from caseMaterializer import materialize, control_entries, remember_control
 import re
 # import matplotlib.pyplot as plt
 import io
 import base64
 
-async def parse_bc_name(part):
-    reverse_ = part[::-1]
-    for line in reverse_:
-        if len(line.strip()) > 1:
-            return line.strip()
-    return ""
-    
-async def parse_bc_info(part):
-    type_ = ""
-    nFaces_ = ""
-    startFace_ = ""
-    
-    for line in part:
-        if line.find("type") >= 0 and line.find(';') > 0:
-            line = line[0:line.find(';')];
-            result = re.split(r'[\t ]+', line)
-            type_ = result[-1]
-            
-        if line.find("nFaces") >= 0 and line.find(';') > 0:
-            line = line[0:line.find(';')];
-            result = re.split(r'[\t ]+', line)
-            nFaces_ = result[-1]
-            
-        if line.find("startFace") >= 0 and line.find(';') > 0:
-            line = line[0:line.find(';')];
-            result = re.split(r'[\t ]+', line)
-            startFace_ = result[-1]
-            
-    return type_, nFaces_, startFace_
-
-async def parse_boundary_file(file_path):
-    boundaries = []
-    with open(file_path, 'r') as file:
-        content = file.readlines()
-
-    check_ = -1
-    for index_, l in enumerate(content):
-        if l.find('{') >= 0:
-            start_ = index_
-        if l.find('}') >= 0:
-            end_ = index_
-
-            if (check_ > start_ and end_ > check_):
-                type_, *_ = await parse_bc_info(content[start_:end_ + 1])
-                name_ = await parse_bc_name(content[start_ - 5:start_ + 1])
-                boundaries.append({"name":name_, "type":type_})
-        
-        if l.find('type') > 0:
-            check_ = index_
-        
-    return boundaries
+async def parse_boundary_file(file_path, case_dir=None):
+    '''Parse a polyMesh boundary file in the case's worker process.'''
+    return await run_in_worker(case_dir or os.path.dirname(file_path), read_boundary, file_path)
 
 
 async def websocket_send(websocket, message):
-    await websocket.send(json.dumps(message))
+    text = json.dumps(message)
+    count("bytes_sent", len(text))
+    await websocket.send(text)
 
-async def run_command(command):
+async def run_command(command, shell=False, timeout=None, websocket=None, on_line=None, pool=None):
     """Run a command and return its output."""
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Command failed with error: {e}")
-        return ""
+        if pool is not None:
+            result = await pool.run(command, timeout=timeout, on_line=on_line, websocket=websocket)
+        else:
+            result = await run_process(command, shell=shell, timeout=timeout,
+                                       on_line=on_line, websocket=websocket)
     except FileNotFoundError:
         print("Docker command not found. Is Docker installed?")
         return ""
+    except ProcessTimeout as e:
+        print(f"Command {command} {e}")
+        return ""
+    except ProcessCancelled as e:
+        print(f"Command {command} cancelled: {e}")
+        return ""
+    except ShellError as e:
+        print(f"Command {command} shell failed: {e}")
+        return ""
+    if not result.ok:
+        print(f"Command failed with exit status {result.returncode}: {result.stderr}")
+        return ""
+    return result.stdout.strip()
 
-async def run_linux_command(command):
-    '''Run a command on Linux ruuning on docker and return its output.'''
+async def run_linux_command(command, timeout=None, websocket=None, on_line=print_line):
+    '''Run a command on Linux ruuning on docker and return its output.
+
+    The command runs through the async process engine: output is streamed to
+    on_line while it runs, the number of concurrent OpenFOAM processes is
+    capped, and the process is killed on timeout or when websocket closes.
+    With the shell pool on, it runs in a warm shell that has the OpenFOAM
+    environment sourced already.
+    '''
     # docker exec meshos /bin/bash -c "source /usr/lib/openfoam/openfoam2406/etc/bashrc
     print("command: ", command)
+    if SHELL_POOL and os.name in ('nt', 'posix'):
+        return await run_command(command, timeout=timeout, websocket=websocket, on_line=on_line, pool=shell_pool())
     if os.name == 'nt':
-        try:
-            dCommand_ = ['docker', 'exec', 'meshos', '/bin/bash', '-c', f'source /usr/lib/openfoam/openfoam2406/etc/bashrc && {command}']
-            # dCommand_ = ['docker', 'exec', 'meshos', '/bin/bash', '-c', f'{command}']
-            print(' '.join(dCommand_))
-            result = subprocess.run(dCommand_, capture_output=True, text=True, check=True)
-            print(result.stdout)
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            print(f"Command failed with error: {e}")
-            return ""
-        except FileNotFoundError:
-            print("Docker command not found. Is Docker installed?")
-            return ""
+        dCommand_ = ['docker', 'exec', 'meshos', '/bin/bash', '-c', f'source /usr/lib/openfoam/openfoam2406/etc/bashrc && {command}']
+        # dCommand_ = ['docker', 'exec', 'meshos', '/bin/bash', '-c', f'{command}']
+        print(' '.join(dCommand_))
+        return await run_command(dCommand_, timeout=timeout, websocket=websocket, on_line=on_line)
     elif os.name == 'posix':
-        result = subprocess.run(command, 
-                                capture_output=True, 
-                                text=True, check=True,
-                                shell=True)
-        return result.stdout.strip()
+        return await run_command(command, shell=True, timeout=timeout, websocket=websocket, on_line=on_line)
     else:
         print('Linux command: ', command)
     
+# Number of surfaceMeshExtract jobs one request keeps in flight. The global
+# process cap in processEngine still applies across all clients.
+EXTRACT_WORKERS = int(os.environ.get("SIMONMESH_EXTRACT_WORKERS", 4))
+# Mesh and field output of a case, overridden per request with "writeFormat"
+# (ascii/binary) and "writeCompression" (on/off)
+WRITE_FORMAT = os.environ.get("SIMONMESH_WRITE_FORMAT", "ascii")
+WRITE_COMPRESSION = os.environ.get("SIMONMESH_WRITE_COMPRESSION", "off")
+
+def foam_case_paths(base_dir, case_dir):
+    '''Return (working dir, -case argument) as seen by the OpenFOAM shell.'''
+    # Convert from windows path to linux path
+    if os.name == 'nt':
+        relative_path = Path(case_dir).relative_to(Path(base_dir))
+        return '/OpenFOAM', relative_path.as_posix()
+    return case_dir, case_dir
+
+def request_sender(websocket, obj):
+    '''Patch sender for the protocol, payload format and LOD mode the client asked for,
+    skipping the patches whose hashes the client lists in "known".'''
+    return patch_sender(websocket, obj.get("protocol"), negotiate_format(obj),
+                        obj.get("progressive", False), obj.get("lodTarget", 5000), obj.get("known"))
+
+async def extract_native(case_dir, patchNames, boundaries=None):
+    '''Write patch VTK files straight from constant/polyMesh.
+
+    Returns {patchName: path} for the patches written, empty when the mesh
+    can't be read natively (the caller falls back to surfaceMeshExtract).
+    '''
+    try:
+        if boundaries is None:
+            boundaries = await parse_boundary_file(os.path.join(case_dir, 'constant', 'polyMesh', 'boundary'), case_dir)
+        return await run_in_worker(case_dir, write_patch_vtks, case_dir, boundaries, patchNames)
+    except (OSError, ValueError, PolyMeshError, FoamDictError) as e:
+        print("native patch extraction failed, using surfaceMeshExtract: ", e)
+        return {}
+
+async def extract_patches(patchNames, base_dir, case_dir, websocket, sender, announce=None, workers=EXTRACT_WORKERS,
+                          extractor="native", boundaries=None):
+    '''Extract patch surfaces and stream each one to the client as soon as it is ready.
+
+    With extractor "native" all patches are written in one pass straight
+    from constant/polyMesh; patches it can't produce (and every patch with
+    extractor "surfaceMeshExtract") run surfaceMeshExtract on a bounded
+    worker pool. Finished patches are handed to sender (see patchStream).
+    announce, if given, is the "ops" of the JSON message sent ahead of
+    each transfer. Returns {patchName: path} of the patches extracted.
+    '''
+    foam_dir, case_arg = foam_case_paths(base_dir, case_dir)
+    pool = asyncio.Semaphore(workers)
+
+    for patchName in patchNames:
+        patchPath = os.path.join(case_dir, f'{patchName}.vtk')
+        if os.path.exists(patchPath):
+            os.remove(patchPath)
+
+    native = {}
+    if extractor == "native":
+        with span("extract.native"):
+            native = await extract_native(case_dir, patchNames, boundaries)
+
+    async def extract(patchName):
+        patchPath = os.path.join(case_dir, f'{patchName}.vtk')
+        if patchName not in native:
+            async with pool:
+                with span("extract.surfaceMeshExtract"):
+                    await run_linux_command(f'cd {foam_dir} && surfaceMeshExtract -case {case_arg} -patches "{patchName}" {patchName}.vtk', websocket=websocket)
+
+        if not os.path.exists(patchPath):
+            print("patch not extracted: ", patchName)
+            return
+        extracted[patchName] = patchPath
+        with span("send.patch"):
+            await sender.send(patchName, patchPath, announce)
+
+    extracted = {}
+    await asyncio.gather(*[extract(patchName) for patchName in patchNames])
+    return extracted
+
+def time_window(value):
+    '''(t0, t1) from a [t0, t1] list, either end may be null.'''
+    t0, t1 = value
+    return (None if t0 is None else float(t0), None if t1 is None else float(t1))
+
+def point_budget(value):
+    '''A client's point budget as an int, None for no budget; ValueError for anything else.'''
+    if value is None:
+        return None
+    try:
+        budget = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'budget must be a number of points: {value!r}')
+    if budget < 3:
+        raise ValueError(f'budget must be at least 3 points: {value!r}')
+    return budget
+
+def range_request(message):
+    '''(t0, t1) of a {"range": [t0, t1]} monitor message, None for anything else.'''
+    try:
+        return time_window(json.loads(message)["range"])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+# Ops that write into the case directory, run through the per case job queue
+SCHEDULED_OPS = ("view", "extract", "materialize")
+# Long lived ops, not timed as a whole
+STREAM_OPS = ("monitor", "upload")
+
+def server_stats(base_dir):
+    '''Span histograms and counters, plus the state of the queues and pools.'''
+    return {**snapshot(), "jobs": get_scheduler().stats(), "shells": shell_pool().stats() if SHELL_POOL else None,
+            "workers": worker_stats(), "tailers": tailer_stats(), "meshCache": get_mesh_cache(base_dir).stats()}
+
+def stats_gauges(stats):
+    '''Flat numbers of server_stats() for the Prometheus dump.'''
+    jobs = stats["jobs"]
+    gauges = {"jobs_depth": sum(case["depth"] for case in jobs["cases"].values()),
+              "jobs_running": sum(case["running"] is not None for case in jobs["cases"].values()),
+              "jobs_wait_mean_seconds": jobs["wait"]["mean"], "jobs_wait_max_seconds": jobs["wait"]["max"],
+              "log_tailers": len(stats["tailers"]),
+              "log_subscribers": sum(t["subscribers"] for t in stats["tailers"].values())}
+    for key in ("superseded", "failed"):
+        gauges[f"jobs_{key}"] = jobs[key]
+    for key, value in (stats["shells"] or {}).items():
+        gauges[f"shells_{key}"] = value
+    for key, value in stats["meshCache"].items():
+        gauges[f"mesh_cache_{key}"] = value
+    return gauges
+
 async def openfoamServer(obj, blockMeshObj, base_dir,case_dir, websocket, connected_clients):
+    ops = obj.get("ops")
+    if ops == 'jobs':
+        await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+            "status": "success",
+            "ops": "jobs", "stats": get_scheduler().stats()})
+        return
+    if ops == 'stats':
+        stats = server_stats(base_dir)
+        dump(stats_gauges(stats), force=True)
+        await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+            "status": "success",
+            "ops": "stats", "stats": stats})
+        return
+    count(f"op_{ops}")
+    try:
+        if ops in STREAM_OPS:
+            return await openfoam_ops(obj, blockMeshObj, base_dir, case_dir, websocket, connected_clients)
+        with span(f"op.{ops}"):
+            return await scheduled_ops(obj, blockMeshObj, base_dir, case_dir, websocket, connected_clients)
+    finally:
+        if METRICS_FILE:
+            dump(stats_gauges(server_stats(base_dir)))
+
+async def scheduled_ops(obj, blockMeshObj, base_dir,case_dir, websocket, connected_clients):
+    ops = obj.get("ops")
+    if ops not in SCHEDULED_OPS:
+        return await openfoam_ops(obj, blockMeshObj, base_dir, case_dir, websocket, connected_clients)
+    try:
+        return await get_scheduler().run(case_dir, ops,
+            lambda: openfoam_ops(obj, blockMeshObj, base_dir, case_dir, websocket, connected_clients))
+    except JobSuperseded as e:
+        print("openfoamOps: ", e)
+        await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+            "status": "superseded",
+            "ops": ops})
+
+async def openfoam_ops(obj, blockMeshObj, base_dir,case_dir, websocket, connected_clients):
     print("openfoamServer: ", obj, "ops" in obj)
     if not "ops" in obj:
         return {"status": "faile", "message": "No ops in the request."}
     ops = obj["ops"]
     if ops == 'view':
-        blockMeshDict = ToMeshDICT(blockMeshObj, os.path.join(case_dir, 'octopus.dict'))
-        blockMeshDict.write()
-        controlDict = ToControlDICT(os.path.join(case_dir, 'system', 'controlDict'))
-        controlDict.write()
-
-        # Convert from windows path to linux path
-        if os.name == 'nt':
-            base_ = Path(base_dir)
-            case_ = Path(case_dir)
-            relative_path = case_.relative_to(base_)
-            relative_path_linux = relative_path.as_posix()
-            case_linux = os.path.join('/OpenFOAM', relative_path_linux)
-        
-            await run_linux_command(f'cd /OpenFOAM && blockMesh -case {relative_path_linux} -dict octopus.dict')
-
-            patches = obj["para"]
-            print('server patches: ', patches)
-            for patch in patches:
-                print(patch)
-                patchName = patch["name"]
-                # Checking under windows
-                patchPath = os.path.join(case_dir, f'{patchName}.vtk')
-
-                if os.path.exists(patchPath):
-                    os.remove(patchPath)
+        if os.name not in ('nt', 'posix'):
+            print("Later")
+            await websocket_send(websocket, {"name": "server", "target": "ofMesh", 
+                "status": "fail",
+                "ops": "create"})
+            return
 
-                await run_linux_command(f'cd /OpenFOAM && surfaceMeshExtract -case {relative_path_linux} -patches "{patchName}" {patchName}.vtk')
+        # decoding the mesh JSON and rendering the dictionary are CPU bound,
+        # they run in the case's worker process, which keeps the block model:
+        # a "modelDelta" (changes since version "base") is applied to it in
+        # place, the full model JSON is only decoded when that is not possible
+        # keeps what the last materialize op set (application, endTime...)
+        control = control_entries(case_dir) or {}
+        writeFormat = obj.get("writeFormat", control.get("writeFormat", WRITE_FORMAT))
+        if writeFormat not in WRITE_FORMATS:
+            await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+                "status": "fail",
+                "ops": "view", "error": f'writeFormat must be one of {WRITE_FORMATS}: {writeFormat}'})
+            return
 
-            await run_linux_command(f'cd /OpenFOAM && surfaceMeshExtract -case {relative_path_linux} -patches "walls" walls.vtk')
+        dictFile = os.path.join(case_dir, 'octopus.dict')
+        with span("view.dict"):
+            rendered = None
+            if obj.get("modelDelta"):
+                rendered = await run_in_worker(case_dir, render_mesh_dict, None, dictFile, obj["modelDelta"])
+            if rendered is None:
+                version = obj.get("modelVersion", (obj.get("modelDelta") or {}).get("version"))
+                rendered = await run_in_worker(case_dir, render_mesh_dict, blockMeshObj.getObj(), dictFile, None,
+                                               version)
+            dictDigest, geometry = rendered
+            controlDict = ToControlDICT(os.path.join(case_dir, 'system', 'controlDict'), writeFormat,
+                                        obj.get("writeCompression", control.get("writeCompression", WRITE_COMPRESSION)),
+                                        control)
+            controlDict.write()
+        sender = request_sender(websocket, obj)
+        # a superseded (cancelled) view stops between patches, the protocol 2
+        # streamer task is not left waiting for patches that never come
+        try:
+            if obj.get("preview"):
+                # block outlines, graded grid lines and patch faces straight from
+                # the model, drawn by the client until the patches below arrive
+                with span("view.preview"):
+                    preview = await run_in_worker(case_dir, mesh_preview, dictFile,
+                                                  negotiate_format(obj) == "surface+zlib")
+                    if preview is not None:
+                        data, description = preview
+                        await sender.send_payload("preview", data, "preview", None, "preview", {"preview": description})
+            if geometry:
+                # ASCII STLs are rewritten as binary before blockMesh reads them
+                with span("view.geometry"):
+                    await run_in_worker(case_dir, case_geometry, case_dir, base_dir, [g["name"] for g in geometry])
 
-            print("before patches: ", patches)
+            patches = obj["para"]
+            print('server patches: ', patches)
             patches.append({"name": "walls"})
-            print("after patches: ", patches)
+            patchNames = [patch["name"] for patch in patches]
+            extractor = obj.get("extractor", "native")
+
+            # Same dictionaries, STL files and patch list give the same mesh;
+            # hashing and copying run in threads, off the event loop
+            cache = get_mesh_cache(base_dir)
+            cacheKey = await asyncio.to_thread(cache.key, [dictDigest, controlDict.meshKey(), extractor],
+                                               geometry_files(case_dir, geometry), patchNames)
+            entry = await asyncio.to_thread(cache.get, cacheKey)
+            if entry is not None:
+                print("mesh cache hit: ", cacheKey, cache.stats())
+                try:
+                    with span("view.cacheRestore"):
+                        await asyncio.to_thread(cache.restore, entry, case_dir)
+                except OSError as e:
+                    print("mesh cache entry not restored, meshing again: ", e)
+                    entry = None
+            if entry is not None:
+                with span("view.send"):
+                    for patchName in entry["patches"]:
+                        await sender.send(patchName, os.path.join(case_dir, f'{patchName}.vtk'), "view")
+                    await sender.close()
+                return
+
+            foam_dir, case_arg = foam_case_paths(base_dir, case_dir)
+            with span("view.blockMesh"):
+                meshed = await run_linux_command(f'cd {foam_dir} && blockMesh -case {case_arg} -dict octopus.dict', websocket=websocket)
 
             # surfaceMeshExtract -case {relative_path_linux} '(patch)' patchName.vtk 
             # objOutput = await run_linux_command(f'cd /OpenFOAM && surfaceMeshExtract -case {relative_path_linux} surfaceMesh.vtk')
-            
-            for patch in patches:
-                patchName = patch["name"]
-                objPath = os.path.join(case_dir, f'{patchName}.vtk')
-                if os.path.exists(objPath):
-                    await websocket_send(websocket, {"name": patchName, "target": "ofMesh", 
-                    "status": "success",
-                    "ops": "view", "url": objPath})
-                    '''
-                    chunkSize = 64 * 1024 # 64KB chunk size
-                    with open(objPath, 'rb') as f:
-                        while chunk := f.read(chunkSize):
-                            await websocket.send(chunk)
-                    await websocket.send(b'__END__')
-                    print(f'Sent chunk of size {len(chunk)} bytes')
-                    '''
-                    print("objFile sent to client successfully")
-            
-            CHUNK_SIZE = 1024 * 64  # 64 KB per chunk
-            for patch in patches:
-                patchName = patch["name"]
-                objPath = os.path.join(case_dir, f'{patchName}.vtk')
-                if os.path.exists(objPath):
-                    file_size = os.path.getsize(objPath)
-                    total_chunks = (file_size // CHUNK_SIZE) + (1 if file_size % CHUNK_SIZE else 0)
-
-                    await websocket.send(f"__START__:{patchName}:{total_chunks}")
-
-                    with open(objPath, "rb") as f:
-                        for _ in range(total_chunks):
-                            chunk = f.read(CHUNK_SIZE)
-                            await websocket.send(chunk)
-                            await asyncio.sleep(0.01)  # Allow time for transmission
-
-                    await websocket.send("__END__")  # Mark file transfer complete
-
-        elif os.name == 'posix':
-            await run_linux_command(f'cd {case_dir} && blockMesh -case {case_dir} -dict octopus.dict')
-            objOutput = await run_linux_command(f'cd {case_dir} && surfaceMeshExtract -case {case_dir} surfaceMesh.vtk')
+            # patches are streamed while others are still extracted, view.send
+            # is what is left to send once the last one is ready
+            with span("view.extract"):
+                extracted = await extract_patches(patchNames, base_dir, case_dir, websocket, sender, announce="view",
+                                                  extractor=extractor)
+            with span("view.send"):
+                await sender.close()
+            mesh_dir = os.path.join(case_dir, 'constant', 'polyMesh')
+            if meshed and extracted and os.path.isdir(mesh_dir):
+                await asyncio.to_thread(cache.put, cacheKey, extracted, mesh_dir)
             print("openfoamOps: ", ops, " success!")
-            print(objOutput)
-
-            patches = obj["para"]
-            print('server patches: ', patches)
-            for patch in patches:
-                print(patch)
-                patchName = patch["name"]
-                # Checking under windows
-                patchPath = os.path.join(case_dir, f'{patchName}.vtk')
-
-                if os.path.exists(patchPath):
-                    os.remove(patchPath)
-
-                await run_linux_command(f'cd {case_dir} && surfaceMeshExtract -case {case_dir} -patches "{patchName}" {patchName}.vtk')
-
-            await run_linux_command(f'cd {case_dir} && surfaceMeshExtract -case {case_dir} -patches "walls" walls.vtk')
-
-            print("before patches: ", patches)
-            patches.append({"name": "walls"})
-            print("after patches: ", patches)
-
-            for patch in patches:
-                patchName = patch["name"]
-                objPath = os.path.join(case_dir, f'{patchName}.vtk')
-                if os.path.exists(objPath):
-                    await websocket_send(websocket, {"name": patchName, "target": "ofMesh", 
-                    "status": "success",
-                    "ops": "view", "url": objPath})
-                    '''
-                    chunkSize = 64 * 1024 # 64KB chunk size
-                    with open(objPath, 'rb') as f:
-                        while chunk := f.read(chunkSize):
-                            await websocket.send(chunk)
-                    await websocket.send(b'__END__')
-                    print(f'Sent chunk of size {len(chunk)} bytes')
-                    '''
-                    print("objFile sent to client successfully")
-
-            CHUNK_SIZE = 1024 * 64  # 64 KB per chunk
-            for patch in patches:
-                patchName = patch["name"]
-                objPath = os.path.join(case_dir, f'{patchName}.vtk')
-                if os.path.exists(objPath):
-                    file_size = os.path.getsize(objPath)
-                    total_chunks = (file_size // CHUNK_SIZE) + (1 if file_size % CHUNK_SIZE else 0)
-
-                    await websocket.send(f"__START__:{patchName}:{total_chunks}")
-
-                    with open(objPath, "rb") as f:
-                        for _ in range(total_chunks):
-                            chunk = f.read(CHUNK_SIZE)
-                            await websocket.send(chunk)
-                            await asyncio.sleep(0.01)  # Allow time for transmission
-
-                    await websocket.send("__END__")  # Mark file transfer complete
-
-        else:
-            print("Later")
-            await websocket_send(websocket, {"name": "server", "target": "ofMesh", 
-                "status": "fail",
-                "ops": "create"})
+        finally:
+            sender.cancel()
             
         '''
         objPath = os.path.join(case_dir, 'surfaceMesh.vtk')
@@ -279,134 +384,115 @@ async def openfoamServer(obj, blockMeshObj, base_dir,case_dir, websocket, connec
                 "status": "fail",
                 "ops": "extract"})
             return
-        boundary_dict = await parse_boundary_file(os.path.join(case_dir, 'constant', 'polyMesh', 'boundary'))
+        with span("extract.boundary"):
+            boundary_dict = await parse_boundary_file(os.path.join(case_dir, 'constant', 'polyMesh', 'boundary'), case_dir)
         print('boundary_dict: ', boundary_dict)
-        if os.name == 'nt':
-            base_ = Path(base_dir)
-            case_ = Path(case_dir)
-            relative_path = case_.relative_to(base_)
-            relative_path_linux = relative_path.as_posix()
-            case_linux = os.path.join('/OpenFOAM', relative_path_linux)
-
-            print('server patches: ', boundary_dict)
-            for patch in boundary_dict:
-                patchName = patch["name"]
-                # Checking under windows
-                patchPath = os.path.join(case_dir, f'{patchName}.vtk')
-
-                if os.path.exists(patchPath):
-                    os.remove(patchPath)
-
-                await run_linux_command(f'cd /OpenFOAM && surfaceMeshExtract -case {relative_path_linux} -patches "{patchName}" {patchName}.vtk')
-
-            CHUNK_SIZE = 1024 * 64  # 64 KB per chunk
-            for patch in boundary_dict:
-                patchName = patch["name"]
-                objPath = os.path.join(case_dir, f'{patchName}.vtk')
-                if os.path.exists(objPath):
-                    file_size = os.path.getsize(objPath)
-                    total_chunks = (file_size // CHUNK_SIZE) + (1 if file_size % CHUNK_SIZE else 0)
-
-                    await websocket.send(f"__START__:{patchName}:{total_chunks}")
-
-                    with open(objPath, "rb") as f:
-                        for _ in range(total_chunks):
-                            chunk = f.read(CHUNK_SIZE)
-                            await websocket.send(chunk)
-                            await asyncio.sleep(0.01)  # Allow time for transmission
-
-                    await websocket.send("__END__")  # Mark file transfer complete
+        # protocol 2 needs the announcement to map transfer ids to patch names
+        sender = request_sender(websocket, obj)
+        try:
+            with span("extract.extract"):
+                await extract_patches([patch["name"] for patch in boundary_dict], base_dir, case_dir, websocket,
+                                      sender, announce="extract" if not is_legacy(sender) else None,
+                                      extractor=obj.get("extractor", "native"), boundaries=boundary_dict)
+            with span("extract.send"):
+                await sender.close()
+        finally:
+            sender.cancel()
+
+    if ops == 'resume':
+        await resume_patch(websocket, obj)
+
+    if ops == 'upload':
+        # chunked binary STL upload into constant/geometry, see stlUpload
+        await receive_upload(websocket, obj, base_dir, case_dir)
+
+    if ops == 'materialize':
+        # system/, constant/ and 0/ files of the case from one spec, only
+        # the files whose content changed are written
+        try:
+            result = await run_in_worker(case_dir, materialize, case_dir, obj.get("para") or {})
+        except (ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+            print("materialize failed: ", e)
+            await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+                "status": "fail",
+                "ops": "materialize", "error": str(e)})
+            return
+        remember_control(case_dir, result.pop("control"))
+        await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+            "status": "success",
+            "ops": "materialize", **result})
+
+    if ops == 'geometryInfo':
+        # bounding box, area, watertightness... of the case's STL files,
+        # cached by content so only new files are analysed
+        names = (obj.get("para") or {}).get("names")
+        info = await run_in_worker(case_dir, case_geometry, case_dir, base_dir, names)
+        await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+            "status": "success",
+            "ops": "geometryInfo", "geometry": info})
         
     if ops == 'monitor':
         print('process log file: ', obj)
         runLogName = obj["para"]["run"] or "log.run" 
         log_file = os.path.join(case_dir, runLogName)
         print('log_file: ', log_file)
-        patterns = {
-            "Ux": re.compile(r"Solving for Ux, Initial residual = ([\d.eE+-]+)"),
-            "Uy": re.compile(r"Solving for Uy, Initial residual = ([\d.eE+-]+)"),
-            "Uz": re.compile(r"Solving for Uz, Initial residual = ([\d.eE+-]+)"),
-            "p": re.compile(r"Solving for p, Initial residual = ([\d.eE+-]+)"),
-            "continuity": re.compile(r"continuity errors : .* global = ([\d.eE+-]+)"),
-            "time": re.compile(r"^Time = ([\d.eE+-]+)")
-        }
-        
-        residuals = {key: [] for key in patterns}
-
-        count = {key: 0 for key in patterns}
-
-        # Function to process a line of the log file
-        def process_line(line):
-            global count
-            for key, pattern in patterns.items():
-                match = pattern.search(line)
-                if match:
-                    value_ = float(match.group(1))
-                    if key == "time":
-                        count = {ki: 0 for ki in patterns}
-                        logValue = value_
-                    else:
-                        logValue = np.log10(np.abs(value_)) * np.sign(value_)
-                    if count[key] == 0:
-                        residuals[key].append(logValue)
-                        count[key] += 1
-        
-        # Read existing data in the log file
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as file:
-                for line in file:
-                    process_line(line)
-
-        if any(residuals[key] for key in residuals):
-            # Generate the plot and send it as a base64-encoded image
-            # print("Sending plot data...")
-            # plot_data = generate_plot()
-            # await websocket.send(json.dumps({"plot": plot_data}))
-            await websocket.send(json.dumps(residuals))
-            for key in residuals:
-                residuals[key].clear()
-
+        # One shared tailer per log file parses it once for every client and
+        # publishes coalesced updates; the first update holds the history,
+        # read from the residual index next to the log. "budget" caps the
+        # points sent per field (downsampled with "downsample": minmax or
+        # lttb) and "viewport" [t0, t1] limits the history; a zoom message
+        # {"range": [t0, t1], "budget": n} gets that window refined.
+        para = obj["para"]
+        rate = para.get("rate")
+        try:
+            budget = point_budget(para.get("budget"))
+        except ValueError as e:
+            await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+                "status": "fail",
+                "ops": "monitor", "error": str(e)})
+            return
+        method = para.get("downsample", "minmax")
+        viewport = time_window(para["viewport"]) if para.get("viewport") else None
+        sub = subscribe_log(log_file, float(rate) if rate else None, viewport)
+        recv = asyncio.ensure_future(websocket.recv())
+        update = None
         running = True
-        # Tail the log file
-        while running:
-
-            try:
-                with open(log_file, 'r') as file:
-                    file.seek(0, 2)
-                    while running:
-                        line = file.readline()
-                        if line:
-                            process_line(line)
-                            if any(residuals[key] for key in residuals):
-                                await websocket.send(json.dumps(residuals))
-                                for key in residuals:
-                                    residuals[key].clear()
-                        else:
-                            await asyncio.sleep(1)
-
-                        try:
-                            message = await asyncio.wait_for(websocket.recv(), timeout=0.1)
-                            print(f"Received message in inner loop: {message}")
-                            if message == "stop":
-                                print("Received 'stop' command. Exiting loop.")
-                                running = False
-                        except asyncio.TimeoutError:
-                            pass  # No message received, continue looping
-                        
-            except FileNotFoundError:
-                print("Log file not found. Retrying in 5 seconds...")
-                await asyncio.sleep(5)
-            except Exception as e:
-                print(f"Error: {e}")
-                await asyncio.sleep(5)
-
-
-            try:
-                message = await asyncio.wait_for(websocket.recv(), timeout=0.1)
-                print(f"Received message in outer loop: {message}")
-                if message == "stop":
-                    print("Received 'stop' command. Exiting loop.")
-                    running = False
-            except asyncio.TimeoutError:
-                pass  # No message received, continue looping
-
+        try:
+            while running:
+                if update is None or update.done():
+                    update = asyncio.ensure_future(sub.get())
+                done, _ = await asyncio.wait({recv, update}, return_when=asyncio.FIRST_COMPLETED)
+                if update in done:
+                    reset, times, series = update.result()
+                    with span("monitor.payload"):
+                        residuals = residual_payload(times, series, budget, method)
+                    if reset:
+                        residuals["reset"] = [True]
+                    await websocket_send(websocket, residuals)
+                if recv in done:
+                    message = recv.result()
+                    print(f"Received message in monitor loop: {message}")
+                    if message == "stop":
+                        print("Received 'stop' command. Exiting loop.")
+                        running = False
+                    else:
+                        window = range_request(message)
+                        if window:
+                            try:
+                                zoom = point_budget(json.loads(message).get("budget", budget))
+                            except ValueError as e:
+                                await websocket_send(websocket, {"name": "server", "target": "ofMesh",
+                                    "status": "fail",
+                                    "ops": "monitor", "range": list(window), "error": str(e)})
+                                recv = asyncio.ensure_future(websocket.recv())
+                                continue
+                            with span("monitor.query"):
+                                residuals = residual_payload(*await sub.tailer.query(*window), zoom, method)
+                            residuals["range"] = list(window)
+                            await websocket_send(websocket, residuals)
+                        recv = asyncio.ensure_future(websocket.recv())
+        finally:
+            for task in (recv, update):
+                if task is not None and not task.done():
+                    task.cancel()
+            unsubscribe_log(sub)
@@ -0,0 +1,366 @@
+import os
+import json
+import zlib
+import struct
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from metrics import count
+from meshCache import file_digest
+from surfacePayload import load_payload, read_surface, full_payload, coarse_payload
+
+# Patch transfer to the client.
+#
+# protocol 1 (legacy): "__START__:{name}:{chunks}" text frame, 64 KB binary
+#   chunks, "__END__" text frame, one patch after the other.
+# protocol 2: every binary frame starts with a fixed header carrying the
+#   transfer id, offset, total size and crc32 of the whole payload, so
+#   patches can be interleaved over one socket and a transfer can be resumed
+#   at any offset after a reconnect. Each transfer is announced by a JSON
+#   message holding name/id/size/crc before its first frame.
+#
+#   header: magic "SMPF", version u8, flags u8, reserved u16, id u32,
+#           offset u64, total u64, crc32 u32, length u32 (big endian)
+#
+# Every patch announcement carries "hash", the sha256 of the patch file.
+# A client lists the hashes it holds in "known" ({patchName: hash} or a
+# list of hashes); patches whose hash it knows are announced with
+# "unchanged": true and no data follows.
+
+CHUNK_SIZE = 1024 * 64  # 64 KB per chunk
+MAGIC = b'SMPF'
+VERSION = 2
+HEADER = struct.Struct('!4sBBHIQQII')
+FLAG_FIRST = 1
+FLAG_LAST = 2
+# Finished transfers kept in memory so a reconnecting client can resume them
+RESUME_BYTES = int(os.environ.get("SIMONMESH_RESUME_MB", 256)) * 1024 * 1024
+
+_ids = itertools.count(1)
+_transfers = OrderedDict()
+
+
+async def uninterrupted(aw):
+    '''Await aw to the end even if the caller is cancelled meanwhile.
+
+    The cancellation is raised once aw is done, so a superseded job stops
+    between transfers (protocol 1) or frames (protocol 2), never inside one.
+    '''
+    task = asyncio.ensure_future(aw)
+    cancelled = False
+    while True:
+        try:
+            result = await asyncio.shield(task)
+            break
+        except asyncio.CancelledError:
+            if task.done():
+                raise
+            cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError()
+    return result
+
+
+async def send_json(websocket, message):
+    text = json.dumps(message)
+    count("bytes_sent", len(text))
+    await websocket.send(text)
+
+
+async def send_patch_data(websocket, patchName, data):
+    data = memoryview(data)
+    total_chunks = (len(data) // CHUNK_SIZE) + (1 if len(data) % CHUNK_SIZE else 0)
+
+    await websocket.send(f"__START__:{patchName}:{total_chunks}")
+
+    for i in range(total_chunks):
+        chunk = data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]
+        count("bytes_sent", len(chunk))
+        await websocket.send(bytes(chunk))
+        await asyncio.sleep(0.01)  # Allow time for transmission
+
+    await websocket.send("__END__")  # Mark file transfer complete
+    count("patches_sent")
+
+
+class Transfer:
+    def __init__(self, name, data, url=None, fmt="vtk"):
+        self.id = next(_ids)
+        self.name = name
+        self.format = fmt
+        self.data = memoryview(data)
+        self.size = len(data)
+        self.crc = zlib.crc32(data)
+        self.url = url
+
+    def header(self, offset, length):
+        flags = (FLAG_FIRST if offset == 0 else 0) | (FLAG_LAST if offset + length >= self.size else 0)
+        return HEADER.pack(MAGIC, VERSION, flags, 0, self.id, offset, self.size, self.crc, length)
+
+    def frame(self, offset, chunk_size=CHUNK_SIZE):
+        chunk = self.data[offset:offset + chunk_size]
+        return self.header(offset, len(chunk)) + chunk
+
+    def describe(self):
+        return {"name": self.name, "id": self.id, "size": self.size, "crc": self.crc,
+                "protocol": VERSION, "format": self.format}
+
+
+def register(transfer):
+    _transfers[transfer.id] = transfer
+    total = sum(t.size for t in _transfers.values())
+    while total > RESUME_BYTES and len(_transfers) > 1:
+        _, old = _transfers.popitem(last=False)
+        total -= old.size
+    return transfer
+
+
+def get_transfer(transferId, crc=None):
+    transfer = _transfers.get(transferId)
+    if transfer is None or (crc is not None and transfer.crc != crc):
+        return None
+    _transfers.move_to_end(transferId)
+    return transfer
+
+
+def parse_frame(frame):
+    '''Split a protocol 2 frame into (header dict, payload), for clients and tools.'''
+    magic, version, flags, _, transferId, offset, total, crc, length = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ValueError('not a patch frame')
+    return ({"version": version, "flags": flags, "id": transferId, "offset": offset,
+             "total": total, "crc": crc, "length": length},
+            frame[HEADER.size:HEADER.size + length])
+
+
+class LegacySender:
+    '''protocol 1, one patch at a time.'''
+    def __init__(self, websocket, fmt="vtk"):
+        self.websocket = websocket
+        self.format = fmt
+        self.lock = asyncio.Lock()
+
+    async def send(self, patchName, patchPath, announce=None, extra=None):
+        data, fmt = await asyncio.to_thread(load_payload, patchPath, self.format)
+        await self.send_payload(patchName, data, fmt, patchPath, announce, extra)
+
+    async def send_payload(self, patchName, data, fmt, url, announce=None, extra=None):
+        async with self.lock:
+            # a cancelled __START__ ... __END__ sequence would leave the client
+            # reading whatever comes next as chunks
+            await uninterrupted(self.transmit(patchName, data, fmt, url, announce, extra))
+
+    async def transmit(self, patchName, data, fmt, url, announce, extra):
+        if announce is not None:
+            message = {"name": patchName, "target": "ofMesh",
+            "status": "success",
+            "ops": announce, "url": url}
+            if fmt != "vtk":
+                message["format"] = fmt
+            message.update(extra or {})
+            await send_json(self.websocket, message)
+        await send_patch_data(self.websocket, patchName, data)
+        print("objFile sent to client successfully: ", patchName)
+
+    async def close(self):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class PatchStreamer:
+    '''protocol 2, patches added while others are in flight are interleaved.
+
+    Frames go out round robin, one chunk per active transfer. There is no
+    pacing: each send waits for the websocket write buffer to drain, which
+    is the only flow control needed.
+    '''
+    def __init__(self, websocket, fmt="vtk", chunk_size=CHUNK_SIZE):
+        self.websocket = websocket
+        self.format = fmt
+        self.chunk_size = chunk_size
+        self.active = deque()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.task = None
+
+    async def send(self, patchName, patchPath, announce=None, extra=None):
+        data, fmt = await asyncio.to_thread(load_payload, patchPath, self.format)
+        await self.send_payload(patchName, data, fmt, patchPath, announce, extra)
+
+    async def send_payload(self, patchName, data, fmt, url, announce=None, extra=None):
+        transfer = register(Transfer(patchName, data, url, fmt))
+        await self.start(transfer, 0, announce or "patch", extra)
+
+    async def start(self, transfer, offset, announce, extra=None):
+        message = {"target": "ofMesh", "status": "success", "ops": announce, "url": transfer.url,
+                   "offset": offset}
+        message.update(transfer.describe())
+        message.update(extra or {})
+        await send_json(self.websocket, message)
+        self.active.append([transfer, offset])
+        self.wakeup.set()
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            if not self.active:
+                if self.closed:
+                    return
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            entry = self.active.popleft()
+            transfer, offset = entry
+            frame = transfer.frame(offset, self.chunk_size)
+            await uninterrupted(self.websocket.send(frame))
+            count("bytes_sent", len(frame))
+            entry[1] = offset + len(frame) - HEADER.size
+            if entry[1] < transfer.size:
+                self.active.append(entry)
+            else:
+                count("patches_sent")
+                print("objFile sent to client successfully: ", transfer.name)
+
+    async def close(self):
+        '''Wait until every added transfer is fully sent.'''
+        self.closed = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+
+    def cancel(self):
+        '''Stop sending (after the frame in flight), for a job that ends early.'''
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class ProgressiveSender:
+    '''Level of detail wrapper around a sender.
+
+    Every patch is sent decimated (lod 0) as soon as it is ready, the full
+    resolution versions (lod 1) only follow once all coarse ones are out,
+    so the client can draw the whole model early and refine it.
+    '''
+    def __init__(self, sender, target=5000):
+        self.sender = sender
+        self.target = target
+        self.pending = []
+
+    async def send(self, patchName, patchPath, announce=None, extra=None):
+        announce = announce or "patch"
+        surface = await asyncio.to_thread(read_surface, patchPath)
+        coarse = await asyncio.to_thread(coarse_payload, surface, self.sender.format, self.target, patchName)
+        if coarse is None:
+            # small patch, the full resolution is the coarse level
+            data, fmt = await asyncio.to_thread(full_payload, surface, self.sender.format)
+            await self.sender.send_payload(patchName, data, fmt, patchPath, announce,
+                                           {**(extra or {}), "lod": 0, "lods": 1})
+            return
+        await self.sender.send_payload(patchName, *coarse, patchPath, announce, {**(extra or {}), "lod": 0, "lods": 2})
+        self.pending.append((patchName, surface, patchPath, announce, extra))
+
+    async def send_payload(self, patchName, data, fmt, url, announce=None, extra=None):
+        # ready made payloads (the block preview) have a single level
+        await self.sender.send_payload(patchName, data, fmt, url, announce, extra)
+
+    async def close(self):
+        for patchName, surface, patchPath, announce, extra in self.pending:
+            data, fmt = await asyncio.to_thread(full_payload, surface, self.sender.format)
+            await self.sender.send_payload(patchName, data, fmt, patchPath, announce,
+                                           {**(extra or {}), "lod": 1, "lods": 2})
+        self.pending = []
+        await self.sender.close()
+
+    def cancel(self):
+        self.sender.cancel()
+
+
+class HashingSender:
+    '''Content hash wrapper around a sender.
+
+    Adds the sha256 of every patch file to its announcement and only
+    announces (without data) the patches the client already holds.
+    '''
+    def __init__(self, sender, websocket, known=None):
+        self.sender = sender
+        self.websocket = websocket
+        # {patchName: hash}, or a list of hashes held under any name
+        self.known = known if isinstance(known, dict) else set(known or ())
+        self.hashes = {}
+
+    def holds(self, patchName, digest):
+        if isinstance(self.known, dict):
+            return self.known.get(patchName) == digest
+        return digest in self.known
+
+    async def send(self, patchName, patchPath, announce=None, extra=None):
+        digest = await asyncio.to_thread(file_digest, patchPath)
+        self.hashes[patchName] = digest
+        # legacy extract sends no announcements, so nothing can be skipped there
+        if announce is not None and self.holds(patchName, digest):
+            await send_json(self.websocket, {"name": patchName, "target": "ofMesh", "status": "success",
+                                             "ops": announce, "url": patchPath, "hash": digest,
+                                             "unchanged": True, **(extra or {})})
+            count("patches_unchanged")
+            count("bytes_unchanged", os.path.getsize(patchPath))
+            return
+        await self.sender.send(patchName, patchPath, announce, {**(extra or {}), "hash": digest})
+
+    async def send_payload(self, patchName, data, fmt, url, announce=None, extra=None):
+        await self.sender.send_payload(patchName, data, fmt, url, announce, extra)
+
+    async def close(self):
+        await self.sender.close()
+
+    def cancel(self):
+        self.sender.cancel()
+
+
+def is_legacy(sender):
+    '''True for a (wrapped) protocol 1 sender.'''
+    while hasattr(sender, "sender"):
+        sender = sender.sender
+    return isinstance(sender, LegacySender)
+
+
+def protocol_version(protocol):
+    '''The protocol a client asked for, 1 for anything that is not a number.'''
+    try:
+        return int(protocol or 1)
+    except (TypeError, ValueError):
+        print("unknown patch protocol, using 1: ", protocol)
+        return 1
+
+
+def patch_sender(websocket, protocol=1, fmt="vtk", progressive=False, lodTarget=5000, known=None):
+    if protocol_version(protocol) >= VERSION:
+        sender = PatchStreamer(websocket, fmt)
+    else:
+        sender = LegacySender(websocket, fmt)
+    if progressive:
+        try:
+            lodTarget = int(lodTarget)
+        except (TypeError, ValueError):
+            print("bad lodTarget, using 5000: ", lodTarget)
+            lodTarget = 5000
+        sender = ProgressiveSender(sender, lodTarget)
+    return HashingSender(sender, websocket, known)
+
+
+async def resume_patch(websocket, obj):
+    '''Continue a protocol 2 transfer from the offset the client already holds.'''
+    transfer = get_transfer(obj.get("id"), obj.get("crc"))
+    if transfer is None:
+        await send_json(websocket, {"name": obj.get("name", "server"), "target": "ofMesh",
+                                    "status": "fail", "ops": "resume", "id": obj.get("id")})
+        return
+    offset = min(int(obj.get("offset", 0)), transfer.size)
+    streamer = PatchStreamer(websocket)
+    try:
+        await streamer.start(transfer, offset, "resume")
+        await streamer.close()
+    finally:
+        streamer.cancel()
@@ -0,0 +1,150 @@
+import os
+import numpy as np
+from foamDict import CompactList, FoamDictError, compact_list, top_level_lists, read_foam_file
+
+# Reads constant/polyMesh directly and writes one VTK file per boundary patch,
+# so patch previews no longer need a surfaceMeshExtract process per patch.
+#
+# Binary meshes and fields (writeFormat binary) come back as views of the
+# memory mapped file, compressed ones (writeCompression on, <name>.gz) are
+# read transparently.
+
+
+class PolyMeshError(Exception):
+    pass
+
+
+def read_foam_list(path):
+    '''Return the top level lists of an OpenFOAM list file, ASCII, binary or gzipped.'''
+    try:
+        return top_level_lists(path)
+    except FoamDictError as e:
+        raise PolyMeshError(str(e))
+
+
+def read_points(path):
+    points = np.asarray(read_foam_list(path)[0], dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise PolyMeshError(f'{path}: not a list of points')
+    return points
+
+
+def read_faces(path):
+    '''Return (offsets, labels) of a faceList, CSR style.'''
+    lists = read_foam_list(path)
+    if isinstance(lists[0], CompactList):
+        return lists[0]
+    if len(lists) == 2:
+        # binary faceCompactList: offsets and labels as two lists
+        return CompactList(lists[0], lists[1])
+    if len(lists[0]) == 0:
+        return compact_list(np.zeros(0, dtype=np.int64), 0)
+    raise PolyMeshError(f'{path}: not a face list')
+
+
+def read_boundary(path):
+    '''Patches of a polyMesh boundary file: name, type, nFaces, startFace, inGroups.'''
+    boundaries = []
+    patches = read_foam_file(path).get(None, [[]])[0]
+    # the boundary list alternates patch names and patch dictionaries
+    for name, entry in zip(patches[::2], patches[1::2]):
+        inGroups = entry.get("inGroups", [])
+        boundaries.append({"name": str(name), "type": entry.get("type", ""),
+                           "nFaces": int(entry.get("nFaces", 0)), "startFace": int(entry.get("startFace", 0)),
+                           "inGroups": [str(group) for group in inGroups] if isinstance(inGroups, list) else []})
+    return boundaries
+
+
+def read_field(path):
+    '''Return (internalField, boundaryField) of a field file.
+
+    A nonuniform internal field is an array, a uniform one its value.
+    '''
+    try:
+        field = read_foam_file(path)
+    except FoamDictError as e:
+        raise PolyMeshError(str(e))
+    internal = field.get('internalField')
+    if isinstance(internal, list) and len(internal) == 2 and internal[0] in ('uniform', 'nonuniform'):
+        internal = internal[1]
+    return internal, field.get('boundaryField', {})
+
+
+class PolyMesh:
+    def __init__(self, case_dir):
+        self.mesh_dir = os.path.join(case_dir, 'constant', 'polyMesh')
+        self.points = read_points(os.path.join(self.mesh_dir, 'points'))
+        self.offsets, self.labels = read_faces(os.path.join(self.mesh_dir, 'faces'))
+
+    @property
+    def nFaces(self):
+        return len(self.offsets) - 1
+
+    def patch(self, ranges):
+        '''Return compact (points, offsets, labels) of one or more face ranges.'''
+        for startFace, nFaces in ranges:
+            if startFace + nFaces > self.nFaces:
+                raise PolyMeshError(f'face range {startFace}+{nFaces} outside mesh ({self.nFaces} faces)')
+        faceIds = np.concatenate([np.arange(s, s + n, dtype=np.int64) for s, n in ranges])
+        starts = self.offsets[faceIds]
+        counts = self.offsets[faceIds + 1] - starts
+        offsets = np.zeros(len(faceIds) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        index = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        used, local = np.unique(self.labels[index], return_inverse=True)
+        return self.points[used], offsets, local.reshape(-1)
+
+
+def patch_ranges(boundaries, patchName):
+    '''Face ranges of a patch, or of every patch in a group of that name.'''
+    ranges = [(b["startFace"], b["nFaces"]) for b in boundaries if b["name"] == patchName]
+    if not ranges:
+        ranges = [(b["startFace"], b["nFaces"]) for b in boundaries if patchName in b.get("inGroups", [])]
+    return ranges
+
+
+def vtk_polydata(title, points, offsets, labels):
+    '''Legacy ASCII VTK PolyData text.'''
+    counts = np.diff(offsets)
+    res = [
+        '# vtk DataFile Version 2.0\n',
+        f'{title}\n',
+        'ASCII\n',
+        'DATASET POLYDATA\n',
+        f'POINTS {len(points)} float\n',
+        ('%.8g %.8g %.8g\n' * len(points)) % tuple(points.ravel().tolist()),
+        f'POLYGONS {len(counts)} {len(counts) + len(labels)}\n',
+    ]
+    if len(counts) and np.all(counts == counts[0]):
+        n = int(counts[0])
+        rows = np.column_stack([counts, labels.reshape(-1, n)])
+        res.append((('%d' + ' %d' * n + '\n') * len(counts)) % tuple(rows.ravel().tolist()))
+    else:
+        flat = labels.tolist()
+        for i, c in enumerate(counts.tolist()):
+            res.append(f'{c} ' + ' '.join(map(str, flat[offsets[i]:offsets[i + 1]])) + '\n')
+    return ''.join(res)
+
+
+def write_patch_vtks(case_dir, boundaries, patchNames, out_dir=None):
+    '''Write <patch>.vtk for every requested patch in a single pass over the mesh.
+
+    boundaries is the list from parse_boundary_file (name, startFace, nFaces).
+    Returns {patchName: path} for the patches written; names that match
+    neither a patch nor a patch group are left out so the caller can fall
+    back to surfaceMeshExtract.
+    '''
+    out_dir = out_dir or case_dir
+    mesh = PolyMesh(case_dir)
+    written = {}
+    for patchName in patchNames:
+        ranges = patch_ranges(boundaries, patchName)
+        if not ranges:
+            continue
+        points, offsets, labels = mesh.patch(ranges)
+
+        path = os.path.join(out_dir, f'{patchName}.vtk')
+        with open(path, 'w') as f:
+            f.write(vtk_polydata(patchName, points, offsets, labels))
+        written[patchName] = path
+    return written
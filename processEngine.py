@@ -0,0 +1,128 @@
+import os
+import signal
+import time
+import asyncio
+from metrics import count, observe
+
+# Upper bound on OpenFOAM utilities running at the same time, shared by every
+# connected client. blockMesh / surfaceMeshExtract are mostly single threaded,
+# so one slot per core is a sensible default.
+MAX_PROCESSES = int(os.environ.get("SIMONMESH_MAX_PROCESSES", os.cpu_count() or 4))
+# Default per-command timeout in seconds, 0 disables it.
+COMMAND_TIMEOUT = float(os.environ.get("SIMONMESH_COMMAND_TIMEOUT", 0)) or None
+# asyncio StreamReader line limit, OpenFOAM banners can be long
+LINE_LIMIT = 1024 * 1024
+
+_slots = None
+_slots_loop = None
+
+
+class ProcessTimeout(Exception):
+    pass
+
+
+class ProcessCancelled(Exception):
+    pass
+
+
+class ProcessResult:
+    def __init__(self, returncode, stdout, stderr):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+def process_slots():
+    '''Semaphore capping concurrent processes, bound to the running loop.'''
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots = asyncio.Semaphore(MAX_PROCESSES)
+        _slots_loop = loop
+    return _slots
+
+
+def print_line(stream, line):
+    print(f'[{stream}] {line}')
+
+
+async def _pump(reader, name, sink, on_line):
+    while True:
+        raw = await reader.readline()
+        if not raw:
+            return
+        line = raw.decode(errors='replace').rstrip('\r\n')
+        sink.append(line)
+        if on_line is not None:
+            res = on_line(name, line)
+            if asyncio.iscoroutine(res):
+                await res
+
+
+async def _kill(proc):
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name == 'posix':
+            # shell commands run in their own session, take the whole group down
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+    await proc.wait()
+
+
+async def _wait_closed(websocket):
+    await websocket.wait_closed()
+    raise ProcessCancelled("client disconnected")
+
+
+async def run_process(command, shell=False, timeout=None, on_line=None, websocket=None, cwd=None):
+    '''Run a process without blocking the event loop.
+
+    stdout/stderr are streamed line by line to on_line(stream, line) as they
+    arrive (plain or async callable). The process is killed when the timeout
+    expires, when the calling task is cancelled or, if a websocket is given,
+    when that client disconnects.
+    '''
+    if timeout is None:
+        timeout = COMMAND_TIMEOUT
+    queued = time.perf_counter()
+    async with process_slots():
+        observe("queue.processSlot", time.perf_counter() - queued)
+        count("processes_started")
+        kwargs = dict(stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                      cwd=cwd, limit=LINE_LIMIT)
+        if os.name == 'posix':
+            kwargs["start_new_session"] = True
+        if shell:
+            proc = await asyncio.create_subprocess_shell(command, **kwargs)
+        else:
+            proc = await asyncio.create_subprocess_exec(*command, **kwargs)
+
+        stdout, stderr = [], []
+        work = asyncio.gather(_pump(proc.stdout, 'stdout', stdout, on_line),
+                              _pump(proc.stderr, 'stderr', stderr, on_line),
+                              proc.wait())
+        waiters = [work]
+        if websocket is not None and hasattr(websocket, 'wait_closed'):
+            waiters.append(asyncio.ensure_future(_wait_closed(websocket)))
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise ProcessTimeout(f"timed out after {timeout}s")
+            for task in done:
+                task.result()
+        finally:
+            for task in waiters:
+                task.cancel()
+            await _kill(proc)
+            await asyncio.gather(*waiters, return_exceptions=True)
+
+        return ProcessResult(proc.returncode, '\n'.join(stdout), '\n'.join(stderr))
@@ -0,0 +1,132 @@
+import os
+import json
+import numpy as np
+from residualLog import ResidualParser, residual_payload
+
+# Sidecar store of the residuals parsed from a solver log, so monitoring
+# can resume after a restart or reconnect without re-reading the log.
+#
+#   <log>.residuals/meta.json  parser checkpoint, log inode and size, the
+#                              number of valid entries of every array
+#   <log>.residuals/time.f8    time step values
+#   <log>.residuals/<n>.f8     (time, initial residual) pairs of field n
+#
+# Arrays are only ever appended to. meta.json is replaced atomically after
+# the arrays are written, so a crash in between leaves at most a tail of
+# entries beyond the recorded counts, which is cut off on the next load.
+
+SUFFIX = '.residuals'
+
+
+class ResidualIndex:
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.root = log_path + SUFFIX
+        self.meta = None
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def field_file(self, i):
+        return self.path(f'{i}.f8')
+
+    @property
+    def offset(self):
+        return self.meta["parser"]["offset"] if self.meta else 0
+
+    def load(self):
+        '''Return a parser resumed from the checkpoint.
+
+        A fresh parser (and an empty index) is returned when there is no
+        index yet or it belongs to an earlier run: the log was replaced
+        (other inode) or truncated below the checkpoint.
+        '''
+        try:
+            with open(self.path('meta.json')) as f:
+                meta = json.load(f)
+            st = os.stat(self.log_path)
+            if meta["inode"] != st.st_ino or st.st_size < meta["parser"]["offset"]:
+                raise ValueError('log changed')
+        except (OSError, ValueError, KeyError):
+            self.clear()
+            return ResidualParser()
+        self.meta = meta
+        self.truncate(self.path('time.f8'), meta["steps"] * 8)
+        for i, count in enumerate(meta["counts"]):
+            self.truncate(self.field_file(i), count * 16)
+        return ResidualParser.resume(meta["parser"])
+
+    def refresh(self):
+        '''Reload the checkpoint written by another process (the case worker tailing the log).'''
+        try:
+            with open(self.path('meta.json')) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = None
+
+    @staticmethod
+    def read_array(path, count):
+        '''count float64s from path; arrays are only created by their first append.'''
+        if count == 0 or not os.path.exists(path):
+            return np.empty(0, dtype='<f8')
+        return np.fromfile(path, dtype='<f8', count=count)
+
+    @staticmethod
+    def truncate(path, size):
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        elif os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def clear(self):
+        os.makedirs(self.root, exist_ok=True)
+        for name in os.listdir(self.root):
+            os.remove(self.path(name))
+        self.meta = None
+
+    def append(self, times, series, checkpoint):
+        '''Store the output of parser.take() and the checkpoint right after it.'''
+        meta = self.meta or {"steps": 0, "counts": []}
+        counts = list(meta["counts"])
+        fields = checkpoint["fields"]
+        counts += [0] * (len(fields) - len(counts))
+        if times:
+            with open(self.path('time.f8'), 'ab') as f:
+                f.write(np.asarray(times, dtype='<f8').tobytes())
+        for field, (valueTimes, values) in series.items():
+            i = fields.index(field)
+            with open(self.field_file(i), 'ab') as f:
+                f.write(np.column_stack([valueTimes, values]).astype('<f8').tobytes())
+            counts[i] += len(values)
+
+        st = os.stat(self.log_path)
+        meta = {"inode": st.st_ino, "size": st.st_size, "steps": meta["steps"] + len(times),
+                "counts": counts, "parser": checkpoint}
+        tmp = self.path('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path('meta.json'))
+        self.meta = meta
+
+    def read(self, t0=None, t1=None):
+        '''Return (times, {field: (times, values)}), optionally within [t0, t1].'''
+        if not self.meta:
+            return [], {}
+        times = self.read_array(self.path('time.f8'), self.meta["steps"])
+        series = {}
+        for i, field in enumerate(self.meta["parser"]["fields"]):
+            count = self.meta["counts"][i]
+            pairs = self.read_array(self.field_file(i), count * 2).reshape(-1, 2)
+            series[field] = (pairs[:, 0], pairs[:, 1])
+        if t0 is not None or t1 is not None:
+            lo = -np.inf if t0 is None else t0
+            hi = np.inf if t1 is None else t1
+            times = times[(times >= lo) & (times <= hi)]
+            for field, (valueTimes, values) in series.items():
+                keep = (valueTimes >= lo) & (valueTimes <= hi)
+                series[field] = (valueTimes[keep], values[keep])
+        return times.tolist(), series
+
+    def history(self, t0=None, t1=None):
+        '''Stored residuals in the monitor payload layout.'''
+        return residual_payload(*self.read(t0, t1))
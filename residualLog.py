@@ -0,0 +1,189 @@
+import re
+import numpy as np
+from downsample import downsample
+
+# Single pass residual scanner for OpenFOAM solver logs.
+#
+# The log is fed in large byte blocks; one combined pattern finds the only
+# lines that matter (time steps, "Solving for <field>" and continuity
+# errors) without splitting the block into lines in Python. Every solved
+# field is picked up, not just a fixed list.
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Every pattern starts at a newline, which lets the regex engine skip
+# through the block quickly; the parser keeps the newline ending the
+# previous block so lines at block boundaries still match.
+_RESIDUAL = re.compile(
+    rb'\n(?:Time = ([\d.eE+-]+)'
+    rb'|\w+:  Solving for ([^,\s]+), Initial residual = ([^,\s]+)'
+    rb'|time step continuity errors : [^\n]*? global = ([^,\s]+))')
+
+
+def log_residual(values):
+    '''log10(|r|) * sign(r), vectorized.'''
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log10(np.abs(values)) * np.sign(values)
+
+
+class ResidualParser:
+    '''Incremental residual parser.
+
+    feed() accepts arbitrary byte blocks (a partial last line is kept for
+    the next call), flush() returns the residuals found since the previous
+    flush in the monitor payload layout: {"time": [...], "Ux": [...], ...}.
+    Only the first residual of each field per time step is kept (the first
+    corrector), like the original line parser.
+    '''
+    def __init__(self):
+        self.tail = b'\n'
+        self.time = None
+        self.seen = set()
+        self.fields = []
+        self.fieldIds = {}
+        self.times = []
+        self.values = {}
+        self.valueTimes = {}
+        self.bytes = 0
+
+    def feed(self, chunk):
+        self.bytes += len(chunk)
+        data = self.tail + chunk
+        cut = data.rfind(b'\n') + 1
+        self.tail = data[cut - 1:]
+        self.scan(data, cut)
+
+    def finish(self):
+        '''Parse a trailing line without newline, at the end of a replay.'''
+        if len(self.tail) > 1:
+            tail, self.tail = self.tail + b'\n', b'\n'
+            self.scan(tail, len(tail))
+
+    def field_id(self, name):
+        fid = self.fieldIds.get(name)
+        if fid is None:
+            fid = self.fieldIds[name] = len(self.fields)
+            field = name.decode()
+            self.fields.append(field)
+            self.values[field] = []
+            self.valueTimes[field] = []
+        return fid
+
+    def scan(self, data, end):
+        matches = _RESIDUAL.findall(data, 0, end)
+        if not matches:
+            return
+        names = [m[1] or (b'' if m[0] else b'continuity') for m in matches]
+        for name in dict.fromkeys(names):
+            if name and name not in self.fieldIds:
+                self.field_id(name)
+        lookup = dict(self.fieldIds)
+        lookup[b''] = -1
+        fids = np.array([lookup[name] for name in names], dtype=np.int64)
+        isTime = fids < 0
+        # step 0 continues the time step open at the end of the previous block
+        step = np.cumsum(isTime)
+        newTimes = [float(m[0]) for m in matches if m[0]]
+        stepTimes = np.array([np.nan if self.time is None else self.time] + newTimes)
+
+        entry = ~isTime
+        if self.seen:
+            entry &= ~((step == 0) & np.isin(fids, list(self.seen)))
+        index = np.flatnonzero(entry)
+        nf = len(self.fields)
+        _, first = np.unique(step[index] * nf + fids[index], return_index=True)
+        index = index[np.sort(first)]
+
+        raw = np.array([matches[i][2] or matches[i][3] for i in index.tolist()])
+        values = raw.astype(np.float64) if len(raw) else np.zeros(0)
+        for fid in np.unique(fids[index]).tolist():
+            sel = fids[index] == fid
+            field = self.fields[fid]
+            self.values[field].append(values[sel])
+            self.valueTimes[field].append(stepTimes[step[index[sel]]])
+
+        self.times.extend(newTimes)
+        last = step[-1]
+        if newTimes:
+            self.time = newTimes[-1]
+            self.seen = set()
+        self.seen.update(fids[(step == last) & ~isTime].tolist())
+
+    def checkpoint(self):
+        '''State to resume parsing from, taken right after take().
+
+        The offset points past the last complete line; a partial line is
+        parsed again after resuming.
+        '''
+        return {"offset": self.bytes - len(self.tail) + 1, "time": self.time,
+                "seen": sorted(self.seen), "fields": list(self.fields)}
+
+    @classmethod
+    def resume(cls, state):
+        parser = cls()
+        for field in state["fields"]:
+            parser.field_id(field.encode())
+        parser.time = state["time"]
+        parser.seen = set(state["seen"])
+        parser.bytes = state["offset"]
+        return parser
+
+    def pending(self):
+        return bool(self.times) or any(self.values.values())
+
+    def take(self):
+        '''Return and clear the raw (times, {field: (times, values)}) parsed so far.'''
+        times = self.times
+        series = {}
+        for field in self.fields:
+            if self.values[field]:
+                series[field] = (np.concatenate(self.valueTimes[field]), np.concatenate(self.values[field]))
+                self.values[field] = []
+                self.valueTimes[field] = []
+        self.times = []
+        return times, series
+
+    def flush(self):
+        return residual_payload(*self.take())
+
+
+def parse_log_file(path, parser=None, block_size=BLOCK_SIZE, start=0):
+    '''Feed a whole log file (from byte offset start) through a parser.'''
+    parser = parser or ResidualParser()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while chunk := f.read(block_size):
+            parser.feed(chunk)
+    return parser
+
+
+def residual_payload(times, series, budget=None, method="minmax"):
+    '''Monitor payload layout of take() output: {"time": [...], field: log residuals}.
+
+    With a point budget, fields longer than it are downsampled; the payload
+    then also carries the time of every kept value in "fieldTimes", since
+    the fields no longer line up with "time" (which is thinned evenly).
+    '''
+    residuals = {"time": list(times)}
+    fieldTimes = {}
+    for field, (valueTimes, values) in series.items():
+        values = log_residual(values)
+        index = downsample(valueTimes, values, budget, method)
+        if len(index) < len(values):
+            values = values[index]
+            fieldTimes[field] = valueTimes[index]
+        residuals[field] = values.tolist()
+    if fieldTimes:
+        for field, (valueTimes, _) in series.items():
+            fieldTimes[field] = json_times(fieldTimes.get(field, valueTimes))
+        residuals["fieldTimes"] = fieldTimes
+        if len(times) > budget:
+            index = np.linspace(0, len(times) - 1, budget).astype(np.int64)
+            residuals["time"] = np.asarray(times)[index].tolist()
+    return residuals
+
+
+def json_times(values):
+    # a step parsed before the first "Time =" line has no time
+    return [None if t != t else t for t in np.asarray(values).tolist()]
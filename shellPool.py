@@ -0,0 +1,256 @@
+import os
+import uuid
+import shlex
+import signal
+import asyncio
+import time
+from metrics import count, observe
+from processEngine import (ProcessResult, ProcessTimeout, ProcessCancelled, COMMAND_TIMEOUT, LINE_LIMIT,
+                           process_slots)
+
+# Pool of long lived shells with the OpenFOAM environment sourced once.
+#
+# Instead of a docker exec plus "source bashrc" per command, commands are
+# written to the stdin of an idle shell. Each runs in a background subshell
+# with its own process group (set -m), so a timeout or a cancelled request
+# kills just that command and the shell stays warm. The command line is
+# handed to a fresh "$0 -c" (the pool's own shell) rather than pasted into
+# the session, so a syntax error fails that command instead of leaving the
+# session waiting for the rest of it. The end of the output is found by a
+# sentinel printed on stdout (with the exit status) and on stderr after the
+# command.
+#
+# SIMONMESH_SHELL replaces the shell command line, e.g. "/bin/sh" to try the
+# pool without OpenFOAM, and SIMONMESH_SHELL_INIT the environment setup.
+
+SHELL_POOL = os.environ.get("SIMONMESH_SHELL_POOL", "1") != "0"
+FOAM_CONTAINER = os.environ.get("SIMONMESH_CONTAINER", "meshos")
+FOAM_BASHRC = "/usr/lib/openfoam/openfoam2406/etc/bashrc"
+# Seconds allowed for a new shell to come up (sourcing the bashrc is slow)
+START_TIMEOUT = 60
+# Idle shells are checked with a no-op command before reuse after this long
+HEALTH_INTERVAL = 30
+HEALTH_TIMEOUT = 5
+# Seconds to wait for a killed command's sentinel before giving up on the shell
+KILL_GRACE = 5
+# Timeout of pooled commands when SIMONMESH_COMMAND_TIMEOUT sets none, a
+# command that never ends must not hold its process slot and case forever
+POOL_TIMEOUT = float(os.environ.get("SIMONMESH_SHELL_TIMEOUT", 3600))
+
+
+class ShellError(Exception):
+    pass
+
+
+class ShellSession:
+    def __init__(self, argv, init=None, kill_argv=None):
+        self.argv = argv
+        self.init = init
+        # command killing a process group in the shell's pid namespace, the
+        # group id is appended; None kills it locally
+        self.kill_argv = kill_argv
+        self.proc = None
+        self.token = uuid.uuid4().hex
+        self.count = 0
+        self.pid = None
+        self.on_line = None
+        self.lastUsed = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        kwargs = dict(stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                      stderr=asyncio.subprocess.PIPE, limit=LINE_LIMIT)
+        if os.name == 'posix':
+            kwargs["start_new_session"] = True
+        self.proc = await asyncio.create_subprocess_exec(*self.argv, **kwargs)
+        setup = 'set -m\n' + (f'{self.init}\n' if self.init else '')
+        self.proc.stdin.write(setup.encode())
+        result = await self.run(':', timeout=START_TIMEOUT)
+        if not result.ok:
+            await self.close()
+            raise ShellError(f'shell setup failed: {result.stderr}')
+
+    async def healthy(self):
+        if not self.alive:
+            return False
+        try:
+            return (await self.run(':', timeout=HEALTH_TIMEOUT)).ok
+        except (ShellError, ProcessTimeout):
+            return False
+
+    async def _pump(self, reader, name, sink, mark):
+        async def emit(line):
+            sink.append(line)
+            if self.on_line is not None:
+                res = self.on_line(name, line)
+                if asyncio.iscoroutine(res):
+                    await res
+
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                raise ShellError('shell exited')
+            line = raw.decode(errors='replace').rstrip('\r\n')
+            i = line.find(mark)
+            if i < 0:
+                await emit(line)
+                continue
+            # output without a final newline ends up in front of the sentinel
+            head, tail = line[:i], line[i + len(mark):]
+            if head:
+                await emit(head)
+            if tail.startswith('PID'):
+                self.pid = int(tail[3:])
+                continue
+            return int(tail) if tail else None
+
+    async def _collect(self, mark, stdout, stderr):
+        returncode, _ = await asyncio.gather(self._pump(self.proc.stdout, 'stdout', stdout, mark),
+                                             self._pump(self.proc.stderr, 'stderr', stderr, mark))
+        return returncode
+
+    async def run(self, command, timeout=None, on_line=None, websocket=None):
+        '''Run a shell command line, same contract as processEngine.run_process.'''
+        if not self.alive:
+            raise ShellError('shell is not running')
+        self.count += 1
+        self.pid = None
+        self.on_line = on_line
+        mark = f'__SIMONMESH_{self.token}_{self.count}__'
+        self.proc.stdin.write(
+            f'( exec "$0" -c {shlex.quote(command)} ) </dev/null &\n'
+            f'__pid=$!; printf "%s\\n" "{mark}PID$__pid" >&2; wait "$__pid"; __rc=$?\n'
+            f'printf "%s\\n" "{mark}$__rc"; printf "%s\\n" "{mark}" >&2\n'.encode())
+        await self.proc.stdin.drain()
+
+        stdout, stderr = [], []
+        work = asyncio.ensure_future(self._collect(mark, stdout, stderr))
+        waiters = [work]
+        if websocket is not None and hasattr(websocket, 'wait_closed'):
+            waiters.append(asyncio.ensure_future(_wait_closed(websocket)))
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise ProcessTimeout(f"timed out after {timeout}s")
+            for task in done:
+                task.result()
+        finally:
+            for task in waiters[1:]:
+                task.cancel()
+            if not work.done():
+                self.on_line = None
+                await self.interrupt(work)
+            self.lastUsed = time.monotonic()
+        return ProcessResult(work.result(), '\n'.join(stdout), '\n'.join(stderr))
+
+    async def interrupt(self, work):
+        '''Kill the running command and wait for its sentinel, close the shell if that fails.'''
+        try:
+            if self.pid is not None:
+                if self.kill_argv is None:
+                    os.killpg(self.pid, signal.SIGKILL)
+                else:
+                    killer = await asyncio.create_subprocess_exec(*self.kill_argv, f'-{self.pid}',
+                                                                  stdout=asyncio.subprocess.DEVNULL,
+                                                                  stderr=asyncio.subprocess.DEVNULL)
+                    await killer.wait()
+            await asyncio.wait_for(work, KILL_GRACE)
+        except (ProcessLookupError, PermissionError, ShellError, asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # without job control (some sh) the command shares the shell's
+            # process group: take the whole shell down instead
+            print(f"shell session reset after kill: {e!r}")
+            await self.close()
+            await asyncio.gather(work, return_exceptions=True)
+
+    async def close(self):
+        if not self.alive:
+            return
+        try:
+            self.proc.stdin.close()
+            if os.name == 'posix':
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+        await self.proc.wait()
+
+
+async def _wait_closed(websocket):
+    await websocket.wait_closed()
+    raise ProcessCancelled("client disconnected")
+
+
+class ShellPool:
+    '''Idle warm shells, at most processEngine.MAX_PROCESSES of them in use.'''
+    def __init__(self, argv, init=None, kill_argv=None):
+        self.argv = argv
+        self.init = init
+        self.kill_argv = kill_argv
+        self.idle = []
+        self.counts = {"started": 0, "restarted": 0, "commands": 0}
+
+    async def acquire(self):
+        while self.idle:
+            session = self.idle.pop()
+            fresh = time.monotonic() - session.lastUsed < HEALTH_INTERVAL
+            if session.alive and (fresh or await session.healthy()):
+                return session
+            await session.close()
+            self.counts["restarted"] += 1
+        session = ShellSession(self.argv, self.init, self.kill_argv)
+        await session.start()
+        self.counts["started"] += 1
+        count("processes_started")
+        return session
+
+    def release(self, session):
+        if session.alive:
+            self.idle.append(session)
+
+    async def run(self, command, timeout=None, on_line=None, websocket=None):
+        if timeout is None:
+            timeout = COMMAND_TIMEOUT or POOL_TIMEOUT
+        queued = time.perf_counter()
+        async with process_slots():
+            observe("queue.processSlot", time.perf_counter() - queued)
+            session = await self.acquire()
+            self.counts["commands"] += 1
+            count("shell_commands")
+            try:
+                return await session.run(command, timeout=timeout, on_line=on_line, websocket=websocket)
+            finally:
+                self.release(session)
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for session in idle:
+            await session.close()
+
+    def stats(self):
+        return {"idle": len(self.idle), **self.counts}
+
+
+_pool = None
+
+
+def shell_pool():
+    '''The shared pool: bash in the OpenFOAM container on Windows, a local shell elsewhere.'''
+    global _pool
+    if _pool is None:
+        if os.name == 'nt':
+            argv = ['docker', 'exec', '-i', FOAM_CONTAINER, '/bin/bash', '--noprofile', '--norc']
+            init = f'source {FOAM_BASHRC}'
+            kill_argv = ['docker', 'exec', FOAM_CONTAINER, 'kill', '-KILL', '--']
+        else:
+            argv = ['/bin/bash', '--noprofile', '--norc']
+            init = None
+            kill_argv = None
+        if os.environ.get("SIMONMESH_SHELL"):
+            argv = shlex.split(os.environ["SIMONMESH_SHELL"])
+        init = os.environ.get("SIMONMESH_SHELL_INIT", init)
+        _pool = ShellPool(argv, init, kill_argv)
+    return _pool
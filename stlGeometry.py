@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import numpy as np
+from meshCache import file_digest, remember_digest
+
+# STL ingestion: read ASCII or binary STL in bulk with NumPy, rewrite ASCII
+# files as binary STL (OpenFOAM reads those much faster) and compute the
+# geometry metadata clients ask for: bounding box, area, volume, normals,
+# watertightness and feature edges.
+#
+# Metadata is cached by the sha256 of the file content, in memory and as
+# JSON next to the geometry store (<base_dir>/.geometry/meta), so a file
+# is analysed once however many cases link it. The binary version of a
+# converted file goes into the store too; the entry of the ASCII original
+# points to it, so other cases holding the same ASCII file just link it.
+
+# Angle between the normals of two faces above which their edge is a feature edge
+FEATURE_ANGLE = float(os.environ.get("SIMONMESH_FEATURE_ANGLE", 30))
+# Content addressed store of STL files, <sha256>.stl, see stlUpload
+STORE_DIR = '.geometry'
+META_DIR = os.path.join(STORE_DIR, 'meta')
+# Binary STL facet: normal, three vertices, attribute byte count
+FACET = np.dtype([('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+
+_VERTEX = re.compile(rb'^\s*vertex\s+([^\r\n]+)', re.M)
+_NORMAL = re.compile(rb'^\s*facet\s+normal\s+([^\r\n]+)', re.M)
+_SOLID = re.compile(rb'^\s*solid[ \t]*([^\r\n]*)', re.M)
+# store entries are named by digest, anything else must never become a path
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+_meta = {}
+
+
+class StlError(Exception):
+    pass
+
+
+class Stl:
+    def __init__(self, triangles, normals, solids, binary):
+        self.triangles = triangles
+        self.normals = normals
+        # (name, facet count) of every solid, one unnamed solid for binary files
+        self.solids = solids
+        self.binary = binary
+
+
+def is_binary(data):
+    if len(data) < 84:
+        return False
+    count = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+    return len(data) == 84 + count * FACET.itemsize
+
+
+def read_stl(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return parse_stl(data)
+
+
+def parse_stl(data):
+    if is_binary(data):
+        facets = np.frombuffer(data, dtype=FACET, offset=84)
+        return Stl(facets['vertices'].astype(np.float64), facets['normal'].astype(np.float64),
+                   [("", len(facets))], True)
+    if not data.lstrip().startswith(b'solid'):
+        raise StlError('neither ASCII nor binary STL')
+    try:
+        coords = np.array(b' '.join(_VERTEX.findall(data)).split(), dtype=np.float64)
+        normals = np.array(b' '.join(_NORMAL.findall(data)).split(), dtype=np.float64)
+    except ValueError as e:
+        raise StlError(f'bad number in STL: {e}')
+    if len(coords) % 9:
+        raise StlError('facet with a missing vertex coordinate')
+    triangles = coords.reshape(-1, 3, 3)
+    normals = normals.reshape(-1, 3) if len(normals) == 3 * len(triangles) else np.zeros((len(triangles), 3))
+    solids = []
+    starts = [m.start() for m in _SOLID.finditer(data)] + [len(data)]
+    for m, end in zip(_SOLID.finditer(data), starts[1:]):
+        solids.append((m.group(1).strip().decode(errors='replace'), data.count(b'vertex', m.end(), end) // 3))
+    return Stl(triangles, normals, solids, False)
+
+
+def write_binary_stl(path, triangles, normals=None, header=b'binary STL written by sim.on.mesh'):
+    '''Write a binary STL atomically.'''
+    facets = np.zeros(len(triangles), dtype=FACET)
+    facets['vertices'] = triangles
+    if normals is not None:
+        facets['normal'] = normals
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header[:80].ljust(80, b' '))
+        f.write(np.uint32(len(facets)).tobytes())
+        f.write(facets.tobytes())
+    os.replace(tmp, path)
+
+
+def face_normals(triangles):
+    '''(unit normals, areas) of the triangles, degenerate ones get a zero normal.'''
+    cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    length = np.linalg.norm(cross, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normals = np.where(length[:, None] > 0, cross / length[:, None], 0.0)
+    return normals, 0.5 * length
+
+
+def weld(points):
+    '''(unique points, index of each input point in them), exact matches only.'''
+    # lexsort and compare neighbours, much faster than np.unique(axis=0)
+    order = np.lexsort(points.T[::-1])
+    ordered = points[order]
+    new = np.empty(len(ordered), dtype=bool)
+    new[:1] = True
+    np.any(ordered[1:] != ordered[:-1], axis=1, out=new[1:])
+    ids = np.empty(len(ordered), dtype=np.int64)
+    ids[order] = np.cumsum(new) - 1
+    return ordered[new], ids
+
+
+def edge_topology(triangles):
+    '''Weld the corners and find the edges shared by the faces.
+
+    Returns (points, a, b, edges, starts, counts, edgeFaces): a -> b are
+    the directed corner edges as point ids, edges the unique undirected
+    edge keys with the index of their first entry in edgeFaces and the
+    number of faces sharing them; edgeFaces lists the face of every corner
+    edge, grouped by edge.
+    '''
+    points, ids = weld(triangles.reshape(-1, 3))
+    ids = ids.reshape(-1, 3)
+    a = ids.ravel()
+    b = ids[:, [1, 2, 0]].ravel()
+    keys = np.minimum(a, b).astype(np.int64) * len(points) + np.maximum(a, b)
+    order = np.argsort(keys, kind='stable')
+    edges, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    return points, a, b, edges, starts, counts, order // 3
+
+
+def stl_metadata(stl, featureAngle=FEATURE_ANGLE):
+    triangles = stl.triangles
+    n = len(triangles)
+    meta = {"triangles": n, "solids": [{"name": name, "triangles": count} for name, count in stl.solids],
+            "binary": stl.binary}
+    if n == 0:
+        return {**meta, "watertight": False}
+    normals, areas = face_normals(triangles)
+    points, a, b, edges, starts, counts, edgeFaces = edge_topology(triangles)
+
+    # consistent orientation: every directed edge is used once
+    directed = a.astype(np.int64) * len(points) + b
+    consistent = len(np.unique(directed)) == len(directed)
+    watertight = bool(np.all(counts == 2))
+
+    # feature edges between the two faces of manifold edges
+    pair = counts == 2
+    f0 = edgeFaces[starts[pair]]
+    f1 = edgeFaces[starts[pair] + 1]
+    cosine = np.einsum('ij,ij->i', normals[f0], normals[f1])
+    feature = cosine < np.cos(np.radians(featureAngle))
+    edgeKeys = edges[pair][feature]
+    p, q = edgeKeys // len(points), edgeKeys % len(points)
+    featureLength = float(np.linalg.norm(points[p] - points[q], axis=1).sum())
+
+    stored = np.einsum('ij,ij->i', stl.normals, normals)
+    meta.update({
+        "bbox": [triangles.reshape(-1, 3).min(axis=0).tolist(), triangles.reshape(-1, 3).max(axis=0).tolist()],
+        "area": float(areas.sum()),
+        "vertices": len(points),
+        "edges": len(edges),
+        "boundaryEdges": int(np.count_nonzero(counts == 1)),
+        "nonManifoldEdges": int(np.count_nonzero(counts > 2)),
+        "degenerateTriangles": int(np.count_nonzero(areas == 0)),
+        "watertight": watertight,
+        "consistentNormals": consistent,
+        # stored normals pointing against the vertex winding
+        "flippedNormals": int(np.count_nonzero(stored < 0)),
+        "meanNormal": (normals * areas[:, None]).sum(axis=0).tolist(),
+        "featureAngle": featureAngle,
+        "featureEdges": int(np.count_nonzero(feature)),
+        "featureLength": featureLength,
+    })
+    if watertight and consistent:
+        v0, v1, v2 = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        meta["volume"] = float(np.einsum('ij,ij->i', v0, np.cross(v1, v2)).sum() / 6)
+    return meta
+
+
+def valid_digest(digest):
+    '''True for a lower case hex sha256, the only names store entries may have.'''
+    return isinstance(digest, str) and _SHA256.match(digest) is not None
+
+
+def geometry_store(base_dir):
+    return os.path.join(base_dir, STORE_DIR)
+
+
+def stored_file(store, digest):
+    '''Path of the stored copy of a file with this sha256, None if there is no intact one.'''
+    if not valid_digest(digest):
+        print("not a sha256, ignored: ", repr(digest))
+        return None
+    path = os.path.join(store, f'{digest}.stl')
+    if not os.path.exists(path):
+        return None
+    # a linked copy rewritten in place changes the stored file too
+    if file_digest(path) != digest:
+        print("geometry store entry changed, dropping it: ", path)
+        os.remove(path)
+        return None
+    return path
+
+
+def link_into(stored, target, digest):
+    '''Replace target by a hardlink to the stored file (a copy where links are not possible).'''
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target) and os.path.samefile(stored, target):
+        return
+    tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(stored, tmp)
+    except OSError:
+        shutil.copyfile(stored, tmp)
+    os.replace(tmp, target)
+    remember_digest(target, digest)
+
+
+def meta_path(base_dir, digest):
+    return os.path.join(base_dir, META_DIR, f'{digest}.json')
+
+
+def cached_metadata(base_dir, digest):
+    meta = _meta.get(digest)
+    if meta is None and base_dir:
+        try:
+            with open(meta_path(base_dir, digest)) as f:
+                meta = _meta[digest] = json.load(f)
+        except (OSError, ValueError):
+            return None
+    return meta
+
+
+def store_metadata(base_dir, digest, meta):
+    _meta[digest] = meta
+    if base_dir:
+        path = meta_path(base_dir, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+
+def ingest_stl(path, base_dir=None, convert=True):
+    '''Metadata of an STL file, converting a single solid ASCII file to binary on the way.
+
+    Runs in a case worker. Multi solid ASCII files are left as they are,
+    binary STL has no place for the solid (region) names.
+    '''
+    digest = file_digest(path)
+    meta = cached_metadata(base_dir, digest)
+    if meta is not None and convert and meta.get("binarySha256") and base_dir:
+        # ASCII file converted before (in another case): link the binary version
+        stored = stored_file(geometry_store(base_dir), meta["binarySha256"])
+        if stored is not None:
+            link_into(stored, path, meta["binarySha256"])
+            return {**meta, "sha256": meta["binarySha256"]}
+        meta = None
+    if meta is not None:
+        return {**meta, "sha256": digest}
+    stl = read_stl(path)
+    meta = stl_metadata(stl)
+    if convert and not stl.binary and len(stl.solids) <= 1:
+        # a hardlinked store copy keeps its content, os.replace makes a new file
+        write_binary_stl(path, stl.triangles, stl.normals)
+        binary = file_digest(path)
+        meta = {**meta, "binary": True, "converted": True}
+        if base_dir:
+            store = geometry_store(base_dir)
+            if stored_file(store, binary) is None:
+                os.makedirs(store, exist_ok=True)
+                link_into(path, os.path.join(store, f'{binary}.stl'), binary)
+            store_metadata(base_dir, digest, {**meta, "binarySha256": binary})
+        print("STL converted to binary: ", path, os.path.getsize(path))
+        digest = binary
+    store_metadata(base_dir, digest, meta)
+    return {**meta, "sha256": digest}
+
+
+def case_geometry(case_dir, base_dir=None, names=None):
+    '''Ingest the STL files of constant/geometry (all, or the given names).'''
+    geo_dir = os.path.join(case_dir, 'constant', 'geometry')
+    if names is None:
+        names = [f[:-4] for f in sorted(os.listdir(geo_dir)) if f.lower().endswith('.stl')] \
+            if os.path.isdir(geo_dir) else []
+    info = {}
+    for name in names:
+        # names come from the client: only plain file names inside constant/geometry
+        if not isinstance(name, str) or not name or name != os.path.basename(name) \
+                or '/' in name or '\\' in name or '..' in name:
+            info[str(name)] = {"error": "not a file name in constant/geometry"}
+            continue
+        path = os.path.join(geo_dir, f'{name}.stl')
+        try:
+            info[name] = ingest_stl(path, base_dir)
+        except (OSError, StlError) as e:
+            info[name] = {"error": str(e)}
+    return info
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import uuid
+import struct
+import asyncio
+import hashlib
+from meshCache import remember_digest
+from metrics import count, span
+from stlGeometry import ingest_stl, geometry_store, stored_file, link_into, valid_digest, StlError
+from workerPool import run_in_worker
+
+# Chunked STL upload straight to disk.
+#
+# The client announces the file with a JSON "upload" op (fileName, size and
+# optionally its sha256), gets back an uploadId and the offset to start at,
+# then sends binary frames: header magic "SMUP" + offset u64 (big endian)
+# followed by the bytes. Each frame is appended to a part file and fed to an
+# incremental sha256, so the server never holds more than one frame.
+#
+# Finished files go into a content addressed store (<base_dir>/.geometry,
+# <sha256>.stl) and are hardlinked into constant/geometry; a file already in
+# the store is not stored twice, and an upload announced with a known
+# sha256 is linked without any transfer. After a disconnect the client sends
+# the op again with its uploadId and continues from the returned offset.
+# Stored files are ingested (see stlGeometry) and the reply carries their
+# geometry metadata.
+#
+# _uploads holds the uploads being received. A resume can arrive while the
+# receiver of a half open connection still holds the upload: the new one
+# takes it over (its generation moves on) and the old receiver leaves the
+# file alone from then on. A paused or disconnected upload is dropped from
+# _uploads and loaded from its part file when resumed.
+
+MAGIC = b'SMUP'
+HEADER = struct.Struct('!4sQ')
+UPLOAD_DIR = 'uploads'
+# Suggested frame size, and how often progress is acknowledged
+CHUNK_SIZE = 1024 * 1024
+ACK_BYTES = 16 * CHUNK_SIZE
+# Unfinished uploads older than this are removed (seconds)
+UPLOAD_TTL = float(os.environ.get("SIMONMESH_UPLOAD_TTL", 24 * 3600))
+
+_uploads = {}
+
+
+class UploadError(Exception):
+    pass
+
+
+class Upload:
+    def __init__(self, store, uploadId, fileName, size, target, sha256=None):
+        self.store = store
+        self.id = uploadId
+        self.fileName = fileName
+        self.size = size
+        self.target = target
+        self.sha256 = sha256
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        self.file = None
+        # bumped by every receiver taking the upload over
+        self.generation = 0
+        base = os.path.join(store, UPLOAD_DIR, uploadId)
+        self.part = base + '.part'
+        self.meta = base + '.json'
+
+    @classmethod
+    def load(cls, store, uploadId):
+        '''An unfinished upload from disk, its hash rebuilt from the part file.'''
+        meta = os.path.join(store, UPLOAD_DIR, f'{uploadId}.json')
+        try:
+            with open(meta) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if info.get("sha256") is not None and not valid_digest(info["sha256"]):
+            return None
+        upload = cls(store, uploadId, info["fileName"], info["size"], info["target"], info.get("sha256"))
+        upload.rehash()
+        return upload
+
+    def rehash(self):
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        if not os.path.exists(self.part):
+            return
+        with open(self.part, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                self.hash.update(chunk)
+                self.offset += len(chunk)
+
+    def open(self):
+        # a receiver taking over: flush what the previous one wrote
+        self.close()
+        os.makedirs(os.path.dirname(self.part), exist_ok=True)
+        if not os.path.exists(self.meta):
+            with open(self.meta, 'w') as f:
+                json.dump({"fileName": self.fileName, "size": self.size, "target": self.target,
+                           "sha256": self.sha256}, f)
+        if os.path.exists(self.part) and os.path.getsize(self.part) != self.offset:
+            # written by a server that went away before hashing all of it
+            self.rehash()
+        self.file = open(self.part, 'ab')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @property
+    def done(self):
+        return self.offset >= self.size
+
+    def write(self, offset, data):
+        '''Append the frame data found at offset, parts already received are skipped.'''
+        if offset > self.offset:
+            raise UploadError(f'frame at {offset}, expected {self.offset}')
+        data = data[self.offset - offset:]
+        if self.offset + len(data) > self.size:
+            raise UploadError(f'more than the announced {self.size} bytes')
+        self.file.write(data)
+        self.hash.update(data)
+        self.offset += len(data)
+        return len(data)
+
+    def finish(self):
+        '''Move the file into the store (unless it is there already) and link it into place.
+
+        Returns (sha256, deduplicated).
+        '''
+        self.close()
+        digest = self.hash.hexdigest()
+        if self.sha256 and self.sha256 != digest:
+            self.discard()
+            raise UploadError(f'sha256 mismatch: got {digest}, announced {self.sha256}')
+        stored = stored_file(self.store, digest)
+        deduplicated = stored is not None
+        if deduplicated:
+            os.remove(self.part)
+        else:
+            stored = os.path.join(self.store, f'{digest}.stl')
+            os.replace(self.part, stored)
+            remember_digest(stored, digest)
+        os.remove(self.meta)
+        link_into(stored, self.target, digest)
+        return digest, deduplicated
+
+    def discard(self):
+        self.close()
+        for path in (self.part, self.meta):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def prune_uploads(store, ttl=UPLOAD_TTL):
+    '''Remove unfinished uploads nobody resumed within ttl seconds.'''
+    root = os.path.join(store, UPLOAD_DIR)
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        uploadId = name.split('.')[0]
+        path = os.path.join(root, name)
+        if uploadId not in _uploads and now - os.path.getmtime(path) > ttl:
+            os.remove(path)
+
+
+def start_upload(base_dir, case_dir, para):
+    '''(Upload to continue or start, None), or (None, target path) when the file was stored already.'''
+    store = geometry_store(base_dir)
+    fileName = os.path.basename(para["fileName"])
+    if not fileName:
+        raise UploadError('no fileName')
+    target = os.path.join(case_dir, 'constant', 'geometry', fileName)
+    sha256 = para.get("sha256")
+    if sha256 is not None and not valid_digest(sha256):
+        # it names a store entry, a path in it could reach (and remove) any file
+        raise UploadError('sha256 must be 64 lower case hex digits')
+    uploadId = para.get("uploadId")
+    if uploadId:
+        upload = _uploads.get(uploadId) or Upload.load(store, os.path.basename(uploadId))
+        if upload is None:
+            raise UploadError(f'unknown upload {uploadId}')
+        return upload, None
+    prune_uploads(store)
+    if sha256:
+        stored = stored_file(store, sha256)
+        if stored is not None:
+            link_into(stored, target, sha256)
+            return None, target
+    size = int(para["size"])
+    if size < 0:
+        raise UploadError(f'bad size {size}')
+    return Upload(store, uuid.uuid4().hex, fileName, size, target, sha256), None
+
+
+def parse_frame(frame):
+    '''(offset, payload) of an upload frame.'''
+    if len(frame) < HEADER.size:
+        raise UploadError('short frame')
+    magic, offset = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise UploadError('not an upload frame')
+    return offset, memoryview(frame)[HEADER.size:]
+
+
+async def send_json(websocket, message):
+    text = json.dumps(message)
+    count("bytes_sent", len(text))
+    await websocket.send(text)
+
+
+async def geometry_reply(base_dir, case_dir, path):
+    try:
+        return {"geometry": await run_in_worker(case_dir, ingest_stl, path, base_dir)}
+    except (StlError, OSError) as e:
+        print("STL ingestion failed: ", path, e)
+        return {"geometryError": str(e)}
+
+
+async def receive_upload(websocket, obj, base_dir, case_dir):
+    '''The "upload" op: receive one STL file as binary frames into constant/geometry.
+
+    A text frame "pause" ends the op keeping the upload for a later resume,
+    "abort" drops it. Frames at the wrong offset are answered with status
+    "seek" and the offset to continue at.
+    '''
+    para = obj.get("para") or {}
+    reply = {"name": para.get("fileName"), "target": "ofMesh", "ops": "upload"}
+    try:
+        upload, linked = await asyncio.to_thread(start_upload, base_dir, case_dir, para)
+    except (UploadError, KeyError, ValueError, TypeError, OSError) as e:
+        print("upload failed: ", e)
+        await send_json(websocket, {**reply, "status": "fail", "error": str(e)})
+        return
+    if upload is None:
+        print("upload deduplicated before transfer: ", linked, para["sha256"])
+        await send_json(websocket, {**reply, "status": "success", "sha256": para["sha256"], "deduplicated": True,
+                                    "size": os.path.getsize(linked), "url": linked,
+                                    **await geometry_reply(base_dir, case_dir, linked)})
+        return
+
+    _uploads[upload.id] = upload
+    upload.generation += 1
+    generation = upload.generation
+    # file work runs in threads: open() may rehash a whole part file
+    try:
+        await asyncio.to_thread(upload.open)
+    except OSError as e:
+        print("upload failed: ", e)
+        if upload.generation == generation:
+            _uploads.pop(upload.id, None)
+        await send_json(websocket, {**reply, "status": "fail", "error": str(e)})
+        return
+    reply["uploadId"] = upload.id
+    await send_json(websocket, {**reply, "status": "ready", "offset": upload.offset, "chunkSize": CHUNK_SIZE})
+    acked = upload.offset
+    try:
+        while not upload.done:
+            message = await websocket.recv()
+            if upload.generation != generation:
+                print("upload taken over by another connection: ", upload.fileName)
+                return
+            if isinstance(message, str):
+                if message == "abort":
+                    print("upload aborted: ", upload.fileName)
+                    _uploads.pop(upload.id, None)
+                    upload.discard()
+                    await send_json(websocket, {**reply, "status": "aborted"})
+                    return
+                if message == "pause":
+                    await send_json(websocket, {**reply, "status": "paused", "offset": upload.offset})
+                    return
+                continue
+            try:
+                offset, data = parse_frame(message)
+                count("bytes_received", await asyncio.to_thread(upload.write, offset, data))
+            except UploadError as e:
+                await send_json(websocket, {**reply, "status": "seek", "offset": upload.offset, "error": str(e)})
+                continue
+            if upload.offset - acked >= ACK_BYTES:
+                acked = upload.offset
+                await send_json(websocket, {**reply, "status": "progress", "offset": upload.offset})
+
+        _uploads.pop(upload.id, None)
+        try:
+            with span("upload.finish"):
+                digest, deduplicated = await asyncio.to_thread(upload.finish)
+        except (UploadError, OSError) as e:
+            print("upload failed: ", e)
+            await send_json(websocket, {**reply, "status": "fail", "error": str(e)})
+            return
+        print("upload stored: ", upload.target, digest, "deduplicated" if deduplicated else "")
+        await send_json(websocket, {**reply, "status": "success", "sha256": digest, "deduplicated": deduplicated,
+                                    "size": upload.size, "url": upload.target,
+                                    **await geometry_reply(base_dir, case_dir, upload.target)})
+    finally:
+        # on a disconnect the part file stays for a resume; an upload taken
+        # over belongs to the new receiver
+        if upload.generation == generation:
+            _uploads.pop(upload.id, None)
+            upload.close()
@@ -0,0 +1,242 @@
+import re
+import zlib
+import struct
+import numpy as np
+from polyMeshReader import vtk_polydata
+
+# Compact binary surface layout sent to clients instead of ASCII legacy VTK.
+#
+#   header: magic "SMS1", version u16, flags u16, nPoints u32, nIndices u32,
+#           bodySize u32 (uncompressed), little endian
+#   body:   float32 xyz * nPoints, int32 triangle indices * nIndices
+#
+# The body is zlib compressed when FLAG_ZLIB is set. Both arrays can be
+# uploaded to the GPU as they are (Float32Array / Int32Array on the client).
+
+MAGIC = b'SMS1'
+VERSION = 1
+FLAG_ZLIB = 1
+HEADER = struct.Struct('<4sHHIII')
+
+# Formats the server can produce, in order of preference
+FORMATS = ("surface+zlib", "surface", "vtk")
+
+_SECTION = re.compile(rb'\n(POINTS|POLYGONS|OFFSETS|CONNECTIVITY|POINT_DATA|CELL_DATA|'
+                      rb'LINES|VERTICES|TRIANGLE_STRIPS|METADATA|FIELD)\b([^\n]*)\n')
+
+
+class PayloadError(Exception):
+    pass
+
+
+def _numbers(body, dtype):
+    # fromstring in text mode parses in C, several times faster than split()
+    return np.fromstring(body, dtype=dtype, sep=' ')
+
+
+def negotiate_format(obj):
+    '''Pick the payload format for a request.
+
+    Clients list what they accept in "formats" (most preferred first) or
+    ask for a single "format"; old clients get the VTK file as before.
+    '''
+    accepted = obj.get("formats") or [obj.get("format", "vtk")]
+    for fmt in accepted:
+        if fmt in FORMATS:
+            return fmt
+    return "vtk"
+
+
+def read_vtk_polydata(data):
+    '''Parse ASCII legacy VTK PolyData into (points, offsets, labels).
+
+    Handles both the classic "POLYGONS n size" cell layout and the
+    OFFSETS/CONNECTIVITY layout of VTK file version 5.
+    '''
+    if b'\nASCII' not in data[:256]:
+        raise PayloadError('only ASCII legacy VTK is supported')
+
+    sections = list(_SECTION.finditer(data))
+    blocks = {}
+    for i, m in enumerate(sections):
+        end = sections[i + 1].start() if i + 1 < len(sections) else len(data)
+        blocks[m.group(1)] = (m.group(2).split(), data[m.end():end])
+
+    if b'POINTS' not in blocks:
+        raise PayloadError('no POINTS section')
+    args, body = blocks[b'POINTS']
+    nPoints = int(args[0])
+    points = _numbers(body, np.float64)[:nPoints * 3].reshape(nPoints, 3)
+
+    if b'OFFSETS' in blocks:
+        offsets = _numbers(blocks[b'OFFSETS'][1], np.int64)
+        labels = _numbers(blocks[b'CONNECTIVITY'][1], np.int64)
+        return points, offsets, labels
+
+    if b'POLYGONS' not in blocks:
+        return points, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    args, body = blocks[b'POLYGONS']
+    nPolys, size = int(args[0]), int(args[1])
+    flat = _numbers(body, np.int64)[:size]
+
+    n = flat[0] if flat.size else 0
+    if flat.size == nPolys * (n + 1) and np.all(flat[::n + 1] == n):
+        return points, np.arange(nPolys + 1, dtype=np.int64) * n, flat.reshape(nPolys, n + 1)[:, 1:].ravel()
+
+    heads = np.empty(nPolys, dtype=np.int64)
+    pos = 0
+    for i in range(nPolys):
+        heads[i] = pos
+        pos += flat[pos] + 1
+    offsets = np.zeros(nPolys + 1, dtype=np.int64)
+    np.cumsum(flat[heads], out=offsets[1:])
+    keep = np.ones(flat.size, dtype=bool)
+    keep[heads] = False
+    return points, offsets, flat[keep]
+
+
+def triangulate(offsets, labels):
+    '''Fan triangulate CSR polygons into an (n, 3) index array.'''
+    counts = np.diff(offsets)
+    ntri = np.maximum(counts - 2, 0)
+    total = int(ntri.sum())
+    if total == 0:
+        return np.zeros((0, 3), dtype=np.int64)
+    first = np.repeat(offsets[:-1], ntri)
+    start = np.zeros(len(ntri), dtype=np.int64)
+    np.cumsum(ntri[:-1], out=start[1:])
+    k = np.arange(total) - np.repeat(start, ntri)
+    return np.column_stack([labels[first], labels[first + 1 + k], labels[first + 2 + k]])
+
+
+def deduplicate(points, triangles):
+    '''Merge coincident points (at float32 precision) and drop unused ones.'''
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    # unique over 12 byte records is much faster than unique(axis=0)
+    keys = points.view(np.dtype((np.void, 12))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    unique = points[first]
+    triangles = inverse.reshape(-1)[triangles]
+    used = np.zeros(len(unique), dtype=bool)
+    used[triangles] = True
+    remap = np.cumsum(used) - 1
+    return unique[used], remap[triangles]
+
+
+def encode_surface(points, triangles, compress=False):
+    body = np.ascontiguousarray(points, dtype='<f4').tobytes() + \
+           np.ascontiguousarray(triangles, dtype='<i4').tobytes()
+    flags = 0
+    size = len(body)
+    if compress:
+        body = zlib.compress(body, 1)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(MAGIC, VERSION, flags, len(points), triangles.size, size) + body
+
+
+def decode_surface(data):
+    '''Inverse of encode_surface, returns (points, triangles).'''
+    magic, version, flags, nPoints, nIndices, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise PayloadError('not a surface payload')
+    body = data[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+    points = np.frombuffer(body, dtype='<f4', count=nPoints * 3).reshape(-1, 3)
+    triangles = np.frombuffer(body, dtype='<i4', count=nIndices, offset=nPoints * 12).reshape(-1, 3)
+    return points, triangles
+
+
+def vtk_to_surface(data, compress=False):
+    points, offsets, labels = read_vtk_polydata(data)
+    points, triangles = deduplicate(points, triangulate(offsets, labels))
+    return encode_surface(points, triangles, compress)
+
+
+def decimate(points, triangles, target):
+    '''Vertex clustering simplification down to roughly target points.
+
+    Points are snapped to a uniform grid sized from the bounding box, each
+    occupied cell becomes one point at the mean of its members, and
+    triangles that collapse or duplicate another are dropped.
+    '''
+    if len(points) <= target or len(triangles) == 0:
+        return points, triangles
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, 1e-30)
+    # patches are mostly two dimensional: spread target cells over the two
+    # largest extents
+    major = np.sort(extent)[1:].prod()
+    h = np.sqrt(major / target)
+    dims = np.maximum(np.ceil(extent / h).astype(np.int64), 1)
+    cell = np.minimum(((points - lo) / h).astype(np.int64), dims - 1)
+    keys = (cell[:, 0] * dims[1] + cell[:, 1]) * dims[2] + cell[:, 2]
+    _, cluster = np.unique(keys, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    n = cluster.max() + 1
+    counts = np.bincount(cluster, minlength=n)[:, None]
+    coarse = np.column_stack([np.bincount(cluster, weights=points[:, k], minlength=n) for k in range(3)]) / counts
+
+    tri = cluster[triangles]
+    keep = (tri[:, 0] != tri[:, 1]) & (tri[:, 1] != tri[:, 2]) & (tri[:, 0] != tri[:, 2])
+    tri = tri[keep]
+    # drop duplicates regardless of winding, keep the first orientation
+    _, first = np.unique(np.sort(tri, axis=1), axis=0, return_index=True)
+    return coarse, tri[np.sort(first)]
+
+
+def encode(points, triangles, fmt, title='surface'):
+    if fmt == "vtk":
+        offsets = np.arange(len(triangles) + 1) * 3
+        return vtk_polydata(title, points, offsets, triangles.ravel()).encode()
+    return encode_surface(points, triangles, compress=fmt == "surface+zlib")
+
+
+def read_surface(path):
+    '''Return (raw bytes, points, triangles) of a patch file.
+
+    points and triangles are None when the file can't be parsed. Points
+    are not deduplicated yet: decimation merges them anyway, so the coarse
+    level doesn't pay for it.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        points, offsets, labels = read_vtk_polydata(data)
+        return data, points, triangulate(offsets, labels)
+    except (PayloadError, ValueError, IndexError) as e:
+        print("surface payload conversion failed, sending vtk: ", path, e)
+        return data, None, None
+
+
+def full_payload(surface, fmt):
+    data, points, triangles = surface
+    if points is None:
+        return data, "vtk"
+    if fmt == "vtk":
+        return data, fmt
+    return encode(*deduplicate(points, triangles), fmt), fmt
+
+
+def coarse_payload(surface, fmt, target, title='surface'):
+    '''Decimated payload of a surface, None when it is already small enough.'''
+    data, points, triangles = surface
+    if points is None or len(points) <= target:
+        return None
+    return encode(*decimate(points, triangles, target), fmt, title=title), fmt
+
+
+def load_payload(path, fmt="vtk"):
+    '''Return (bytes, format) to send for a patch file.
+
+    Falls back to the VTK file itself when it can't be converted.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if fmt == "vtk":
+        return data, fmt
+    try:
+        return vtk_to_surface(data, compress=fmt == "surface+zlib"), fmt
+    except (PayloadError, ValueError, IndexError) as e:
+        print("surface payload conversion failed, sending vtk: ", path, e)
+        return data, "vtk"
@@ -0,0 +1,28 @@
+'''Case materialization: field names from the client never leave 0/.'''
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from caseMaterializer import materialize
+
+FIELD = {"class": "volScalarField", "internalField": ["uniform", 0]}
+
+
+@pytest.mark.parametrize("name", ["../../escaped", "a/b", ".hidden", "", "p q", 'p"'])
+def test_bad_field_names_rejected(tmp_path, name):
+    case = tmp_path / 'case'
+    with pytest.raises(ValueError):
+        materialize(str(case), {"fields": {name: FIELD}, "patches": ["inlet"]})
+    # nothing written, in the case or next to it
+    assert os.listdir(tmp_path) == []
+
+
+def test_field_files_written_once(tmp_path):
+    spec = {"fields": {"p": FIELD, "alpha.water": FIELD}, "patches": ["inlet"]}
+    first = materialize(str(tmp_path), spec)
+    assert {'0/p', '0/alpha.water', 'system/controlDict'} <= set(first["written"])
+    again = materialize(str(tmp_path), spec)
+    assert again["written"] == [] and set(again["unchanged"]) == set(first["written"])
@@ -0,0 +1,90 @@
+'''OpenFOAM file parser: fast numeric lists, binary lists, mmap and .gz
+reads and the parsed file cache.'''
+import os
+import sys
+import gzip
+import mmap
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+import foamDict
+from foamDict import parse_foam, read_foam_file, read_foam_bytes, CompactList, FoamDictError
+
+HEADER = 'FoamFile\n{\n    version 2.0;\n    format %s;\n    class %s;\n    arch "LSB;label=32;scalar=64";\n}\n'
+
+
+def test_numeric_lists():
+    parsed = parse_foam('a 3(1 2 3); b 2((1 2.5 3) (4 5 6)); c 2(3(0 1 2) 4(0 1 2 3));')
+    assert parsed["a"].tolist() == [1, 2, 3]
+    assert parsed["b"].tolist() == [[1, 2.5, 3], [4, 5, 6]]
+    assert isinstance(parsed["c"], CompactList)
+    assert parsed["c"].offsets.tolist() == [0, 3, 7]
+
+
+def test_flat_list_with_sublist_is_not_cut_short():
+    # the first ")" closes the sublist, not the list
+    assert parse_foam('a 3(1.5 (2 3) 4); b 1;') == {"a": [1.5, [2, 3], 4], "b": 1}
+    assert parse_foam('a 2((1.5 (2) 3) (5 6));')["a"] == [[1.5, [2], 3], [5, 6]]
+
+
+def test_miscounted_list_raises():
+    with pytest.raises(FoamDictError):
+        parse_foam('a 4(1 2 3);')
+
+
+def test_binary_scalar_list():
+    values = np.array([0.5, 1e-300, -2.0], dtype='<f8')
+    data = (HEADER % ('binary', 'volScalarField')).encode() + \
+        b'internalField nonuniform List<scalar> 3(' + values.tobytes() + b');\n'
+    parsed = parse_foam(data)
+    assert parsed["internalField"][0] == 'nonuniform'
+    assert parsed["internalField"][1].tolist() == values.tolist()
+
+
+def test_gz_file(tmp_path):
+    with gzip.open(tmp_path / 'points.gz', 'wb') as f:
+        f.write((HEADER % ('ascii', 'vectorField') + '2\n(\n(0 0 0)\n(1 2 3)\n)\n').encode())
+    points = read_foam_file(str(tmp_path / 'points'))[None][0]
+    assert points.tolist() == [[0, 0, 0], [1, 2, 3]]
+
+
+def test_big_binary_file_is_mapped(tmp_path):
+    count = foamDict.MMAP_MIN_BYTES // 24 + 1000
+    points = np.arange(count * 3, dtype='<f8').reshape(count, 3)
+    path = str(tmp_path / 'points')
+    with open(path, 'wb') as f:
+        f.write((HEADER % ('binary', 'vectorField') + f'{count}\n(').encode())
+        f.write(points.tobytes())
+        f.write(b')\n')
+    assert isinstance(read_foam_bytes(path), mmap.mmap)
+    parsed = read_foam_file(path)[None][0]
+    assert parsed.shape == (count, 3) and np.array_equal(parsed, points)
+    # never cached, OpenFOAM may rewrite it in place
+    assert read_foam_file(path) is not read_foam_file(path)
+
+
+def test_cache_follows_mtime_and_size(tmp_path):
+    path = tmp_path / 'controlDict'
+    path.write_text('endTime 10;\n')
+    first = read_foam_file(str(path))
+    assert read_foam_file(str(path)) is first
+    # same size, new mtime
+    path.write_text('endTime 20;\n')
+    stamp = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(stamp, stamp))
+    assert read_foam_file(str(path))["endTime"] == 20
+    # new size, same mtime
+    path.write_text('endTime 300;\n')
+    os.utime(path, ns=(stamp, stamp))
+    assert read_foam_file(str(path))["endTime"] == 300
+
+
+def test_cache_follows_included_files(tmp_path):
+    (tmp_path / 'settings').write_text('nu 1;\n')
+    (tmp_path / 'transportProperties').write_text('#include "settings"\nmodel Newtonian;\n')
+    assert read_foam_file(str(tmp_path / 'transportProperties'))["nu"] == 1
+    (tmp_path / 'settings').write_text('nu 22;\n')
+    assert read_foam_file(str(tmp_path / 'transportProperties'))["nu"] == 22
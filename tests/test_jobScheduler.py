@@ -0,0 +1,129 @@
+'''Job scheduler: per case ordering, supersede and cancel ordering.'''
+import asyncio
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from jobScheduler import JobScheduler, JobSuperseded
+from patchStream import uninterrupted
+
+
+def test_same_case_runs_in_order_other_cases_in_parallel(tmp_path):
+    events = []
+
+    def job(name, delay):
+        async def run():
+            events.append(('start', name))
+            await asyncio.sleep(delay)
+            events.append(('end', name))
+            return name
+        return run
+
+    async def main():
+        scheduler = JobScheduler()
+        a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+        results = await asyncio.gather(scheduler.run(a, 'mesh', job('a1', 0.05)),
+                                       scheduler.run(a, 'solve', job('a2', 0)),
+                                       scheduler.run(b, 'mesh', job('b1', 0)))
+        return scheduler, results
+
+    scheduler, results = asyncio.run(main())
+    assert results == ['a1', 'a2', 'b1']
+    # a2 waits for a1, b1 does not
+    assert events.index(('end', 'a1')) < events.index(('start', 'a2'))
+    assert events.index(('end', 'b1')) < events.index(('end', 'a1'))
+    assert scheduler.counts == {"submitted": 3, "completed": 3, "superseded": 0, "failed": 0}
+    assert scheduler.cases == {}
+
+
+def test_supersede_queued_and_running(tmp_path):
+    case = str(tmp_path)
+    started = []
+
+    def job(name):
+        async def run():
+            started.append(name)
+            await asyncio.sleep(0.05)
+            return name
+        return run
+
+    async def main():
+        scheduler = JobScheduler()
+        first = asyncio.ensure_future(scheduler.run(case, 'mesh', job('first')))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(scheduler.run(case, 'mesh', job('second')))
+        await asyncio.sleep(0)
+        third = asyncio.ensure_future(scheduler.run(case, 'mesh', job('third')))
+        results = await asyncio.gather(first, second, third, return_exceptions=True)
+        return scheduler, results
+
+    scheduler, (first, second, third) = asyncio.run(main())
+    assert isinstance(first, JobSuperseded) and 'while running' in str(first)
+    assert isinstance(second, JobSuperseded) and 'while queued' in str(second)
+    assert third == 'third'
+    assert started == ['first', 'third']
+    assert scheduler.counts["superseded"] == 2 and scheduler.counts["completed"] == 1
+
+
+def test_other_ops_are_not_superseded(tmp_path):
+    async def job():
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    async def main():
+        scheduler = JobScheduler()
+        return await asyncio.gather(scheduler.run(str(tmp_path), 'mesh', job),
+                                    scheduler.run(str(tmp_path), 'solve', job))
+
+    assert asyncio.run(main()) == ['done', 'done']
+
+
+def test_superseded_job_finishes_its_transfer_first(tmp_path):
+    case = str(tmp_path)
+    events = []
+
+    async def transfer():
+        events.append('transfer start')
+        await asyncio.sleep(0.05)
+        events.append('transfer end')
+
+    async def old():
+        await uninterrupted(transfer())
+        events.append('old after transfer')
+
+    async def new():
+        events.append('new start')
+
+    async def main():
+        scheduler = JobScheduler()
+        first = asyncio.ensure_future(scheduler.run(case, 'view', old))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(scheduler.run(case, 'view', new))
+        with pytest.raises(JobSuperseded):
+            await first
+        await second
+
+    asyncio.run(main())
+    assert events == ['transfer start', 'transfer end', 'new start']
+
+
+def test_failed_job_does_not_block_the_case(tmp_path):
+    async def failing():
+        raise RuntimeError('blockMesh failed')
+
+    async def fine():
+        return 'ok'
+
+    async def main():
+        scheduler = JobScheduler(supersede=False)
+        results = await asyncio.gather(scheduler.run(str(tmp_path), 'mesh', failing),
+                                       scheduler.run(str(tmp_path), 'mesh', fine),
+                                       return_exceptions=True)
+        return scheduler, results
+
+    scheduler, (failed, ok) = asyncio.run(main())
+    assert isinstance(failed, RuntimeError) and ok == 'ok'
+    assert scheduler.counts["failed"] == 1 and scheduler.counts["completed"] == 1
@@ -0,0 +1,64 @@
+'''Mesh cache: restores replace the case's mesh whole and survive eviction races.'''
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from meshCache import MeshCache, INDEX_NAME
+
+
+def mesh(root, name, size=10):
+    os.makedirs(os.path.join(root, 'polyMesh'))
+    with open(os.path.join(root, 'polyMesh', 'points'), 'w') as f:
+        f.write(name * size)
+    path = os.path.join(root, 'inlet.vtk')
+    with open(path, 'w') as f:
+        f.write(name)
+    return {"inlet": path}, os.path.join(root, 'polyMesh')
+
+
+def test_restore_replaces_polyMesh(tmp_path):
+    cache = MeshCache(str(tmp_path / 'cache'))
+    cache.put('k', *mesh(str(tmp_path / 'a'), 'a'))
+    case = tmp_path / 'case'
+    (case / 'constant' / 'polyMesh' / 'sets').mkdir(parents=True)
+    (case / 'constant' / 'polyMesh' / 'cellZones').write_text('stale')
+    cache.restore(cache.get('k'), str(case))
+    assert os.listdir(case / 'constant') == ['polyMesh']
+    assert os.listdir(case / 'constant' / 'polyMesh') == ['points']
+    assert (case / 'inlet.vtk').read_text() == 'a'
+
+
+def test_hits_do_not_rewrite_index(tmp_path):
+    cache = MeshCache(str(tmp_path / 'cache'))
+    cache.put('k', *mesh(str(tmp_path / 'a'), 'a'))
+    index = tmp_path / 'cache' / INDEX_NAME
+    stamp = index.stat().st_mtime_ns
+    os.utime(index, ns=(stamp - 10**9, stamp - 10**9))
+    for _ in range(3):
+        assert cache.get('k') is not None
+    assert index.stat().st_mtime_ns == stamp - 10**9
+    assert cache.stats()["hits"] == 3
+
+
+def test_evicted_entry_raises_oserror(tmp_path):
+    cache = MeshCache(str(tmp_path / 'cache'), max_bytes=15)
+    cache.put('old', *mesh(str(tmp_path / 'a'), 'a'))
+    entry = cache.get('old')
+    cache.put('new', *mesh(str(tmp_path / 'b'), 'b'))
+    assert cache.get('old') is None
+    with pytest.raises(OSError):
+        cache.restore(entry, str(tmp_path / 'case'))
+
+
+def test_pinned_entry_not_evicted(tmp_path):
+    cache = MeshCache(str(tmp_path / 'cache'), max_bytes=15)
+    cache.put('old', *mesh(str(tmp_path / 'a'), 'a'))
+    cache.pinned['old'] = 1
+    cache.put('new', *mesh(str(tmp_path / 'b'), 'b'))
+    assert cache.get('old') is not None and cache.get('new') is not None
+    del cache.pinned['old']
+    cache.put('newer', *mesh(str(tmp_path / 'c'), 'c'))
+    assert cache.get('old') is None
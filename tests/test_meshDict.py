@@ -0,0 +1,55 @@
+'''The view renders blockMeshDict from the full model JSON every time: a
+model sent again must reuse the sections the worker already rendered.'''
+import os
+import sys
+import json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+import toDICT
+from blockModel import BlockModel
+from toDICT import render_mesh_dict
+from synthetic import mesh_json
+
+SECTIONS = ("vertices", "blocks", "edges", "boundary")
+
+
+def cached(fileName):
+    return {name: toDICT._sectionCache[fileName][name] for name in SECTIONS}
+
+
+def test_repeated_model_reuses_sections(tmp_path):
+    fileName = str(tmp_path / 'blockMeshDict')
+    text = mesh_json(200, 8)
+    digest, _ = render_mesh_dict(text, fileName)
+    before = cached(fileName)
+
+    assert render_mesh_dict(text, fileName)[0] == digest
+    after = cached(fileName)
+    assert all(after[name] is before[name] for name in SECTIONS)
+
+
+def test_changed_model_renders_changed_section_only(tmp_path):
+    fileName = str(tmp_path / 'blockMeshDict')
+    model = json.loads(mesh_json(200, 8))
+    render_mesh_dict(json.dumps(model), fileName)
+    before = cached(fileName)
+
+    model["vertices"][0]["xyz"][0] += 0.5
+    render_mesh_dict(json.dumps(model), fileName)
+    after = cached(fileName)
+    assert after["vertices"] is not before["vertices"]
+    assert all(after[name] is before[name] for name in SECTIONS[1:])
+    with open(fileName) as f:
+        assert f.read() == toDICT.ToMeshDICT(toDICT.BlockModel(model), fileName + '.fresh').res
+
+
+def test_coordinates_round_trip():
+    values = [0.30000000000000004, 0.1, 2, -1.5e-17, 1e16, 123456.789012345678]
+    model = BlockModel({"vertices": [{"xyz": [v, v, v]} for v in values]})
+    lines = model.render_vertices().splitlines()[2:-1]
+    read = [float(line.strip('\t()').split()[0]) for line in lines]
+    assert read == [float(v) for v in values]
+    # integers stay integral, as the client's JSON writes them
+    assert lines[2] == '\t(2 2 2)'
@@ -0,0 +1,93 @@
+'''Patch transfer: protocol 2 frames, resume from an offset, and
+transfers that a cancelled job still finishes.'''
+import os
+import sys
+import json
+import zlib
+import asyncio
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from patchStream import (Transfer, register, parse_frame, resume_patch, uninterrupted, patch_sender, is_legacy,
+                         HEADER, FLAG_FIRST, FLAG_LAST, VERSION)
+
+DATA = os.urandom(200000)
+
+
+class Client:
+    def __init__(self):
+        self.messages = []
+        self.frames = []
+
+    async def send(self, message):
+        if isinstance(message, str):
+            self.messages.append(json.loads(message))
+        else:
+            self.frames.append(bytes(message))
+
+
+def test_frame_header_round_trip():
+    transfer = Transfer('inlet', DATA)
+    first = transfer.frame(0, 65536)
+    header, payload = parse_frame(first)
+    assert len(first) == HEADER.size + 65536
+    assert header == {"version": VERSION, "flags": FLAG_FIRST, "id": transfer.id, "offset": 0,
+                      "total": len(DATA), "crc": zlib.crc32(DATA), "length": 65536}
+    assert payload == DATA[:65536]
+    header, payload = parse_frame(transfer.frame(196608, 65536))
+    assert header["flags"] == FLAG_LAST and header["length"] == len(DATA) - 196608
+    assert payload == DATA[196608:]
+    with pytest.raises(ValueError):
+        parse_frame(b'XXXX' + first[4:])
+
+
+def test_resume_from_offset():
+    transfer = register(Transfer('inlet', DATA))
+    client = Client()
+    asyncio.run(resume_patch(client, {"id": transfer.id, "crc": transfer.crc, "offset": 70000}))
+    assert client.messages[0]["ops"] == "resume" and client.messages[0]["offset"] == 70000
+    parsed = [parse_frame(frame) for frame in client.frames]
+    assert parsed[0][0]["offset"] == 70000
+    assert b''.join(payload for _, payload in parsed) == DATA[70000:]
+
+
+def test_resume_unknown_transfer_fails():
+    transfer = register(Transfer('inlet', DATA))
+    client = Client()
+    asyncio.run(resume_patch(client, {"id": transfer.id, "crc": transfer.crc + 1, "offset": 0}))
+    assert client.messages[0]["status"] == "fail" and client.frames == []
+
+
+def test_uninterrupted_finishes_before_cancelling():
+    steps = []
+
+    async def transfer():
+        for i in range(5):
+            await asyncio.sleep(0.01)
+            steps.append(i)
+        return 'done'
+
+    async def main():
+        task = asyncio.ensure_future(uninterrupted(transfer()))
+        await asyncio.sleep(0.015)
+        task.cancel()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return list(steps)
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+    assert asyncio.run(uninterrupted(transfer())) == 'done'
+
+
+def test_uninterrupted_passes_errors_on():
+    async def failing():
+        raise OSError('gone')
+    with pytest.raises(OSError):
+        asyncio.run(uninterrupted(failing()))
+
+
+@pytest.mark.parametrize("protocol, legacy", [(None, True), (1, True), ("2", False), (2, False), ("v2", True)])
+def test_protocol_parsed_defensively(protocol, legacy):
+    assert is_legacy(patch_sender(Client(), protocol, lodTarget="many", progressive=True)) == legacy
@@ -0,0 +1,102 @@
+'''Residual index: append, reload from the checkpoint, and drop stale state.'''
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from residualIndex import ResidualIndex
+
+STEP = ('Time = {t}\n\n'
+        'smoothSolver:  Solving for Ux, Initial residual = {ux}, Final residual = 0.001, No Iterations 2\n'
+        'GAMG:  Solving for p, Initial residual = {p}, Final residual = 0.0001, No Iterations 5\n')
+
+
+def step(t):
+    return STEP.format(t=t, ux=1 / t, p=0.5 / t).encode()
+
+
+def write_log(path, steps, mode='wb'):
+    with open(path, mode) as f:
+        f.write(b''.join(step(t) for t in steps))
+
+
+def tail(log, index):
+    '''What the case worker does: feed the log from the checkpoint and append.'''
+    parser = index.load()
+    with open(log, 'rb') as f:
+        f.seek(index.offset)
+        parser.feed(f.read())
+    index.append(*parser.take(), parser.checkpoint())
+
+
+def stored(index):
+    times, series = index.read()
+    return times, {field: (t.tolist(), v.tolist()) for field, (t, v) in series.items()}
+
+
+def test_reload_resumes_at_checkpoint(tmp_path):
+    log = str(tmp_path / 'log.simpleFoam')
+    write_log(log, [1, 2])
+    tail(log, ResidualIndex(log))
+    write_log(log, [3], 'ab')
+    index = ResidualIndex(log)
+    tail(log, index)
+    times, series = stored(index)
+    assert times == [1, 2, 3]
+    assert series["Ux"] == ([1, 2, 3], [1, 0.5, 1 / 3])
+    assert series["p"] == ([1, 2, 3], [0.5, 0.25, 0.5 / 3])
+    assert index.read(2, 3)[0] == [2, 3]
+
+    reader = ResidualIndex(log)
+    assert reader.read() == ([], {})
+    reader.refresh()
+    assert stored(reader) == (times, series)
+
+
+def test_tail_beyond_the_counts_is_cut(tmp_path):
+    log = str(tmp_path / 'log.simpleFoam')
+    write_log(log, [1, 2])
+    tail(log, ResidualIndex(log))
+    # a crash after writing the arrays but before meta.json
+    index = ResidualIndex(log)
+    with open(index.path('time.f8'), 'ab') as f:
+        f.write(b'\0' * 8)
+    with open(index.field_file(0), 'ab') as f:
+        f.write(b'\0' * 16)
+    index.load()
+    assert os.path.getsize(index.path('time.f8')) == 2 * 8
+    assert os.path.getsize(index.field_file(0)) == 2 * 16
+    write_log(log, [3], 'ab')
+    tail(log, index)
+    assert stored(index)[0] == [1, 2, 3]
+
+
+def test_replaced_or_truncated_log_clears_the_index(tmp_path):
+    log = str(tmp_path / 'log.simpleFoam')
+    write_log(log, [1, 2, 3])
+    tail(log, ResidualIndex(log))
+    write_log(log, [1])   # same inode, shorter than the checkpoint
+    index = ResidualIndex(log)
+    tail(log, index)
+    assert stored(index)[0] == [1]
+
+    # a new log written next to the old one and moved over it has another inode
+    write_log(log + '.new', [1, 2, 3, 4, 5])
+    os.replace(log + '.new', log)
+    index = ResidualIndex(log)
+    parser = index.load()
+    assert index.offset == 0 and os.listdir(index.root) == []
+    assert parser.checkpoint()["offset"] == 0
+    tail(log, index)
+    assert stored(index)[0] == [1, 2, 3, 4, 5]
+
+
+def test_missing_array_reads_empty(tmp_path):
+    log = str(tmp_path / 'log.simpleFoam')
+    write_log(log, [1, 2])
+    tail(log, ResidualIndex(log))
+    index = ResidualIndex(log)
+    os.remove(index.path('time.f8'))
+    index.refresh()
+    times, series = stored(index)
+    assert times == [] and series["p"] == ([1, 2], [0.5, 0.25])
@@ -0,0 +1,105 @@
+'''Residual scanner: the same residuals however the log is cut into blocks.'''
+import os
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from residualLog import ResidualParser, parse_log_file
+
+LOG = b'''/*---------------------------------------------------------------------------*\\
+Starting time loop
+
+Time = 1
+
+smoothSolver:  Solving for Ux, Initial residual = 1, Final residual = 0.01, No Iterations 3
+smoothSolver:  Solving for Uy, Initial residual = 0.5, Final residual = 0.004, No Iterations 3
+GAMG:  Solving for p, Initial residual = 0.25, Final residual = 0.002, No Iterations 9
+GAMG:  Solving for p, Initial residual = 0.125, Final residual = 0.001, No Iterations 4
+time step continuity errors : sum local = 1e-05, global = -2e-19, cumulative = 1e-18
+ExecutionTime = 0.1 s
+
+Time = 2
+
+smoothSolver:  Solving for Ux, Initial residual = 0.1, Final residual = 0.001, No Iterations 2
+smoothSolver:  Solving for Uy, Initial residual = 0.05, Final residual = 0.0004, No Iterations 2
+GAMG:  Solving for p, Initial residual = 0.025, Final residual = 0.0002, No Iterations 7
+time step continuity errors : sum local = 1e-06, global = 3e-20, cumulative = 1e-18
+'''
+
+EXPECTED = {"Ux": ([1, 2], [1, 0.1]), "Uy": ([1, 2], [0.5, 0.05]), "p": ([1, 2], [0.25, 0.025]),
+            "continuity": ([1, 2], [-2e-19, 3e-20])}
+
+
+def parsed(parser):
+    times, series = parser.take()
+    return times, {field: (t.tolist(), v.tolist()) for field, (t, v) in series.items()}
+
+
+def feed(blocks):
+    parser = ResidualParser()
+    for block in blocks:
+        parser.feed(block)
+    parser.finish()
+    return parsed(parser)
+
+
+def test_whole_log():
+    times, series = feed([LOG])
+    assert times == [1, 2]
+    # only the first p corrector of a time step counts
+    assert series == EXPECTED
+
+
+def test_any_block_boundary():
+    whole = feed([LOG])
+    for size in (1, 7, 64, 333):
+        assert feed([LOG[i:i + size] for i in range(0, len(LOG), size)]) == whole
+    for cut in range(0, len(LOG), 17):
+        assert feed([LOG[:cut], LOG[cut:]]) == whole
+
+
+def test_partial_last_line_waits_for_its_end():
+    line = b'GAMG:  Solving for k, Initial residual = 0.5, Final residual = 0.1, No Iterations 1\n'
+    parser = ResidualParser()
+    parser.feed(LOG + line[:30])
+    assert 'k' not in parsed(parser)[1]
+    # the checkpoint points at the start of the partial line, it is read again on resume
+    assert parser.checkpoint()["offset"] == len(LOG)
+    parser.feed(line[30:])
+    assert parsed(parser)[1]["k"] == ([2], [0.5])
+
+
+def test_unterminated_last_line_is_read_by_finish():
+    parser = ResidualParser()
+    parser.feed(LOG + b'Time = 3\n\nGAMG:  Solving for p, Initial residual = 0.5, Final residual = 0.1')
+    times, series = parsed(parser)
+    assert times == [1, 2, 3] and series["p"][0] == [1, 2]
+    parser.finish()
+    assert parsed(parser)[1]["p"] == ([3], [0.5])
+
+
+def test_resume_from_checkpoint(tmp_path):
+    path = tmp_path / 'log.run'
+    path.write_bytes(LOG)
+    cut = LOG.index(b'smoothSolver:  Solving for Uy', LOG.index(b'Time = 2'))
+    first = ResidualParser()
+    first.feed(LOG[:cut + 20])
+    head = parsed(first)
+    resumed = parse_log_file(str(path), ResidualParser.resume(first.checkpoint()),
+                             start=first.checkpoint()["offset"])
+    resumed.finish()
+    times, series = parsed(resumed)
+    assert head[0] + times == [1, 2]
+    for field, (t, v) in EXPECTED.items():
+        before = head[1].get(field, ([], []))
+        after = series.get(field, ([], []))
+        assert (before[0] + after[0], before[1] + after[1]) == (t, v)
+
+
+def test_residual_before_first_time_step():
+    parser = ResidualParser()
+    parser.feed(b'GAMG:  Solving for p, Initial residual = 1, Final residual = 0.1, No Iterations 1\n')
+    valueTimes, values = parser.take()[1]["p"]
+    assert np.isnan(valueTimes[0]) and values.tolist() == [1]
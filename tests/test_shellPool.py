@@ -0,0 +1,42 @@
+'''Pooled shells: a command line that does not parse fails that command,
+the session stays usable.'''
+import os
+import sys
+import asyncio
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from shellPool import ShellPool
+from processEngine import ProcessTimeout
+
+pytestmark = pytest.mark.skipif(not os.path.exists('/bin/bash'), reason='needs bash')
+
+
+def run(commands, timeout=None):
+    async def main():
+        pool = ShellPool(['/bin/bash', '--noprofile', '--norc'])
+        try:
+            return [await asyncio.wait_for(pool.run(c, timeout=timeout), 10) for c in commands]
+        finally:
+            await pool.close()
+    return asyncio.run(main())
+
+
+def test_syntax_error_fails_fast():
+    bad, good = run(['echo "unbalanced', 'echo "a b"; exit 3'])
+    assert bad.returncode != 0 and 'unexpected EOF' in bad.stderr
+    assert good.returncode == 3 and good.stdout == 'a b'
+
+
+def test_timeout_kills_command_only():
+    async def main():
+        pool = ShellPool(['/bin/bash', '--noprofile', '--norc'])
+        try:
+            with pytest.raises(ProcessTimeout):
+                await pool.run('sleep 30', timeout=0.5)
+            return await pool.run('echo alive')
+        finally:
+            await pool.close()
+    assert asyncio.run(main()).stdout == 'alive'
@@ -0,0 +1,130 @@
+'''Chunked STL uploads: resume, dedup through the store, seek replies and
+connections taking an upload over.'''
+import os
+import sys
+import json
+import asyncio
+import hashlib
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+import stlUpload
+from stlUpload import receive_upload, HEADER, MAGIC, UPLOAD_DIR
+
+DATA = os.urandom(300000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class Closed(Exception):
+    pass
+
+
+class Client:
+    '''Fake websocket: recv() hands out the queued frames, then the connection drops.'''
+    def __init__(self, frames=(), hold=None, gate=None):
+        self.frames = list(frames)
+        self.sent = []
+        self.hold = hold
+        self.gate = gate
+
+    async def send(self, text):
+        self.sent.append(json.loads(text))
+
+    async def recv(self):
+        if self.gate is not None:
+            await self.gate.wait()
+        if not self.frames:
+            if self.hold is not None:
+                await self.hold.wait()
+            raise Closed()
+        return self.frames.pop(0)
+
+
+def frame(offset, stop=None):
+    return HEADER.pack(MAGIC, offset) + DATA[offset:stop]
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    async def no_geometry(base_dir, case_dir, path):
+        return {}
+    monkeypatch.setattr(stlUpload, "geometry_reply", no_geometry)
+    stlUpload._uploads.clear()
+    case = tmp_path / 'case'
+    case.mkdir()
+    return str(tmp_path), str(case)
+
+
+def upload(client, dirs, **para):
+    async def main():
+        try:
+            await receive_upload(client, {"para": {"fileName": "part.stl", **para}}, *dirs)
+        except Closed:
+            pass
+    asyncio.run(main())
+    return client.sent
+
+
+def test_resume_at_offset(dirs):
+    sent = upload(Client([frame(0, 100000)]), dirs, size=len(DATA))
+    uploadId = sent[0]["uploadId"]
+    assert stlUpload._uploads == {}
+    sent = upload(Client([frame(100000)]), dirs, uploadId=uploadId)
+    assert sent[0]["status"] == "ready" and sent[0]["offset"] == 100000
+    assert sent[-1]["status"] == "success" and sent[-1]["sha256"] == SHA256
+    with open(os.path.join(dirs[1], 'constant', 'geometry', 'part.stl'), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_seek_reply(dirs):
+    sent = upload(Client([frame(0, 1000), frame(5000), frame(1000)]), dirs, size=len(DATA))
+    seek = [m for m in sent if m["status"] == "seek"]
+    assert len(seek) == 1 and seek[0]["offset"] == 1000
+    assert sent[-1]["status"] == "success"
+
+
+def test_known_sha256_is_hardlinked(dirs):
+    upload(Client([frame(0)]), dirs, size=len(DATA))
+    sent = upload(Client(), dirs, fileName="copy.stl", size=len(DATA), sha256=SHA256)
+    assert sent == [{**sent[0], "status": "success", "deduplicated": True}]
+    geometry = os.path.join(dirs[1], 'constant', 'geometry')
+    stored = os.path.join(dirs[0], '.geometry', f'{SHA256}.stl')
+    assert os.path.samefile(os.path.join(geometry, 'copy.stl'), stored)
+    assert os.path.samefile(os.path.join(geometry, 'part.stl'), stored)
+
+
+def test_takeover_keeps_new_file_open(dirs):
+    async def main():
+        old = Client([frame(0, 100000)], hold=asyncio.Event())
+        oldRun = asyncio.ensure_future(receive_upload(old, {"para": {"fileName": "part.stl",
+                                                                     "size": len(DATA)}}, *dirs))
+        while not old.sent or stlUpload._uploads[old.sent[0]["uploadId"]].offset < 100000:
+            await asyncio.sleep(0.01)
+        new = Client([frame(100000)], gate=asyncio.Event())
+        newRun = asyncio.ensure_future(receive_upload(new, {"para": {"fileName": "part.stl",
+                                                                     "uploadId": old.sent[0]["uploadId"]}},
+                                                      *dirs))
+        while not new.sent:
+            await asyncio.sleep(0.01)
+        # the half open connection only notices after the resume took over,
+        # the new one receives its frames after that
+        old.hold.set()
+        await asyncio.gather(oldRun, return_exceptions=True)
+        new.gate.set()
+        await newRun
+        return new.sent
+    sent = asyncio.run(main())
+    assert sent[0]["offset"] == 100000
+    assert sent[-1]["status"] == "success"
+    assert stlUpload._uploads == {}
+
+
+def test_paused_upload_is_pruned(dirs):
+    sent = upload(Client([frame(0, 1000), "pause"]), dirs, size=len(DATA))
+    assert sent[-1]["status"] == "paused"
+    assert stlUpload._uploads == {}
+    store = os.path.join(dirs[0], '.geometry')
+    stlUpload.prune_uploads(store, ttl=-1)
+    assert os.listdir(os.path.join(store, UPLOAD_DIR)) == []
@@ -4,6 +4,11 @@ import numpy as np
 from copy import deepcopy
 import sys
 import json
+import uuid
+import hashlib
+import marshal
+import functools
+from blockModel import BlockModel, ModelError, get_model, put_model
 # import pyvista as pv
 
 header = r'''
@@ -23,6 +28,44 @@ FoamFile
 }
 // * * * * * * * * * * * * * modified by simonmesh * * * * * * * * * * * * * //
 '''
+footer = '// ************************************************************************* //\n'
+
+
+@functools.lru_cache(maxsize=None)
+def foam_header(objName, className="dictionary", location=None):
+    '''The FoamFile header for a file, built once per (object, class, location).'''
+    text = header.replace('class       dictionary;', f'class       {className};')
+    if location is not None:
+        text = text.replace('    object', f'    location    "{location}";\n    object')
+    return text.replace('object      DICT;', f'object      {objName};')
+
+
+def foam_value(value):
+    '''A Python value as an OpenFOAM dictionary value.'''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return '(' + ' '.join([foam_value(v) for v in value]) + ')'
+    return str(value)
+
+
+def foam_entries(entries, indent=1):
+    '''Keyword entries of a (nested) dict, sub dicts as blocks.'''
+    pad = '\t' * indent
+    res_ = []
+    for key, value in entries.items():
+        if isinstance(value, dict):
+            res_.append(f'{pad}{key}\n{pad}{{\n' + foam_entries(value, indent + 1) + f'{pad}}}\n')
+        else:
+            res_.append(f'{pad}{key}\t{foam_value(value)};\n')
+    return ''.join(res_)
+
+
+def field_value(value):
+    '''A field value: ["uniform", [1, 0, 0]] as uniform (1 0 0), anything else as foam_value.'''
+    if isinstance(value, (list, tuple)) and len(value) == 2 and value[0] in ('uniform', 'nonuniform'):
+        return f'{value[0]} {foam_value(value[1])}'
+    return foam_value(value)
 
 
 class ToBoundary:
@@ -31,20 +74,20 @@ class ToBoundary:
         self.res = ""
         
     def genBCFile(self, className, objName, varUnit, fieldType, fieldValue, bcList):
+        self.render(className, objName, varUnit, fieldType, fieldValue, bcList)
+        return write_if_changed(self.boundaryName, self.res)
+
+    def render(self, className, objName, varUnit, fieldType, fieldValue, bcList):
+        self.res = ""
         self.assignHeader(className, objName)
         self.assignUnit(varUnit)
         self.assignInternalField(fieldType, fieldValue)
         self.assignBoundaryField(bcList)
         self.res += "//*************modified by sim.on.mesh********** //*\n"
-
-        with open(self.boundaryName, "w") as f:
-            f.write(self.res)
+        return self.res
         
     def assignHeader(self, className, objName):
-        global header
-        local_header = re.sub(r'\bclass\s+dictionary\b', f'class    \t{className}', header)
-        local_header = re.sub(r'\bobject\s+\w+\b', f'object    \t{objName}', local_header)
-        self.res += local_header + '\n'
+        self.res += foam_header(objName, className, "0") + '\n'
         
     def assignUnit(self, varUnit):
         self.res += 'dimensions\t[' + ' '.join([str(k) for k in varUnit]) + '];\n';
@@ -74,56 +117,133 @@ class ToBoundary:
         if len(bcInfo) == 0:
             res += '\t}\n'
             return res
-        bcInfo = bcInfo[0]
+        bcInfo = dict(bcInfo[0])
+        # "value": "uniform" and "data": [1, 0, 0] make value uniform (1 0 0)
+        data = bcInfo.pop("data", None)
+        if data is not None:
+            data = foam_value(data) if len(data) > 1 else foam_value(data[0])
+            bcInfo["value"] = f'{bcInfo.get("value", "uniform")} {data}'
         for k, v in bcInfo.items():
-            if k == "data":
-                res += f'\t\t'
-                if len(v) > 1:
-                    res += '('
-                    res += ' '.join([str(j) for j in v])
-                    res += ');\n'
-                else:
-                    res += f'\t\t{v[0]};\n'
-            else:
-                res += f'\t\t{k}\t{v}'
+            res += f'\t\t{k}\t{field_value(v)};\n'
 
         res += '\t}\n'
                     
         return res
         
+# Rendered blockMeshDict sections per output file: {fileName: {section: (fingerprint, text)}}
+# Only sections whose input slice changed are rendered again.
+_sectionCache = {}
+
+def fingerprint(data):
+    # marshal is an order of magnitude faster than json.dumps on float lists,
+    # and fingerprints never leave this process
+    return hashlib.blake2b(marshal.dumps(data), digest_size=16).digest()
+
+def write_if_changed(fileName, text):
+    '''Write text to fileName unless the file already holds exactly these bytes.
+
+    An unchanged file keeps its mtime (runTimeModifiable and the mesh cache
+    see no change); a changed one is replaced atomically, OpenFOAM never
+    reads half a file.
+    '''
+    data = text.encode()
+    try:
+        if os.path.getsize(fileName) == len(data):
+            with open(fileName, "rb") as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+    tmp = f'{fileName}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, fileName)
+    return True
+
+class MeshJSON:
+    '''Mesh object stand-in holding just the JSON text, for the case workers.'''
+    def __init__(self, text):
+        self.text = text
+
+    def getObj(self):
+        return self.text
+
+def render_mesh_dict(meshText, fileName, delta=None, version=None):
+    '''Render and write a blockMeshDict from the mesh JSON text (runs in a case worker).
+
+    The worker keeps the BlockModel of every file it rendered: with a
+    delta (and no text) that model is updated in place instead. Returns
+    (digest of the dictionary text, geometry entries), so the rendered
+    text itself never has to leave the worker, or None when a delta can't
+    be applied and the full text is needed.
+    '''
+    model = get_model(fileName)
+    if meshText is None:
+        if model is None:
+            return None
+        try:
+            model.apply(delta)
+        except ModelError as e:
+            print("model delta rejected, asking for the full model: ", e)
+            put_model(fileName, None)
+            return None
+    else:
+        model = put_model(fileName, BlockModel.from_json(meshText, version).succeed(model))
+    blockMeshDict = ToMeshDICT(model, fileName)
+    blockMeshDict.write()
+    digest = hashlib.blake2b(blockMeshDict.res.encode(), digest_size=16).hexdigest()
+    return digest, blockMeshDict.obj.get('geometry')
+
 class ToMeshDICT:
     def __init__(self, mesh, fileName="sample/system/blockMeshDict"):
-        self.obj = json.loads(mesh.getObj())
+        # a BlockModel renders its bulky sections from arrays, a mesh object
+        # (getObj() JSON) goes through the dicts
+        self.model = mesh if isinstance(mesh, BlockModel) else None
+        self.obj = self.model.obj if self.model is not None else json.loads(mesh.getObj())
         self.filename = fileName
         self.num2Node_ = {}
-
-        res = ""
-        res += self.genHeader()
-        res += self.genPrescale()
-        res += self.genTransform()
-        res += self.genGeometry()
-        res += self.genVertices()
-        res += self.genBlocks()
-        res += self.genEdges()
-        res += self.genFaces()
-        res += self.genDefaultPatch()
-        res += self.genBoundary()
-        res += '// ************************************************************************* //\n'
-        self.res = res
+        self.sections = _sectionCache.setdefault(fileName, {})
+        self.dirty = []
+
+        obj = self.obj
+        res = [
+            self.genSection('header', None, self.genHeader),
+            self.genSection('prescale', obj.get('prescale'), self.genPrescale),
+            self.genSection('transform', obj.get('transform'), self.genTransform),
+            self.genSection('geometry', obj.get('geometry'), self.genGeometry),
+            self.genArraySection('vertices', 'vertices', self.genVertices),
+            self.genArraySection('blocks', 'blocks', self.genBlocks),
+            self.genArraySection('edges', 'edges', self.genEdges),
+            self.genSection('faces', obj.get('faces'), self.genFaces),
+            self.genSection('defaultPatch', obj.get('defaultPatch'), self.genDefaultPatch),
+            self.genArraySection('boundary', 'boundaries', self.genBoundary),
+            '// ************************************************************************* //\n',
+        ]
+        self.res = ''.join(res)
+
+    def genArraySection(self, name, key, render):
+        if self.model is None or key in self.obj:
+            return self.genSection(name, self.obj.get(key), render)
+        # the model's change counter stands in for the data fingerprint
+        return self.genSection(name, self.model.fingerprint(key), getattr(self.model, f'render_{key}'))
         
+    def genSection(self, name, data, render):
+        fp = fingerprint(data)
+        cached = self.sections.get(name)
+        if cached is not None and cached[0] == fp:
+            return cached[1]
+        text = render()
+        self.sections[name] = (fp, text)
+        self.dirty.append(name)
+        return text
+
     def write(self):
-        print('writeblockMeshDict: ', self.filename)
-        with open(self.filename, "w") as f:
-            f.write(self.res)
+        print('writeblockMeshDict: ', self.filename, 'rendered: ', self.dirty)
+        return write_if_changed(self.filename, self.res)
         
 
     def genHeader(self):
-        nHeader = header.replace("DICT", "blockMeshDict")
-        return nHeader
-    
-    def genPrescale(self):
-        res_ = 'prescale (' + ' '.join([str(k) for k in self.obj['prescale']]) + ');\n'
-        return res_
+        return foam_header("blockMeshDict")
 
     def genPrescale(self):
         print('genPrescale: ', self.obj['prescale'])
@@ -133,162 +253,111 @@ class ToMeshDICT:
     def genTransform(self):
         if self.obj.get('transform') == None or len(self.obj['transform']) == 0:
             return '\n'
-        res_ = 'transform\n{\n'
+        res_ = ['transform\n{\n']
         
         for k, v in self.obj['transform'].items():
             if isinstance(v, list):
                 v = [str(k) for k in v] 
-                res_ += k + '    (' + ' '.join(v) + ');\n'
+                res_.append(k + '    (' + ' '.join(v) + ');\n')
             else:
-                res_ += k + '    ' + str(v) + ';\n'
-        res_ += '}\n'
-        return res_
+                res_.append(k + '    ' + str(v) + ';\n')
+        res_.append('}\n')
+        return ''.join(res_)
         
     def genGeometry(self):
         if self.obj.get('geometry') == None or len(self.obj['geometry']) == 0:
             return '\n'
-        res_ = 'geometry \n{\n'
+        res_ = ['geometry \n{\n']
 
         for k in self.obj['geometry']:
-            '''
-            res_ += '\t' + k + '\n'
-            res_ += '\t{\n'
-            for k_, v_ in self.obj['geometry'][k].items():   
-                if isinstance(v_, list):
-                    v_ = [str(j) for j in v_]
-                    res_ += '\t\t' + k_ + '   (' + ' '.join(v_) + ');\n'
-                else:
-                    if k_ == 'type':
-                        res_ += '\t\t' + k_ + '\t' + str(v_) + ';\n'
-                    elif k_ == 'info':
-                        for k__, v__ in v_.items():
-                            strV__ = '(' + ' '.join([str(j) for j in v__]) + ')' if isinstance(v__, list)  else str(v__)
-                            if k__ == 'file':
-                                strV__ = '"' + strV__ + '"'
-                            res_ += '\t\t' + k__ + '\t' + strV__ + ';\n' 
-            res_ += '\t}\n'
-            '''
-            
             name_ = k["name"]
             type_ = k["type"]
             info_ = k["info"]
             print(name_, type_, info_)
-            res_ += '\t' + name_ + '\n'
-            res_ += '\t{\n'
-            res_ += '\t\ttype\t' + type_ + ';\n'
-            res_ += '\t\tfile\t' + name_ + '.stl;\n'
-            res_ += '\t}\n'
-            res_ += '\n'
+            res_.append('\t' + name_ + '\n'
+                        '\t{\n'
+                        '\t\ttype\t' + type_ + ';\n'
+                        '\t\tfile\t' + name_ + '.stl;\n'
+                        '\t}\n'
+                        '\n')
             
-        res_ += '}\n'
-        return res_
+        res_.append('}\n')
+        return ''.join(res_)
 
     def genVertices(self):
-        res_ = 'vertices\n(\n'
-        for i, k_ in enumerate(self.obj['vertices']):
-            res_ += '\t'
-            
+        res_ = ['vertices\n(\n']
+        for k_ in self.obj['vertices']:
+            xyz_ = ' '.join([str(j) for j in k_.get('xyz')])
             if k_.get('project'):
-                res_ += 'project (' + ' '.join([str(j) for j in k_.get('xyz')]) + ') (' + ' '.join(k_.get('project')) + ')\n'
+                res_.append('\tproject (' + xyz_ + ') (' + ' '.join(k_.get('project')) + ')\n')
             else:
-                res_ += '(' + ' '.join([str(j) for j in k_.get('xyz')]) + ')\n'
-        res_ += ');\n'
-        return res_
+                res_.append('\t(' + xyz_ + ')\n')
+        res_.append(');\n')
+        return ''.join(res_)
+
+    def genGrading(self, grading):
+        res_ = []
+        for j in grading:
+            if len(j) == 1:
+                res_.append(str(*j[0]))
+            else:
+                res_.append('(' + ' '.join(['(' + ' '.join([str(z[1]), str(z[0]), str(z[2])]) + ')' for z in j]) + ')')
+        return ' '.join(res_)
 
     def genBlocks(self):
-        res_ = 'blocks\n(\n'
-        for i, b_ in enumerate(self.obj['blocks']):
-            res_ += '\t'
-            res_ += 'hex ('
-            hex_ = []
-            for n in b_.get('hex'):
-                hex_.append(str(n))
-            res_ += ' '.join(hex_)
-            res_ += ') ('
-            res_ += ' '.join([str(int(j)) for j in b_.get('number')])
-            res_ += ') grading ('
-            # res_ += ' '.join([str(j) for j in b_.get('grading')])
-            # print('b_', b_.get("grading"))
-            for j in b_.get("grading"):
-                if len(j) == 1:
-                    res_ += str(*j[0]) + ' '
-                else:
-                    res_ += '('
-                    for z in j:
-                        rZ = [z[1], z[0], z[2]]
-                        res_ += '('
-                        res_ += ' '.join([str(c_) for c_ in rZ])
-                        res_ += ') '
-                    if res_[-1] == ' ':
-                        res_ = res_[:-1]
-                    res_ += ') '
-            if res_[-1] == ' ':
-                res_ = res_[:-1]
-            res_ += ')\n'
-        res_ += ');\n'
-        return res_
+        res_ = ['blocks\n(\n']
+        for b_ in self.obj['blocks']:
+            res_.append('\thex (' + ' '.join([str(n) for n in b_.get('hex')])
+                        + ') (' + ' '.join([str(int(j)) for j in b_.get('number')])
+                        + ') grading (' + self.genGrading(b_.get('grading')) + ')\n')
+        res_.append(');\n')
+        return ''.join(res_)
     
     def genEdges(self):
-        print('edge', self.obj['edges'])
-        res_ = 'edges\n(\n'
+        print('edge', len(self.obj['edges']))
+        res_ = ['edges\n(\n']
         for e_ in self.obj['edges']:
-
-            res_ += '\t' + e_['type'] + ' '
-            res_ += ' '.join([str(int(z)) for z in e_['vertices']])
-            res_ += '\n\t(\n'
+            res_.append('\t' + e_['type'] + ' ' + ' '.join([str(int(z)) for z in e_['vertices']]) + '\n\t(\n')
             for s_ in e_['points']:
-                res_ += '\t('
-                res_ += ' '.join([str(z) for z in s_])
-                res_ += ')\n'
-            res_ += '\t)\n'
+                res_.append('\t(' + ' '.join([str(z) for z in s_]) + ')\n')
+            res_.append('\t)\n')
 
-        res_ += ');\n'
-        return res_
+        res_.append(');\n')
+        return ''.join(res_)
 
     def genFaces(self):
 
         if self.obj.get('faces') == None or len(self.obj.get('faces')) == 0:
             return '\n'
-        res_ = 'faces\n(\n'
+        res_ = ['faces\n(\n']
         for f_ in self.obj['faces']:
-            res_ += '\tproject ('
-            res_ += ' '.join([str(z) for z in f_['indices']])
-            res_ += ') ' + f_['project'] + '\n'    
-        res_ += ');\n'
-        return res_
+            res_.append('\tproject (' + ' '.join([str(z) for z in f_['indices']]) + ') ' + f_['project'] + '\n')
+        res_.append(');\n')
+        return ''.join(res_)
     
     def genDefaultPatch(self):
-        res_ = 'defaultPatch\n{\n'
+        res_ = ['defaultPatch\n{\n']
         for k_, v_ in self.obj['defaultPatch'].items():
-            res_ += '\t' + k_ + ' ' + v_ + ';\n'
-        res_ += '}\n'
-        return res_
+            res_.append('\t' + k_ + ' ' + v_ + ';\n')
+        res_.append('}\n')
+        return ''.join(res_)
     
     def genBoundary(self):
-        print('genBoundary: ', self.obj['boundaries'])
         if self.obj.get('boundaries') == None or len(self.obj['boundaries']) == 0:
             return '\n'
+        print('genBoundary: ', len(self.obj['boundaries']))
 
-        res_ = 'boundary\n(\n'
+        res_ = ['boundary\n(\n']
         for b_ in self.obj['boundaries']:
-            print('patch: ', b_)
-            name_ = b_["name"]
-            res_ += '\t'+ name_ + '\n\t{\n'
-            res_ += '\t\t' + 'type' + '\t' + b_["type"] + ';\n'
-            res_ += '\t\t' + 'faces' + '\t('
-
-            for j_ in b_["faces"]:
-                res_ += '('
-                res_ += ' '.join(str(z) for z in j_)
-                res_ += ') '
-            if res_[-1] == ' ':
-                res_ = res_[:-1]
-            res_ += ');\n'
-            res_ += '\n\t}\n'
+            faces_ = ' '.join(['(' + ' '.join(str(z) for z in j_) + ')' for j_ in b_["faces"]])
+            res_.append('\t' + b_["name"] + '\n\t{\n'
+                        '\t\t' + 'type' + '\t' + b_["type"] + ';\n'
+                        '\t\t' + 'faces' + '\t(' + faces_ + ');\n'
+                        '\n\t}\n')
         
-        res_ += ');\n'
+        res_.append(');\n')
         
-        return res_
+        return ''.join(res_)
     '''
     def toPyVista(self):
         points = [v["xyz"] for v in self.obj["vertices"]]  
@@ -309,63 +378,84 @@ class ToMeshDICT:
         return points, cells, bone_grid, vertex_label
     '''
     
+# writeFormat values OpenFOAM accepts; binary meshes are read back memory mapped
+WRITE_FORMATS = ("ascii", "binary")
+# controlDict entries in the order they are written, what a case gets
+# unless the case materializer set others (see caseMaterializer)
+CONTROL_DEFAULTS = {
+    "application": "blockMesh",
+    "startFrom": "startTime",
+    "startTime": 0,
+    "stopAt": "endTime",
+    "endTime": 1000,
+    "deltaT": 1,
+    "writeControl": "timeStep",
+    "writeInterval": 1,
+    "purgeWrite": 0,
+    "writeFormat": "ascii",
+    "writePrecision": 6,
+    "writeCompression": "off",
+    "timeFormat": "general",
+    "timePrecision": 6,
+    "runTimeModifiable": "true",
+}
+# controlDict entries that change how blockMesh writes the mesh
+MESH_CONTROLS = ("writeFormat", "writeCompression", "writePrecision")
+
 class ToControlDICT:
-    def __init__(self, filename="sample/system/controlDict"):
+    def __init__(self, filename="sample/system/controlDict", writeFormat="ascii", writeCompression="off",
+                 entries=None):
         self.filename = filename
-        # self.genDict()
-        res = ''
-        res += header.replace("DICT", "controlDict")
-        res += 'application     blockMesh;\n'
-        res += 'startFrom       startTime;\n'
-        res += 'startTime       0;\n'
-        res += 'stopAt          endTime;\n'
-        res += 'endTime         1000;\n'
-        res += 'deltaT          1;\n'
-        res += 'writeControl    timeStep;\n'
-        res += 'writeInterval   1;\n'
-        res += 'purgeWrite      0;\n'
-        res += 'writeFormat     ascii;\n'
-        res += 'writePrecision  6;\n'
-        res += 'writeCompression off;\n'
-        res += 'timeFormat      general;\n'
-        res += 'timePrecision   6;\n'
-        res += 'runTimeModifiable true;\n'
-        res += '// ************************************************************************* //\n'
-        self.res = res
-        
-    def genDict(self):
-        res += ''
-        
+        if writeFormat not in WRITE_FORMATS:
+            raise ValueError(f'writeFormat must be one of {WRITE_FORMATS}: {writeFormat}')
+        if writeCompression in (True, False):
+            writeCompression = "on" if writeCompression else "off"
+        self.writeFormat = writeFormat
+        self.writeCompression = writeCompression
+        self.entries = {**CONTROL_DEFAULTS, **(entries or {}),
+                        "writeFormat": writeFormat, "writeCompression": writeCompression}
+        res = [foam_header("controlDict")]
+        for key, value in self.entries.items():
+            if isinstance(value, dict):
+                res.append(f'{key}\n{{\n' + foam_entries(value) + '}\n')
+            else:
+                res.append(f'{key:<15} {foam_value(value)};\n')
+        res.append(footer)
+        self.res = ''.join(res)
+
+    def meshKey(self):
+        '''The part of the controlDict the mesh depends on, for the mesh cache key.'''
+        return ' '.join([str(self.entries[key]) for key in MESH_CONTROLS])
+
     def write(self):
         print('blockMeshDict: ', self.filename)
-        with open(self.filename, "w") as f:
-            f.write(self.res)
+        return write_if_changed(self.filename, self.res)
         
 class ToMaterial:
     def __init__(self, filename="constant/transportProperties"):
         self.filename = filename
         self.res = ''
     
-    def genDict(self):
+    def genDict(self, modelType="Newtonian", nu=0.001, unit=(0, 2, -1, 0, 0, 0, 0)):
+        self.render(modelType, nu, unit)
+        return write_if_changed(self.filename, self.res)
+
+    def render(self, modelType="Newtonian", nu=0.001, unit=(0, 2, -1, 0, 0, 0, 0)):
+        self.res = ''
         self.genHeader()
-        self.genModel()
-        self.genNu()
+        self.genModel(modelType)
+        self.genNu(nu, unit)
         self.res += '// **********************modified by simonmesh ********************* //\n'
-    
-        with open(self.filename, "w") as f:
-            f.write(self.res)
-
+        return self.res
 
     def genHeader(self, objName = "transportProperties"):
-        global header
-        # local_header = re.sub(r'\bclass\s+dictionary\b', f'class    \t{className}', header)
-        local_header = re.sub(r'\bobject\s+\w+\b', f'object    \t{objName}', local_header)
+        self.res += foam_header(objName, location="constant") + '\n'
 
     def genModel(self, modelType = "Newtonian"):
         self.res += f'transportModel\t{modelType};\n'
     
     def genNu(self, nu = 0.001, unit = [0, 2, -1, 0, 0, 0, 0]):
-        self.res += f'nu\t{nu};\n'
+        self.res += f'nu\t[{" ".join([str(k) for k in unit])}] {nu};\n'
 
 class ToModel:
     def __init__(self, filename="constant/turbulenceProperties"):
@@ -373,12 +463,12 @@ class ToModel:
         self.res = ''
 
     def genHeader(self, objName = "turbulenceProperties"):
-        global header
-        # local_header = re.sub(r'\bclass\s+dictionary\b', f'class    \t{className}', header)
-        local_header = re.sub(r'\bobject\s+\w+\b', f'object    \t{objName}', local_header)
-        self.res += local_header + '\n'
+        self.res += foam_header(objName, location="constant") + '\n'
 
     def genModel(self, modelType = "kEpsilon"):
+        if modelType == "laminar":
+            self.res += 'simulationType\t' + 'laminar' + ';\n'
+            return
         self.res += 'simulationType\t' + 'RAS' + ';\n'
         self.res += 'RAS\n{\n'
         self.res += '\t' + 'RASModel\t' + modelType + ';\n'
@@ -386,36 +476,43 @@ class ToModel:
         self.res += '\t' + 'printCoeffs\t' + 'on' + ';\n'
         self.res += '}\n'
 
-    def genDict(self):
+    def genDict(self, modelType="kEpsilon"):
+        self.render(modelType)
+        return write_if_changed(self.filename, self.res)
+
+    def render(self, modelType="kEpsilon"):
+        self.res = ''
         self.genHeader()
-        self.genModel()
+        self.genModel(modelType)
         self.res += '// **********************modified by simonmesh ********************* //\n'
-        with open(self.filename, "w") as f:
-            f.write(self.res)
+        return self.res
 
 class ToSchemes:
     def __init__(self, filename="system/fvSchemes"):
         self.filename = filename
         self.res = ''
 
-    def genDict(self):
+    def genDict(self, schemes=None):
+        self.render(schemes)
+        return write_if_changed(self.filename, self.res)
+
+    def render(self, schemes=None):
+        '''schemes overrides the defaults by name: ddt, grad, div, laplacian, interpolation, snGrad, wallDist.'''
+        schemes = schemes or {}
+        self.res = ''
         self.genHeader()
-        self.genDDT()
-        self.gradScheme()
-        self.divScheme()
-        self.laplacianScheme()
-        self.interpolationScheme()
-        self.snGradScheme()
-        self.wallDist()
+        self.genDDT(schemes.get("ddt", "Euler"))
+        self.gradScheme(schemes.get("grad", "Gauss linear"))
+        self.divScheme(schemes.get("div", "Gauss linear"))
+        self.laplacianScheme(schemes.get("laplacian", "Gauss linear corrected"))
+        self.interpolationScheme(schemes.get("interpolation", "linear"))
+        self.snGradScheme(schemes.get("snGrad", "corrected"))
+        self.wallDist(schemes.get("wallDist", "meshWave"))
         self.res += '// **********************modified by simonmesh ********************* //\n'
-        with open(self.filename, "w") as f:
-            f.write(self.res)
+        return self.res
 
     def genHeader(self, objName = "fvSchemes"):
-        global header
-        # local_header = re.sub(r'\bclass\s+dictionary\b', f'class    \t{className}', header)
-        local_header = re.sub(r'\bobject\s+\w+\b', f'object    \t{objName}', local_header)
-        self.res += local_header + '\n'
+        self.res += foam_header(objName, location="system") + '\n'
 
     def genDDT(self, ddtScheme = "Euler"):
         self.res += 'ddtSchemes\n{\n'
@@ -457,11 +554,23 @@ class ToSolution:
         self.fileName = fileName
         self.res = ''
 
+    def genDict(self, solvers, algorithm="SIMPLE", algorithmInfo=None, relaxation=None):
+        self.render(solvers, algorithm, algorithmInfo, relaxation)
+        return write_if_changed(self.fileName, self.res)
+
+    def render(self, solvers, algorithm="SIMPLE", algorithmInfo=None, relaxation=None):
+        '''solvers maps field names (or regular expressions like "(U|k|epsilon)") to solver settings.'''
+        self.res = ''
+        self.genHeader()
+        self.genSolvers([self.genVarSolver(name, info) for name, info in solvers.items()])
+        self.res += algorithm + '\n{\n' + foam_entries(algorithmInfo or {}) + '}\n'
+        if relaxation:
+            self.res += 'relaxationFactors\n{\n' + foam_entries(relaxation) + '}\n'
+        self.res += '// **********************modified by simonmesh ********************* //\n'
+        return self.res
+
     def genHeader(self, objName = "fvSolution"):
-        global header
-        # local_header = re.sub(r'\bclass\s+dictionary\b', f'class    \t{className}', header)
-        local_header = re.sub(r'\bobject\s+\w+\b', f'object    \t{objName}', local_header)
-        self.res += local_header + '\n'
+        self.res += foam_header(objName, location="system") + '\n'
 
     def genSolvers(self, solvers):
         self.res += 'solvers\n{\n'
@@ -470,4 +579,7 @@ class ToSolution:
         self.res += '}\n'
 
     def genVarSolver(self, varName, varInfo):
-        return
\ No newline at end of file
+        '''One solvers entry, e.g. ("p", {"solver": "GAMG", "tolerance": 1e-6, "relTol": 0.1}).'''
+        # genSolvers indents the first line and ends the last
+        name = f'"{varName}"' if any(c in varName for c in '(|*.') else varName
+        return name + '\n\t{\n' + foam_entries(varInfo, 2) + '\t}'
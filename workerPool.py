@@ -0,0 +1,64 @@
+import os
+import zlib
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Worker processes for the CPU bound stages of a request: decoding the mesh
+# JSON and rendering blockMeshDict, parsing boundary files, writing patch
+# VTKs and parsing solver logs. They run outside the event loop's process,
+# so one heavy case neither blocks other clients nor is held to one core.
+#
+# Every case is routed to the same worker, which keeps that worker's
+# per-process caches (rendered dictionary sections, parsed files, log
+# parser state) warm. Only small values cross the process boundary: the
+# mesh JSON text in, digests, patch paths and NumPy arrays out.
+
+# Number of worker processes, 0 runs the same functions in threads instead
+WORKERS = int(os.environ.get("SIMONMESH_WORKERS", min(os.cpu_count() or 1, 8)))
+
+_executors = {}
+
+
+def worker_slot(case_dir):
+    '''Index of the worker a case is routed to, stable across restarts.'''
+    return zlib.crc32(os.path.abspath(case_dir).encode()) % WORKERS
+
+
+def _executor(slot):
+    executor = _executors.get(slot)
+    if executor is None:
+        # spawn: forking the server would copy its event loop and threads
+        executor = _executors[slot] = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    return executor
+
+
+async def run_in_worker(case_dir, fn, *args):
+    '''Run fn(*args) in the worker of case_dir and return its result.
+
+    fn must be a module level function. A worker that died is replaced
+    and the call retried once.
+    '''
+    if WORKERS <= 0:
+        return await asyncio.to_thread(fn, *args)
+    slot = worker_slot(case_dir)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor(slot), fn, *args)
+    except BrokenProcessPool:
+        print(f"case worker {slot} died, restarting it")
+        _executors.pop(slot, None)
+        return await loop.run_in_executor(_executor(slot), fn, *args)
+
+
+def worker_stats():
+    return {"workers": WORKERS, "started": sorted(_executors)}
+
+
+def shutdown_workers():
+    executors = list(_executors.values())
+    _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)